@@ -1,6 +1,13 @@
 ﻿from streamlit_html_viewer.streamlit_html_viewer import streamlit_html_viewer as html_viewer
 from utils import *
 import streamlit as st
+import io, runpy
+
+# Profiled rerun: execute this script again inside the profiler, then stop
+if not globals().get("_PROFILED_RUN") and profile_requested("rerun"):
+    with profile_run("rerun"):
+        runpy.run_path(__file__, init_globals={"_PROFILED_RUN": True}, run_name="__main__")
+    st.stop()
 
 st.set_page_config(page_title="LLM-Based Text Editor")
 
@@ -37,10 +44,272 @@ def render_download_button():
         mime="text/plain"
     )
 
-if not st.session_state.get("_db_initialized"):
-    set_db()
-    st.session_state["_db_initialized"] = True
+# Fragments: widgets inside rerun only their own function, so a toggle click
+# or keystroke does not re-execute the whole page (st.rerun() still does).
+# The sidebar re-polls in-memory notification state, so new invites show up
+# without a refresh and without a query, and checkpoints the flow state
+@st.fragment(run_every=NOTIFY_REFRESH_SECONDS)
+def render_sidebar_notifications():
+    checkpoint_flow_state()
+    with st.expander("🔔 Notifications", expanded=False):
+        invites = notified_invites(st.session_state['name'])
+        if not invites:
+            st.write("No new invites.")
+        else:
+            for inv in invites:
+                ts = time.strftime(
+                    "%Y-%m-%d %H:%M",
+                    time.localtime(inv["requested_ts"])
+                )
+                st.write(f"📩 **{inv['title']}** from _{inv['inviter']}_ at {ts}")
+                col1, col2 = st.columns([1,1])
+                with col1:
+                    if st.button("Accept", key=f"accept_{inv['invite_id']}"):
+                        respond_invite(inv['invite_id'], True)
+                        st.rerun()
+                with col2:
+                    if st.button("Reject", key=f"reject_{inv['invite_id']}"):
+                        respond_invite(inv['invite_id'], False)
+                        st.rerun()
+
+    with st.expander("📁 Shared Documents", expanded=False):
+        files = notified_files(st.session_state['name'])
+        if not files:
+            st.write("No documents yet.")
+        else:
+            for f in files:
+                ts = time.strftime("%Y-%m-%d", time.localtime(f["created_ts"]))
+                if st.button(f"{f['title']}  ({ts})", key=f"file_{f['file_id']}"):
+                    st.session_state["current_file"] = f["file_id"]
+                    set_page("collab")
+
+@st.fragment
+def render_token_panel():
+    show_paid_user_metrics(st.session_state['client_id'])
+    token_input = st.number_input("Enter Tokens", min_value=1, step=1)
+
+    if st.button("Add Tokens"):
+        update_token(st.session_state['client_id'], token_input, 0)
+        st.rerun()
+
+@st.fragment
+def render_self_correction():
+    st.subheader("Self-Correction")
+    # Display highlighted incorrect words
+    if st.session_state.get("rendered_html"):
+        st.markdown("### Text with Incorrect Words Highlighted")
+        raw = st.session_state["rendered_html"]
+        st.markdown("Words in green contain grammatical errors. Edit them below.")
+        render_viewer(raw, height=255)
+
+    self_corrected = st.text_area(
+        "Edit your text below:",
+        value=st.session_state.get("self_corrected_text") or st.session_state["user_input"],
+        height=200,
+        key="self_corrected_area"
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Confirm Self-Correction", key="confirm_self_correction"):
+            if not st.session_state["user_input"]:
+                st.error("Original input is missing. Please submit text again.")
+                st.session_state["pending_self_correction"] = False
+                st.session_state["self_corrected_text"] = None
+                st.rerun()
+            elif self_corrected.strip():
+                words = len(st.session_state["user_input"].split())
+                with stage_span("confirm_self_correction", "pricing", words):
+                    tokens = self_correct_cost(st.session_state["user_input"], self_corrected)
+                    available, _ = get_token(st.session_state['client_id'])
+                if available >= tokens:
+                    # Checkpointed before the charge, so a resumed flow can't pay twice;
+                    # the edit is kept, as nothing else can rebuild it
+                    st.session_state["corrected_text"] = self_corrected
+                    st.session_state["can_download"] = True
+                    st.session_state["pending_self_correction"] = False
+                    st.session_state["self_corrected_text"] = self_corrected
+                    st.session_state["tokens"] = tokens
+                    st.session_state["rendered_html"] = None  # Clear highlighted text
+                    checkpoint_flow_state()
+                    with stage_span("confirm_self_correction", "tokens", words):
+                        update_token(st.session_state['client_id'], -tokens, tokens)
+                    with stage_span("confirm_self_correction", "submission", words):
+                        set_submission(
+                            st.session_state['client_id'],
+                            st.session_state["user_input"],
+                            self_corrected,
+                            1 if st.session_state["user_input"] != self_corrected else 0
+                        )
+                    st.success(f"💰 Deducted {tokens} tokens for self-correction.")
+                    st.rerun()
+                else:
+                    st.error(f"Not enough tokens. Required: {tokens}, Available: {available}")
+            else:
+                st.warning("Corrected text can't be empty.")
+    with col2:
+        if st.button("Cancel", key="cancel_self_correction"):
+            st.session_state["pending_self_correction"] = False
+            st.session_state["self_corrected_text"] = None
+            st.session_state["rendered_html"] = None  # Clear highlighted text
+            st.rerun()
+
+
+@st.fragment
+def render_corrected_viewer():
+    st.subheader("✅ Corrected Text")
+    raw = st.session_state["rendered_html"]
+    flipped = render_viewer(raw, height=255)
+    if flipped is not None:
+        st.session_state["toggles"] = flipped
+        st.session_state["corrected_text"] = apply_toggles(st.session_state["rendered_parts"], flipped)
+
+@st.fragment
+def render_collab_viewer(file_id):
+    st.subheader("✅ Agreed-Upon Text")
+    state     = collab_state(file_id)
+    flipped   = render_viewer(state.get("html", ""), height=400)
+    if flipped is not None:
+        state["clean"] = apply_toggles(state["parts"], flipped)
+
+# Shared editor: a committed edit (blur or Ctrl+Enter) is pushed as an
+# operation and collaborators' operations are merged back into the text area.
+# The timed reruns of this fragment never write the text area, since the
+# browser would drop whatever is being typed there; they only offer to merge
+# collaborators' changes. Long documents are edited COLLAB_WINDOW_CHUNKS
+# paragraphs at a time.
+@st.fragment(run_every=COLLAB_SYNC_SECONDS)
+def render_collab_editor(file_id):
+    state    = collab_state(file_id)
+    edit_key = f"collab_edit_{file_id}"
+    pull_key = f"collab_pull_{file_id}"
+    if "doc" not in state:
+        state["doc"] = load_file_window(file_id, 0, COLLAB_WINDOW_CHUNKS)
+    if edit_key not in st.session_state:
+        st.session_state[edit_key] = state["doc"]["text"]
+    doc = state["doc"]
+    if st.session_state[edit_key] != doc["text"] or st.session_state.pop(pull_key, False):
+        if sync_file(file_id, st.session_state['name'], doc, st.session_state[edit_key]):
+            st.session_state[edit_key] = doc["text"]
+    elif file_changed(file_id, doc):
+        st.info("Collaborators have changed this document.")
+        st.button("⬇️ Merge their changes", key=f"collab_merge_{file_id}",
+                  on_click=st.session_state.__setitem__, args=(pull_key, True))
+    if doc.get("unmerged") is not None:
+        st.warning("This document changed too much while you were away to merge your last edit. "
+                   "It has been reloaded; your text is below to re-apply.")
+        st.text_area("Your last edit", doc["unmerged"], height=150, disabled=True, key=f"collab_unmerged_{file_id}")
+        if st.button("Dismiss", key=f"collab_dismiss_{file_id}"):
+            doc.pop("unmerged")
+            st.rerun(scope="fragment")
+    checkpoint_flow_state()
+
+    st.subheader("🖋️ Original")
+    if doc["chunks"] > COLLAB_WINDOW_CHUNKS:
+        first = st.number_input(
+            f"First paragraph (of {doc['chunks']})", min_value=1, max_value=doc["chunks"],
+            value=doc["first"] + 1, step=COLLAB_WINDOW_CHUNKS, key=f"collab_first_{file_id}"
+        ) - 1
+        if first != doc["first"]:
+            doc = load_file_window(file_id, first, COLLAB_WINDOW_CHUNKS)
+            state["doc"] = doc
+            st.session_state[edit_key] = doc["text"]
+    new_orig = st.text_area(
+        label="", height=400, key=edit_key,
+        label_visibility="collapsed",
+        placeholder=""
+    )
+    st.caption(f"Version {doc['version']}")
+    if st.button("🔄 Submit for correction"):
+        state["orig"] = new_orig
+        correct_document(file_id, new_orig)
+        state["html"]  = st.session_state["rendered_html"]
+        state["parts"] = st.session_state["rendered_parts"]
+        state["clean"] = st.session_state["corrected_text"]
+        st.rerun()
+
+# The whole document is only assembled here, on request, streamed chunk by
+# chunk into one encoded buffer rather than built up as a string first
+@st.fragment
+def render_document_download(file_id):
+    if st.button("📦 Prepare full document", key=f"prepare_{file_id}"):
+        buf = io.BytesIO()
+        for piece in iter_file_text(file_id):
+            buf.write(piece.encode("utf-8"))
+        st.download_button(
+            label="📥 Download document",
+            data=buf,
+            file_name=f"document_{file_id}.txt",
+            mime="text/plain",
+            key=f"download_{file_id}"
+        )
+
+# Super-user debug panel: statements per run of this session (newest first)
+# and per page across all sessions, with repeated and N+1-shaped statements flagged
+def render_query_profile():
+    with st.sidebar.expander("🛠 Query Profile", expanded=False):
+        if DB_PROFILE:
+            st.caption("Profiling every session (DB_PROFILE=1).")
+        else:
+            st.checkbox("Profile my queries", key="_db_profile")
+        runs = recent_query_runs()
+        if not runs:
+            st.write("No queries recorded yet.")
+        else:
+            labels = [
+                f"{time.strftime('%H:%M:%S', time.localtime(r.started))} {r.page}"
+                f"{' (fragment)' if r.fragment else ''}{' (this run, so far)' if current else ''}: "
+                f"{r.count} queries, {r.seconds * 1000:.1f} ms, {r.flagged} flagged"
+                for r, current in runs
+            ]
+            i = st.selectbox("Run", range(len(runs)), format_func=lambda i: labels[i], key="_query_run_pick")
+            st.dataframe(runs[i][0].rows(), hide_index=True)
+        replicas = get_replicas()
+        if replicas is not None:
+            st.markdown("**Read replicas**")
+            st.dataframe(replicas.status(), hide_index=True)
+        st.markdown("**By page, all sessions**")
+        st.dataframe(page_profile.rows()[:50], hide_index=True)
+        if st.button("Reset page totals", key="_query_profile_reset"):
+            page_profile.clear()
+
+# Super-user view of session-state size per live session of this process
+def render_session_memory():
+    with st.sidebar.expander("🧠 Session Memory", expanded=False):
+        rows = session_memory.rows()
+        total = sum(r["bytes"] for r in rows)
+        st.caption(f"{len(rows)} sessions, {total / 2**20:.1f} MiB of session state "
+                   f"(budget {SESSION_BUDGET_BYTES / 2**20:.0f} MiB per session).")
+        st.dataframe([
+            {"session": r["session"], "user": r["user"], "page": r["page"],
+             "MiB": round(r["bytes"] / 2**20, 2), "largest key": r["largest"],
+             "collab files": r["collab_files"], "spilled": r["spilled"],
+             "over budget": r["over_budget"],
+             "seen": time.strftime("%H:%M:%S", time.localtime(r["seen"]))}
+            for r in rows
+        ], hide_index=True)
+
+# Super-user list of the latest profile reports (see PROFILE_MODE in utils)
+def render_profiles():
+    with st.sidebar.expander("🔬 Profiles", expanded=False):
+        paths = list_profiles(PROFILE_DIR)
+        if not paths:
+            st.write("No profiles yet.")
+        for path in paths:
+            with open(path, "rb") as f:
+                st.download_button(os.path.basename(path), f.read(), file_name=os.path.basename(path),
+                                   mime="text/plain", key=f"profile_{path}")
+        st.caption(f"cProfile dumps (.prof) are next to the reports in {os.path.abspath(PROFILE_DIR)}")
+
+ensure_db()
+start_metrics_export()
+start_partition_maintenance()
+checkpoint_flow_state()
 page = get_page()
+enforce_session_budget(st.session_state.get("current_file") if page == "collab" else None)
+if st.session_state.get("type") == "S":
+    render_query_profile()
+    render_profiles()
+    render_session_memory()
 
 if page == "login":
     st.title("Login")
@@ -64,11 +333,12 @@ if page == "login":
                     st.error(f"You have been timed out for {remaining:.0f}s")
                     st.stop()
 
-            # at this point, login OK
+            # at this point, login OK; resume this tab's flow if it is theirs
             st.session_state['name']        = name
             st.session_state['client_id']   = st.session_state['name']
             st.session_state['auth_stat']   = True
             st.session_state['type']        = user_type
+            start_flow()
             set_page("main")
         else:
             st.session_state['auth_stat'] = False
@@ -139,6 +409,7 @@ elif page == "moderation":
                             (word,)
                         )
                         con.commit()
+                        get_censor.clear()
                         st.rerun()
                     if st.button("❌ Reject", key=f"reject_{word}"):
                         cur.execute(
@@ -230,16 +501,14 @@ elif page == "logs":
         set_page("main")
     else:
         st.title("📜 Censor Logs")
-
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute(
-            "SELECT client_id AS user, original_word, event_ts "
-            "FROM censor_log "
-            "ORDER BY event_ts DESC"
+        writer = censor_log.stats()
+        st.caption(
+            f"This process: {writer['queued']} queued, {writer['written']} written "
+            f"({writer['late']} late), {writer['dropped']} dropped (queue full), "
+            f"{writer['failed']} failed to insert."
         )
-        logs = cur.fetchall()
-        con.close()
+
+        logs = list_censor_log()
 
         if not logs:
             st.info("No censored words recorded.")
@@ -262,7 +531,11 @@ elif page == "history":
         set_page("main")
     else:
         st.title("📜 Submission History")
-        history = get_submission(st.session_state['client_id'])
+        archived = st.checkbox(
+            f"Include archived history (older than {ARCHIVE_AFTER_MONTHS['submission']} months)",
+            key="history_archived"
+        )
+        history = get_submission(st.session_state['client_id'], archived)
         
         if not history:
             st.info("No submission recorded.")
@@ -286,15 +559,10 @@ elif page == "history":
             logout_user()
 
 elif page == "collab":
-    if not st.session_state['complaints_checked']:
-        handle_complaint()
+    handle_complaint()
     
     # boost the max-width of the main content only on this page
     st.markdown("""<style> .block-container {max-width: 1600px;} </style>""", unsafe_allow_html=True)
-    file_id       = st.session_state.get("current_file")
-    orig_key      = f"collab_orig_{file_id}"
-    rendered_key  = f"collab_html_{file_id}"
-    clean_key     = f"collab_clean_{file_id}"
 
     st.header("🤝 Collaborative Editor")
 
@@ -306,35 +574,15 @@ elif page == "collab":
             set_page("main")
         st.stop()
 
-    orig_key = f"collab_orig_{file_id}"
-    orig     = st.session_state.get(orig_key)
-    if orig is None:
-        orig = get_file_content(file_id)
-
     left, right = st.columns(2)
 
     with left:
-        st.subheader("🖋️ Original")
-        new_orig = st.text_area(
-            label="", value=orig, 
-            height=400, key="collab_edit",
-            label_visibility="collapsed",
-            placeholder=""
-        )
-        if st.button("🔄 Submit for correction"):
-            st.session_state[orig_key] = new_orig
-            correct_text(new_orig)
-            st.session_state[rendered_key] = st.session_state["rendered_html"]
-            st.session_state[clean_key]    = st.session_state["corrected_text"]
-            st.rerun()
+        render_collab_editor(file_id)
 
     with right:
-        st.subheader("✅ Agreed-Upon Text")
-        html_blob = st.session_state.get(rendered_key, "")
-        wrapped   = wrap_scrollable(html_blob, max_height=400)
-        edited    = html_viewer(html=wrapped, height=400)
-        if edited is not None:
-            st.session_state[clean_key] = edited
+        render_collab_viewer(file_id)
+
+    render_document_download(file_id)
 
     if st.session_state['type'] == 'P':
         st.markdown("---")
@@ -355,8 +603,7 @@ elif page == "collab":
         set_page("main")
 
 elif page == "main":
-    if not st.session_state['complaints_checked']:
-        handle_complaint()
+    handle_complaint()
 
     if not st.session_state['auth_stat']:
         set_page("login")
@@ -366,37 +613,8 @@ elif page == "main":
                 if st.button("Logout", key="sidebar_logout"):
                     logout_user()
             # show invites only to paid users
-            with st.sidebar.expander("🔔 Notifications", expanded=False):
-                invites = list_invites_for(st.session_state['name'])
-                if not invites:
-                    st.write("No new invites.")
-                else:
-                    for inv in invites:
-                        ts = time.strftime(
-                            "%Y-%m-%d %H:%M",
-                            time.localtime(inv["requested_ts"])
-                        )
-                        st.write(f"📩 **{inv['title']}** from _{inv['inviter']}_ at {ts}")
-                        col1, col2 = st.columns([1,1])
-                        with col1:
-                            if st.button("Accept", key=f"accept_{inv['invite_id']}"):
-                                respond_invite(inv['invite_id'], True)
-                                st.rerun()
-                        with col2:
-                            if st.button("Reject", key=f"reject_{inv['invite_id']}"):
-                                respond_invite(inv['invite_id'], False)
-                                st.rerun()
-        
-            with st.sidebar.expander("📁 Shared Documents", expanded=False):
-                files = list_files_for(st.session_state['name'])
-                if not files:
-                    st.write("No documents yet.")
-                else:
-                    for f in files:
-                        ts = time.strftime("%Y-%m-%d", time.localtime(f["created_ts"]))
-                        if st.button(f"{f['title']}  ({ts})", key=f"file_{f['file_id']}"):
-                            st.session_state["current_file"] = f["file_id"]
-                            set_page("collab")
+            with st.sidebar:
+                render_sidebar_notifications()
 
         st.title("📝 LLM-Based Text Editor")
         st.write(f"## Hello, {st.session_state['name']}!")
@@ -418,12 +636,7 @@ elif page == "main":
 
         if st.session_state['type'] == 'P':
             with st.expander("View/Add Tokens", expanded = True):
-                show_paid_user_metrics(st.session_state['client_id'])
-                token_input = st.number_input("Enter Tokens", min_value=1, step=1)
-                
-                if st.button("Add Tokens"):
-                    update_token(st.session_state['client_id'], token_input, 0)
-                    st.rerun()
+                render_token_panel()
         
         elif st.session_state['type'] == 'F':
             lock_time = get_lockout(client_id)
@@ -441,8 +654,8 @@ elif page == "main":
                 st.session_state['type'] = 'S'
                 st.rerun()
 
-        file_text = ""
         typed_input = ""
+        upload_scan = None
 
         if "uploaded_file" not in st.session_state:
             st.session_state['uploaded_file'] = None
@@ -451,8 +664,15 @@ elif page == "main":
             st.markdown("### 📤 Upload a `.txt` file")
             uploaded = st.file_uploader("Choose a text file", type=["txt"])
             if uploaded:
+                # Size, encoding and word counts from one streaming pass; the
+                # text itself is only decoded again on submit
+                try:
+                    upload_scan = scan_uploaded(uploaded)
+                except UploadTooLarge as e:
+                    st.session_state['uploaded_file'] = None
+                    st.error(str(e))
+                    st.stop()
                 st.session_state['uploaded_file'] = uploaded
-                file_text = uploaded.read().decode("utf-8")
             elif st.session_state['uploaded_file'] is not None and uploaded is None:
                 st.session_state['uploaded_file'] = None
 
@@ -460,17 +680,28 @@ elif page == "main":
                 st.markdown("### 💻 Or input your text:")
                 typed_input = st.text_area(label="Your text:", placeholder="Start typing here...", height=170)
 
-            user_input = (typed_input or file_text).rstrip()
-
-            word_count = len(user_input.split())
+            user_input = typed_input.rstrip()
+
+            word_count = upload_scan.words if upload_scan else len(user_input.split())
+            # Paid uploads too long to be an instruction are streamed to the
+            # model a batch of paragraphs at a time and never joined into one
+            # string; a paragraph that repeats is corrected, and billed, once.
+            # Self-correction edits (and bills) the whole text in one box.
+            streamed = upload_scan if (
+                upload_scan and st.session_state['type'] == 'P' and upload_scan.words >= INSTRUCTION_MAX_WORDS
+                and st.session_state.get("correction_type", "LLM Correction") == "LLM Correction"
+            ) else None
+            billed = streamed.unique_words if streamed else word_count
             if st.session_state['type'] == 'F' and word_count > 20:
                 st.markdown(f"<span style='color:red;'>Word count: {word_count} (Limit: 20. Submitting will result in a 3 minute timeout.)</span>", unsafe_allow_html=True)
             elif st.session_state['type'] == 'P':
-                available, _ = get_token(st.session_state['client_id'])
-                if word_count > available:
-                    st.markdown(f"<span style='color:red;'>Word count: {word_count} (Exceeds available tokens: {available}. Submitting will cut your tokens in half.)</span>", unsafe_allow_html=True)
+                available, _ = cached_token(st.session_state['client_id'])
+                if billed > available:
+                    st.markdown(f"<span style='color:red;'>Word count: {billed} (Exceeds available tokens: {available}. Submitting will cut your tokens in half.)</span>", unsafe_allow_html=True)
                 else:
-                    st.write(f"Word count: {word_count}")
+                    st.write(f"Word count: {billed}")
+                if billed != word_count:
+                    st.caption(f"{word_count} words in the file; repeated paragraphs are corrected and billed once.")
             else:
                 st.write(f"Word count: {word_count}")
 
@@ -484,10 +715,10 @@ elif page == "main":
             
             # ─── Submit button ───
             if st.button("Submit"):
-                if user_input.strip():
-                    word_count = len(user_input.split())
-                    
-                    instruction_like = is_instruction_like(user_input)
+                if upload_scan and not streamed and not (st.session_state['type'] == 'F' and word_count > 20):
+                    user_input = "\n\n".join(iter_paragraphs(uploaded, upload_scan.encoding))
+                if word_count:
+                    instruction_like = not streamed and is_instruction_like(user_input)
 
                     if instruction_like:
                         st.warning("⚠️ Your input looks like an instruction. If you're trying to correct a real sentence, rephrase it.")
@@ -504,13 +735,17 @@ elif page == "main":
                         # Paid user flow: defer to confirmation
                         elif st.session_state['type'] == 'P':
                             available, used = get_token(st.session_state['client_id'])
-                            if available >= word_count:
-                                # flag for confirmation on next rerun
+                            if available >= billed:
+                                # flag for confirmation on next rerun; a streamed
+                                # upload is kept as a reference to the file
                                 st.session_state["pending_submit"] = True
-                                st.session_state["pending_input"]  = user_input
-                                st.session_state["pending_count"]  = word_count
+                                st.session_state["pending_count"]  = billed
                                 st.session_state["pending_correction_type"] = correction_type
-                                st.session_state["original_input"] = user_input
+                                if streamed:
+                                    st.session_state["pending_upload"] = {"file_id": uploaded.file_id, "encoding": streamed.encoding}
+                                else:
+                                    st.session_state["pending_input"]  = user_input
+                                    st.session_state["original_input"] = user_input
                             else:
                                 penalty = available // 2
                                 update_token(st.session_state['client_id'], -penalty, penalty)
@@ -523,59 +758,9 @@ elif page == "main":
                 else:
                     st.warning("Input can't be empty.")
 
+            rebuild_flow_renders()
             if st.session_state.get("pending_self_correction"):
-                st.subheader("Self-Correction")
-                # Display highlighted incorrect words
-                if st.session_state.get("rendered_html"):
-                    st.markdown("### Text with Incorrect Words Highlighted")
-                    raw = st.session_state["rendered_html"]
-                    wrapped = wrap_scrollable(raw, max_height=255)
-                    st.markdown("Words in green contain grammatical errors. Edit them below.")
-                    html_viewer(html=wrapped, height=255)
-                
-                self_corrected = st.text_area(
-                    "Edit your text below:",
-                    value=st.session_state["self_corrected_text"],
-                    height=200,
-                    key="self_corrected_area"
-                )
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("Confirm Self-Correction", key="confirm_self_correction"):
-                        if not st.session_state["user_input"]:
-                            st.error("Original input is missing. Please submit text again.")
-                            st.session_state["pending_self_correction"] = False
-                            st.session_state["self_corrected_text"] = None
-                            st.rerun()
-                        elif self_corrected.strip():
-                            tokens = self_correct_cost(st.session_state["user_input"], self_corrected)
-                            available, _ = get_token(st.session_state['client_id'])
-                            if available >= tokens:
-                                update_token(st.session_state['client_id'], -tokens, tokens)
-                                set_submission(
-                                    st.session_state['client_id'],
-                                    st.session_state["user_input"],
-                                    self_corrected,
-                                    1 if st.session_state["user_input"] != self_corrected else 0
-                                )
-                                st.session_state["corrected_text"] = self_corrected
-                                st.session_state["can_download"] = True
-                                st.session_state["pending_self_correction"] = False
-                                st.session_state["self_corrected_text"] = None
-                                st.session_state["tokens"] = tokens
-                                st.session_state["rendered_html"] = None  # Clear highlighted text
-                                st.success(f"💰 Deducted {tokens} tokens for self-correction.")
-                                st.rerun()
-                            else:
-                                st.error(f"Not enough tokens. Required: {tokens}, Available: {available}")
-                        else:
-                            st.warning("Corrected text can't be empty.")
-                with col2:
-                    if st.button("Cancel", key="cancel_self_correction"):
-                        st.session_state["pending_self_correction"] = False
-                        st.session_state["self_corrected_text"] = None
-                        st.session_state["rendered_html"] = None  # Clear highlighted text
-                        st.rerun()
+                render_self_correction()
             
             # ─── Confirmation UI for paid users ───
             if st.session_state.get("pending_submit"):
@@ -584,28 +769,42 @@ elif page == "main":
                 if correction_type == "LLM Correction":
                     st.warning(f"⚠️ {tokens} tokens will be deducted for LLM correction. Are you sure?")
                 else:
-                    estimated_tokens = self_correct_cost(st.session_state["pending_input"], st.session_state["pending_input"])
                     st.warning(f"⚠️ Tokens will be deducted based on actual self-correction edits. Are you sure?")
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button("Yes, submit", key="confirm_submit"):
+                        ref = st.session_state.get("pending_upload")
+                        pending_input = st.session_state.get("pending_input")
+                        # clear the pending flags and checkpoint before anything is
+                        # charged, so a flow resumed after a crash can't submit twice
+                        for k in ("pending_submit", "pending_count", "pending_correction_type", "pending_input", "pending_upload"):
+                            st.session_state.pop(k, None)
+                        if ref and uploaded_file_for(ref) is None:
+                            checkpoint_flow_state()
+                            st.error("The uploaded file is gone. Please upload it again.")
+                            st.stop()
                         # perform the correction
+                        st.session_state.pop("self_corrected_text", None)
                         if correction_type == "LLM Correction":
-                            st.session_state["original_input"] = st.session_state["pending_input"]  # Store original input
-                            correct_text(st.session_state["pending_input"])
+                            st.session_state["original_input"] = pending_input  # Store original input
+                            st.session_state["original_upload"] = ref
+                            checkpoint_flow_state()
+                            if ref:
+                                # Uploads go to the model a batch of paragraphs at a time
+                                correct_paragraph_stream(iter_paragraphs(uploaded_file_for(ref), ref["encoding"]))
+                            else:
+                                correct_text(pending_input)
                         else:
-                            st.session_state["self_corrected_text"] = st.session_state["pending_input"]
-                            st.session_state["user_input"] = st.session_state["pending_input"]
-                            correct_text(st.session_state["pending_input"], self_correction=True)  # Highlight errors
+                            st.session_state["user_input"] = pending_input
+                            st.session_state.pop("original_upload", None)
+                            checkpoint_flow_state()
+                            correct_text(pending_input, self_correction=True)  # Highlight errors
                             st.session_state["pending_self_correction"] = True
-                        # clear the pending flags
-                        for k in ("pending_submit", "pending_count", "pending_correction_type", "pending_input"):
-                            st.session_state.pop(k, None)
                         st.rerun()
                 with col2:
                     if st.button("Cancel", key="cancel_submit"):
                         # abort
-                        for k in ("pending_submit", "pending_input", "pending_count", "pending_correction_type"):
+                        for k in ("pending_submit", "pending_input", "pending_count", "pending_correction_type", "pending_upload"):
                             st.session_state.pop(k, None)
 
             if st.session_state['type'] == 'P':
@@ -617,12 +816,7 @@ elif page == "main":
                 del st.session_state["downloaded_success"]
 
             if st.session_state.get("rendered_html") and not st.session_state.get("can_download") and not st.session_state.get("pending_self_correction"):
-                st.subheader("✅ Corrected Text")
-                raw = st.session_state["rendered_html"]
-                wrapped = wrap_scrollable(raw, max_height=255)
-                edited  = html_viewer(html=wrapped, height=255)
-                if edited is not None:
-                    st.session_state["corrected_text"] = edited
+                render_corrected_viewer()
 
             if st.session_state['type'] == 'P':
                 if st.session_state.get("corrected_text") and not st.session_state.get("can_download"):
@@ -634,11 +828,12 @@ elif page == "main":
                         st.markdown("⚠️ Pressing this will lock further edits.", unsafe_allow_html=True)
 
                     else:
-                        # clean up the HTML into plain text
-                        clean_text = html_to_clean_text(st.session_state["corrected_text"])
+                        # the viewer's text, already rebuilt from its toggle state
+                        clean_text = st.session_state["corrected_text"]
 
                         # figure out the original text to compare against
-                        orig = st.session_state.get("original_input") or st.session_state.get("pending_input")
+                        orig = (st.session_state.get("original_input") or st.session_state.get("pending_input")
+                                or upload_text(st.session_state.get("original_upload")))
                         if not orig:
                             st.error("Original input is missing. Please resubmit your text.")
                             st.session_state["confirming_purchase"] = False
@@ -646,8 +841,10 @@ elif page == "main":
                             st.stop()
 
                         # count how many tokens this change will cost
-                        tokens = count_price(orig, clean_text)
-                        available, _ = get_token(st.session_state['client_id'])
+                        words = len(orig.split())
+                        with stage_span("confirm_edits", "pricing", words):
+                            tokens = count_price(orig, clean_text)
+                            available, _ = get_token(st.session_state['client_id'])
                         if available < tokens:
                             st.error(f"Not enough tokens to confirm edits. Required: {tokens}, Available: {available}")
                             st.session_state["confirming_purchase"] = False
@@ -659,21 +856,28 @@ elif page == "main":
                         c1, c2 = st.columns(2)
                         with c1:
                             if st.button("✅ Yes", key="confirm_yes"):
+                                # allow download and reset for a fresh file next time,
+                                # checkpointed before the charge so a resumed flow
+                                # can't confirm (and pay) twice
+                                st.session_state["can_download"]        = True
+                                st.session_state["confirming_purchase"] = False
+                                st.session_state["tokens"]              = tokens
+                                current_file = st.session_state.pop("current_file", None)
+                                checkpoint_flow_state()
                                 try:
-                                    update_token(
-                                        st.session_state['client_id'],
-                                        -tokens,  # subtract from available
-                                        tokens    # add to used
-                                    )
-                                    # now allow download and reset for a fresh file next time
-                                    st.session_state["can_download"]        = True
-                                    st.session_state["confirming_purchase"] = False
-                                    st.session_state["tokens"]              = tokens
-                                    st.session_state.pop("current_file", None)
+                                    with stage_span("confirm_edits", "tokens", words):
+                                        update_token(
+                                            st.session_state['client_id'],
+                                            -tokens,  # subtract from available
+                                            tokens    # add to used
+                                        )
                                     st.rerun()
                                 except ValueError as e:
                                     st.error(str(e))
-                                    st.session_state["confirming_purchase"] = False
+                                    st.session_state["can_download"] = False
+                                    if current_file is not None:
+                                        st.session_state["current_file"] = current_file
+                                    checkpoint_flow_state()
                                     st.rerun()
                         with c2:
                             if st.button("❌ No", key="confirm_no"):
@@ -683,10 +887,15 @@ elif page == "main":
 
                 if st.session_state.get("can_download"):
                     st.markdown("### 📄 Preview of Approved Edits")
-                    clean_text = html_to_clean_text(st.session_state["corrected_text"])
+                    clean_text = st.session_state["corrected_text"]
 
                     st.text_area("", clean_text, height=200, disabled=True)
-                    st.success(f"💰 Deducted {st.session_state['tokens']} tokens for confirmed edits.")
+                    if st.session_state.get("tokens") is not None:
+                        st.success(f"💰 Deducted {st.session_state['tokens']} tokens for confirmed edits.")
+                    else:
+                        # Resumed flow: the deduction isn't kept, the balance is read again
+                        available, _ = get_token(st.session_state['client_id'])
+                        st.success(f"💰 Edits confirmed. Remaining: {available} tokens.")
 
                     file_id = st.session_state.get("current_file")
                     if file_id is None:
@@ -697,8 +906,7 @@ elif page == "main":
                                 title=title
                             )
                             # immediately write the confirmed text into the DB
-                            clean = html_to_clean_text(st.session_state["corrected_text"])
-                            update_file_content(fid, clean)
+                            update_file_content(fid, clean_text, st.session_state["name"])
                             st.session_state["current_file"] = fid
                             st.rerun()
                         st.stop()  # wait for the user to initialize
@@ -724,14 +932,19 @@ elif page == "main":
                         file_name="corrected_text.txt",
                         mime="text/plain",
                     ):
-                        available, _ = get_token(st.session_state['client_id'])
+                        with stage_span("download", "tokens", len(clean_text.split())):
+                            available, _ = get_token(st.session_state['client_id'])
+                            if available >= 5:
+                                update_token(st.session_state['client_id'], -5, 5)
                         if available >= 5:
-                            update_token(st.session_state['client_id'], -5, 5)
                             st.session_state["downloaded_success"] = f"File downloaded. 5 tokens deducted. Remaining: {available - 5}"
                             st.session_state["can_download"] = False
                             st.session_state["rendered_html"] = None
                             st.session_state["corrected_text"] = None
+                            st.session_state["self_corrected_text"] = None
+                            st.session_state["toggles"] = None
                             st.session_state["original_input"] = None  # Clear original input
+                            st.session_state["original_upload"] = None
                             st.rerun()
                         else:
                             st.error("Not enough tokens to download the file.")
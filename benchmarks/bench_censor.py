@@ -0,0 +1,62 @@
+"""
+Throughput of the compiled blacklist (censor.PhraseMatcher) against the old
+per-word re.sub + set lookup, for large blacklists with multi-word phrases.
+
+    python -m benchmarks.bench_censor [--entries 1000 50000] [--words 100000]
+"""
+import argparse, random, re, time
+from censor import PhraseMatcher
+
+def make_blacklist(n: int, rng: random.Random) -> list[str]:
+    words = [f"bad{i}" for i in range(n)]
+    # a fifth of the entries are two- or three-word phrases
+    for i in range(0, n, 5):
+        words[i] = " ".join(f"bad{rng.randrange(n)}" for _ in range(rng.choice((2, 3))))
+    return words
+
+def make_text(n_words: int, blacklist: list[str], rng: random.Random) -> list[str]:
+    vocab = [f"word{i}" for i in range(20000)]
+    out = []
+    while len(out) < n_words:
+        if rng.random() < 0.01:
+            out.extend(rng.choice(blacklist).split())
+        else:
+            out.append(rng.choice(vocab) + rng.choice(("", "", ",", ".")))
+    return out
+
+# The loop correct_text ran before: single words only
+def legacy(words: list[str], blacklisted: set[str]) -> int:
+    hits = 0
+    for w in words:
+        if re.sub(r'\W+', '', w).lower() in blacklisted:
+            hits += 1
+    return hits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--words", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'entries':>8} {'compile ms':>11} {'legacy w/s':>12} {'engine w/s':>12} {'hits':>6}")
+    for n in args.entries:
+        blacklist = make_blacklist(n, rng)
+        words = make_text(args.words, blacklist, rng)
+
+        start = time.perf_counter()
+        matcher = PhraseMatcher(blacklist)
+        t_compile = time.perf_counter() - start
+
+        start = time.perf_counter()
+        legacy(words, set(blacklist))
+        t_old = time.perf_counter() - start
+
+        start = time.perf_counter()
+        hits = matcher.scan(words)
+        t_new = time.perf_counter() - start
+
+        print(f"{n:>8} {t_compile * 1000:>11.1f} {len(words) / t_old:>12,.0f} {len(words) / t_new:>12,.0f} {len(hits):>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+html_to_clean_text on viewer-sized HTML: the old five-regex version versus
+the single-scan extractor (cold, then memoized). Time per KB should stay
+flat as the document grows.
+
+    python -m benchmarks.bench_clean_text [--kb 50 200 800]
+"""
+import argparse, random, re, time
+import utils
+
+SPAN = (
+    '<span class="toggle" data-original="{o}" data-corrected="{c}" '
+    'style="background:#2EBD2E; border-radius:8px; padding:4px; display:inline-block; '
+    'cursor:pointer; font-size:16px; color:white;">{c}</span> '
+)
+
+# Markup shaped like correct_text's output wrapped by wrap_scrollable
+def make_html(kb: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    body, size = [], 0
+    while size < kb * 1024:
+        line = []
+        for _ in range(12):
+            w = f"word{rng.randrange(5000)}"
+            line.append(SPAN.format(o=w, c=w + "s") if rng.random() < 0.1 else w + " ")
+        line.append("<br><br>" if rng.random() < 0.2 else "<br>")
+        chunk = "".join(line)
+        body.append(chunk)
+        size += len(chunk)
+    return utils.wrap_scrollable(f"<div>{''.join(body)}</div>")
+
+def legacy(html_data: str) -> str:
+    html = re.sub(r"<style.*?>.*?</style>", "", html_data, flags=re.S)
+    html = re.sub(r"</div>\s*<div[^>]*>", "\n\n", html)
+    html = re.sub(r"(?:<br\s*/?>\s*){2,}", "\n\n", html)
+    html = re.sub(r"<br\s*/?>", "\n", html)
+    text = re.sub(r"<[^>]+>", "", html)
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return "\n\n".join([ln for ln in lines if ln.strip()])
+
+def timed(fn, arg) -> tuple[float, str]:
+    start = time.perf_counter()
+    out = fn(arg)
+    return (time.perf_counter() - start) * 1000, out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kb", type=int, nargs="+", default=[50, 200, 800])
+    args = parser.parse_args()
+
+    print(f"{'KB':>6} {'legacy ms':>10} {'scan ms':>9} {'scan ms/KB':>11} {'memo ms':>8}")
+    for kb in args.kb:
+        html = make_html(kb)
+        utils._clean_text_cache.clear()
+        t_old, old = timed(legacy, html)
+        t_new, new = timed(utils.html_to_clean_text, html)
+        t_memo, _ = timed(utils.html_to_clean_text, html)
+        assert old == new
+        print(f"{kb:>6} {t_old:>10.1f} {t_new:>9.1f} {t_new / kb:>11.3f} {t_memo:>8.2f}")
+
+if __name__ == "__main__":
+    main()
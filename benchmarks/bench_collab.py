@@ -0,0 +1,106 @@
+"""
+Two collaborators editing one document concurrently through the operation
+log: checks that both sessions converge on the same text and reports the
+bytes sent per edit against rewriting the whole document.
+
+Runs against an in-memory log with the same push/pull protocol as
+utils.push_file_op / utils.pull_file_ops, so no database is needed.
+
+    python -m benchmarks.bench_collab [--words 20000] [--rounds 500]
+"""
+import argparse, random, time
+from collab import diff_op, apply_op, rebase, dump_op, load_op
+
+class MemoryLog:
+    def __init__(self, text: str):
+        self.base = text
+        self.ops = []
+
+    # Returns (ops after base, bytes up, bytes down)
+    def push(self, base: int, op: list) -> tuple[list[list], int, int]:
+        behind = self.ops[base:]
+        committed = [load_op(o) for o in behind]
+        wire = dump_op(rebase(op, committed))
+        self.ops.append(wire)
+        return committed + [load_op(wire)], len(dump_op(op)), sum(len(o) for o in behind) + len(wire)
+
+    def pull(self, since: int) -> tuple[list[list], int]:
+        wire = self.ops[since:]
+        return [load_op(o) for o in wire], sum(len(o) for o in wire)
+
+    def text(self) -> str:
+        text = self.base
+        for o in self.ops:
+            text = apply_op(text, load_op(o))
+        return text
+
+class Session:
+    def __init__(self, log: MemoryLog):
+        self.log = log
+        self.text = log.base
+        self.version = 0
+        self.local = log.base
+        self.sent = 0
+        self.received = 0
+        self.edits = 0
+
+    # A keystroke batch: replace a few words somewhere in the local buffer
+    def type(self, rng: random.Random) -> None:
+        words = self.local.split(" ")
+        i = rng.randrange(len(words))
+        words[i:i + rng.randint(0, 2)] = [f"edit{rng.randrange(1000)}" for _ in range(rng.randint(0, 3))]
+        self.local = " ".join(words)
+
+    def sync(self) -> None:
+        op = diff_op(self.text, self.local)
+        if op:
+            ops, up, down = self.log.push(self.version, op)
+            self.sent += up
+            self.received += down
+            self.edits += 1
+        else:
+            ops, n = self.log.pull(self.version)
+            self.received += n
+        for o in ops:
+            self.text = apply_op(self.text, o)
+        self.version += len(ops)
+        self.local = self.text
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    doc = " ".join(f"word{rng.randrange(5000)}" for _ in range(args.words))
+    log = MemoryLog(doc)
+    a, b = Session(log), Session(log)
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        # Both type before either syncs, so every round is a real conflict
+        a.type(rng)
+        b.type(rng)
+        first, second = (a, b) if rng.random() < 0.5 else (b, a)
+        first.sync()
+        second.sync()
+    a.sync()
+    b.sync()
+    elapsed = time.perf_counter() - start
+
+    final = log.text()
+    converged = a.text == b.text == final
+    edits = a.edits + b.edits
+    print(f"document: {len(doc.encode()):,} bytes, {args.words:,} words; {edits} edits in {args.rounds} conflicting rounds")
+    print(f"converged: {converged}  (log version {len(log.ops)})")
+    print(f"bytes per edit: {(a.sent + b.sent) / edits:,.1f} sent, "
+          f"{(a.received + b.received) / edits:,.1f} received "
+          f"vs {len(final.encode()):,} to rewrite the document")
+    print(f"{elapsed / edits * 1000:.3f} ms per edit (rebase + apply, both sessions)")
+    if not converged:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+pgbench-style workloads for the data-access helpers in utils, each run in
+isolation against a disposable Postgres seeded with realistic volumes
+(scaled by --scale): 100k accounts, 2M submissions, 500k invites, 1M
+censor_log rows. Reports ops/s, p50/p95/p99 latency and statements per
+operation, plus scaling curves:
+
+    tokens       get_token / update_token with every client on one account, by client count
+    submissions  set_submission, get_submission for a typical and a heavy user, as the table grows
+    invites      invite_user fan-out from one file; list_invites_for by pending invites per user
+    complaints   get_complaint_super by size of the pending backlog
+    censor_log   CensorLogWriter against one INSERT per word, by client count
+
+Seeded rows use the bench_ prefix and are reused by later runs. Needs
+DATABASE_URL pointing at a disposable Postgres:
+
+    python -m benchmarks.bench_data [--workloads tokens submissions ...] [--scale 1.0]
+        [--clients 1 4 16] [--seconds 10] [--growth 0.1 0.5 1] [--backlogs 100 1000 10000]
+        [--save [PATH]]
+"""
+import argparse, itertools, json, os, threading, time
+from datetime import datetime, timezone
+import utils
+from censor import CensorLogWriter
+
+WORKLOADS = ("tokens", "submissions", "invites", "complaints", "censor_log")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+USERS, SUBMISSIONS, INVITES, CENSOR_LOG = 100_000, 2_000_000, 500_000, 1_000_000
+BENCH_FILES = 1000
+FANOUT = (1, 10, 100, 1000)
+
+def sql(query: str, params=None, fetch: bool = False):
+    con = utils.get_connection()
+    try:
+        cur = con.cursor()
+        cur.execute(query, params)
+        return cur.fetchall() if fetch else None
+    finally:
+        con.close()
+
+def count(query: str, params=None) -> int:
+    return sql(query, params, fetch=True)[0]["n"]
+
+def user(i: int) -> str:
+    return f"bench_u{i}"
+
+# Seeding: bulk INSERT ... SELECT generate_series, topped up to the target
+# so reruns only add what is missing
+
+def seed_accounts(users: int) -> None:
+    sql("""
+        INSERT INTO account (client_id, password, type)
+        SELECT 'bench_u' || g, md5(g::text), CASE WHEN g %% 10 = 0 THEN 'P' ELSE 'F' END
+          FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    """, (users,))
+    sql("""
+        INSERT INTO token (client_id, available, used)
+        SELECT client_id, 1000000000, 0 FROM account
+         WHERE client_id LIKE 'bench\\_u%' AND type = 'P'
+        ON CONFLICT DO NOTHING
+    """)
+    if count("SELECT count(*) AS n FROM file WHERE title LIKE 'bench file %'") < BENCH_FILES:
+        sql("""
+            INSERT INTO file (owner, title, created_ts)
+            SELECT 'bench_u' || (1 + g * 10 %% %s), 'bench file ' || g, %s
+              FROM generate_series(1, %s) g
+        """, (users, int(time.time()), BENCH_FILES))
+
+# Submissions are skewed towards low user ids (random()^3), so bench_u1 is a
+# heavy user with a few percent of all rows and most users have a handful
+def seed_submissions(users: int, target: int) -> int:
+    have = count("SELECT count(*) AS n FROM submission WHERE client_id LIKE 'bench\\_u%'")
+    if have < target:
+        sql("""
+            INSERT INTO submission (client_id, original, corrected, error, event_ts)
+            SELECT 'bench_u' || (1 + floor(power(random(), 3) * %s))::int,
+                   repeat(md5(g::text), 6), repeat(md5((g + 1)::text), 6), g %% 2, %s - g
+              FROM generate_series(1, %s) g
+        """, (users, int(time.time()), target - have))
+        sql("ANALYZE submission")
+    return max(have, target)
+
+def seed_invites(users: int, target: int) -> None:
+    have = count("SELECT count(*) AS n FROM invite WHERE inviter LIKE 'bench\\_u%'")
+    if have < target:
+        sql("""
+            INSERT INTO invite (file_id, inviter, invitee, status, requested_ts)
+            SELECT f.file_id, f.owner, 'bench_u' || (1 + floor(random() * %s))::int,
+                   (ARRAY['pending', 'accepted', 'rejected'])[1 + g %% 3], %s - g
+              FROM generate_series(1, %s) g
+              JOIN file f ON f.title = 'bench file ' || (1 + g %% %s)
+        """, (users, int(time.time()), target - have, BENCH_FILES))
+    # Dedicated invitees with exactly k pending invites each
+    for k in FANOUT:
+        invitee = user(users + k)
+        sql("INSERT INTO account (client_id, password, type) VALUES (%s, 'x', 'F') ON CONFLICT DO NOTHING",
+            (invitee,))
+        missing = k - count("SELECT count(*) AS n FROM invite WHERE invitee = %s AND status = 'pending'", (invitee,))
+        if missing > 0:
+            sql("""
+                INSERT INTO invite (file_id, inviter, invitee, status, requested_ts)
+                SELECT file_id, owner, %s, 'pending', %s FROM file
+                 WHERE title LIKE 'bench file %%' ORDER BY file_id LIMIT %s
+            """, (invitee, int(time.time()), missing))
+    sql("ANALYZE invite")
+
+def seed_complaints(users: int, backlog: int) -> None:
+    have = count("SELECT count(*) AS n FROM complaint WHERE description = 'bench complaint' AND status = 'pending'")
+    if have < backlog:
+        sql("""
+            WITH c AS (
+                INSERT INTO complaint (file_id, complainant, complained, description, status, created_ts)
+                SELECT f.file_id, f.owner, 'bench_u' || (1 + floor(random() * %s))::int,
+                       'bench complaint', 'pending', %s - g
+                  FROM generate_series(1, %s) g
+                  JOIN file f ON f.title = 'bench file ' || (1 + g %% %s)
+                RETURNING complaint_id, complainant, complained, created_ts
+            )
+            INSERT INTO complaint_response (complaint_id, client_id, response, created_ts)
+            SELECT complaint_id, complainant, 'bench response', created_ts FROM c
+            UNION ALL
+            SELECT complaint_id, complained, 'bench response', created_ts FROM c
+        """, (users, int(time.time()), backlog - have, BENCH_FILES))
+
+def seed_censor_log(users: int, target: int) -> None:
+    have = count("SELECT count(*) AS n FROM censor_log WHERE client_id LIKE 'bench\\_u%'")
+    if have < target:
+        sql("""
+            INSERT INTO censor_log (client_id, original_word, event_ts)
+            SELECT 'bench_u' || (1 + floor(random() * %s))::int, 'badword' || (g %% 500), %s - g
+              FROM generate_series(1, %s) g
+        """, (users, int(time.time()), target - have))
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def measure(op, clients: int, seconds: float) -> dict:
+    """
+    op(n) is called with a process-wide sequence number. Statements per op are
+    counted over a few serial calls first, since db_stats is not per thread.
+    """
+    seq = itertools.count()
+    before = utils.db_stats["queries"]
+    for _ in range(3):
+        op(next(seq))
+    statements = (utils.db_stats["queries"] - before) / 3
+
+    latencies = [[] for _ in range(clients)]
+    start_line = threading.Barrier(clients + 1)
+    deadline = [0.0]
+
+    def client(i: int):
+        start_line.wait()
+        out = latencies[i]
+        while time.perf_counter() < deadline[0]:
+            t = time.perf_counter()
+            op(next(seq))
+            out.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    deadline[0] = time.perf_counter() + seconds
+    start = time.perf_counter()
+    start_line.wait()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    samples = sorted(x for lat in latencies for x in lat)
+    return {"clients": clients, "ops": len(samples), "ops_per_s": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 0.5) * 1000, "p95_ms": percentile(samples, 0.95) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000, "statements": statements}
+
+def report(results: list, workload: str, variant: str, row: dict) -> None:
+    row = {"workload": workload, "variant": variant, **row}
+    results.append(row)
+    print(f"{workload:<12} {variant:<26} {row['clients']:>7} {row['ops_per_s']:>9.1f} {row['p50_ms']:>8.2f} "
+          f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['statements']:>8.1f}")
+
+def bench_tokens(args, users: int, results: list) -> None:
+    hot = user(10)
+    for clients in args.clients:
+        report(results, "tokens", "get_token, one account", measure(lambda n: utils.get_token(hot), clients, args.seconds))
+        report(results, "tokens", "update_token, one account",
+               measure(lambda n: utils.update_token(hot, -1, 1), clients, args.seconds))
+
+def bench_submissions(args, users: int, results: list) -> None:
+    typical, heavy = user(users // 2), user(1)
+    for frac in args.growth:
+        rows = seed_submissions(users, int(SUBMISSIONS * args.scale * frac))
+        label = f"{rows / 1e6:.2f}M rows"
+        for clients in args.clients:
+            report(results, "submissions", f"set_submission, {label}",
+                   measure(lambda n: utils.set_submission(typical, "bench text", "bench text", 0), clients, args.seconds))
+        report(results, "submissions", f"get_submission typical, {label}",
+               measure(lambda n: utils.get_submission(typical), 1, args.seconds))
+        report(results, "submissions", f"get_submission heavy, {label}",
+               measure(lambda n: utils.get_submission(heavy), 1, args.seconds))
+
+def bench_invites(args, users: int, results: list) -> None:
+    seed_invites(users, int(INVITES * args.scale))
+    fid = sql("SELECT file_id, owner FROM file WHERE title = 'bench file 1'", fetch=True)[0]
+    # Fresh invitees for every call, so each one is a real insert
+    base = sql("SELECT count(*) AS n FROM invite WHERE file_id = %s", (fid["file_id"],), fetch=True)[0]["n"]
+    for clients in args.clients:
+        report(results, "invites", "invite_user fan-out",
+               measure(lambda n: utils.invite_user(fid["file_id"], fid["owner"], user(1 + (base + n) % users)),
+                       clients, args.seconds))
+        base += 1_000_000
+    for k in FANOUT:
+        report(results, "invites", f"list_invites_for, {k} pending",
+               measure(lambda n: utils.list_invites_for(user(users + k)), 1, args.seconds))
+
+def bench_complaints(args, users: int, results: list) -> None:
+    for backlog in args.backlogs:
+        seed_complaints(users, backlog)
+        report(results, "complaints", f"get_complaint_super, {backlog} pending",
+               measure(lambda n: utils.get_complaint_super(), 1, args.seconds))
+
+def bench_censor_log(args, users: int, results: list) -> None:
+    seed_censor_log(users, int(CENSOR_LOG * args.scale))
+    words = [f"badword{i}" for i in range(5)]
+
+    def direct(n: int):
+        con = utils.get_connection()
+        try:
+            cur = con.cursor()
+            for w in words:
+                cur.execute("INSERT INTO censor_log (client_id, original_word, event_ts) VALUES (%s, %s, %s)",
+                            (user(1 + n % users), w, int(time.time())))
+            con.commit()
+        finally:
+            con.close()
+
+    for clients in args.clients:
+        report(results, "censor_log", "INSERT per word (5 words)", measure(direct, clients, args.seconds))
+        writer = CensorLogWriter(lambda: utils.get_connection())
+        row = measure(lambda n: writer.log(user(1 + n % users), words), clients, args.seconds)
+        # The enqueue latency alone flatters the writer; count until the rows are written
+        start = time.perf_counter()
+        writer.close()
+        flush = time.perf_counter() - start
+        row["ops_per_s"] = row["ops"] / (row["ops"] / row["ops_per_s"] + flush) if row["ops"] else 0.0
+        row["statements"] = 0.0
+        report(results, "censor_log", "CensorLogWriter (5 words)", row)
+        stats = writer.stats()
+        lost = stats["dropped"] + stats["failed"]
+        if lost:
+            print(f"{'':<12} {'':<26} dropped {stats['dropped']}, failed {stats['failed']} "
+                  f"of {stats['written'] + lost} rows")
+
+BENCHES = {"tokens": bench_tokens, "submissions": bench_submissions, "invites": bench_invites,
+           "complaints": bench_complaints, "censor_log": bench_censor_log}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the seeded volumes")
+    parser.add_argument("--clients", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--seconds", type=float, default=10, help="per measurement")
+    parser.add_argument("--growth", nargs="+", type=float, default=[0.1, 0.5, 1.0],
+                        help="fractions of the submission volume to measure at")
+    parser.add_argument("--backlogs", nargs="+", type=int, default=[100, 1000, 10000])
+    parser.add_argument("--save", nargs="?", const="", default=None,
+                        help="write results as JSON (default: benchmarks/results/data-<timestamp>.json)")
+    args = parser.parse_args()
+    if not os.getenv("DATABASE_URL"):
+        raise SystemExit("DATABASE_URL must point at a disposable Postgres")
+
+    utils.set_db()
+    users = int(USERS * args.scale)
+    print(f"seeding {users:,} accounts ...", flush=True)
+    seed_accounts(users)
+
+    results = []
+    print(f"{'workload':<12} {'variant':<26} {'clients':>7} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'stmts/op':>8}")
+    for workload in args.workloads:
+        BENCHES[workload](args, users, results)
+    utils.censor_log.close()
+
+    if args.save is not None:
+        path = args.save or os.path.join(
+            RESULTS_DIR, "data-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"created": datetime.now(timezone.utc).isoformat(), "scale": args.scale,
+                "seconds": args.seconds, "users": users}
+        with open(path, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"\nsaved {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the per-line SequenceMatcher diff that correct_text/count_price used
+to run with the document-level diff engine.
+
+    python -m benchmarks.bench_diff [--words 2000 20000 100000]
+"""
+import argparse, random, time
+from difflib import SequenceMatcher
+from diff_engine import diff_opcodes, edit_cost
+
+VOCAB = [f"word{i}" for i in range(5000)] + ["the", "a", "of", "and", "to", "is", "in"] * 200
+
+# Synthetic document plus an "LLM corrected" copy with sparse word edits,
+# some merged lines and one merged paragraph
+def make_pair(n_words: int, seed: int = 0) -> tuple[str, str]:
+    rng = random.Random(seed)
+    words = [rng.choice(VOCAB) for _ in range(n_words)]
+    lines = [" ".join(words[i:i + 12]) for i in range(0, n_words, 12)]
+    paras = ["\n".join(lines[i:i + 6]) for i in range(0, len(lines), 6)]
+    orig = "\n\n".join(paras)
+
+    fixed = []
+    for para in paras:
+        out_lines = []
+        for line in para.split("\n"):
+            w = line.split()
+            for k in range(len(w)):
+                if rng.random() < 0.03:
+                    w[k] = w[k] + "s"
+            if out_lines and rng.random() < 0.1:
+                out_lines[-1] += " " + " ".join(w)
+            else:
+                out_lines.append(" ".join(w))
+        fixed.append("\n".join(out_lines))
+    if len(fixed) > 2:
+        fixed[1:3] = [fixed[1] + "\n" + fixed[2]]
+    return orig, "\n\n".join(fixed)
+
+# What correct_text + count_price did before: zip paragraphs and lines,
+# SequenceMatcher per line pair, then SequenceMatcher on the whole text
+def legacy(orig: str, corr: str) -> int:
+    rendered = 0
+    for o_para, c_para in zip(orig.split("\n\n"), corr.split("\n\n")):
+        for o_line, c_line in zip(o_para.splitlines(), c_para.splitlines()):
+            o_words, c_words = o_line.split(), c_line.split()
+            for tag, o1, o2, c1, c2 in SequenceMatcher(None, o_words, c_words).get_opcodes():
+                rendered += c2 - c1
+    return edit_cost(SequenceMatcher(None, orig.split(), corr.split()).get_opcodes())
+
+def engine(orig: str, corr: str) -> int:
+    return edit_cost(diff_opcodes(orig.split(), corr.split()))
+
+def timed(fn, *args) -> tuple[float, int]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, nargs="+", default=[2000, 20000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'legacy s':>10} {'engine s':>10} {'speedup':>8} {'legacy cost':>12} {'engine cost':>12}")
+    for n in args.words:
+        orig, corr = make_pair(n)
+        t_old, c_old = timed(legacy, orig, corr)
+        t_new, c_new = timed(engine, orig, corr)
+        print(f"{n:>8} {t_old:>10.3f} {t_new:>10.3f} {t_old / t_new:>7.1f}x {c_old:>12} {c_new:>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark for normalize_punctuation: plain ftfy + NFKC versus the
+ASCII fast path and the hash-keyed LRU.
+
+    python -m benchmarks.bench_normalize [--kb 4 32 256] [--repeat 6]
+"""
+import argparse, random, time, unicodedata
+import ftfy
+import utils
+
+SENTENCES = [
+    "The committee have decided to postpone the meeting until next week.",
+    "She don't know where the documents was left after the review.",
+    "Each of the students are responsible for their own project files.",
+    "We was planning to submit the report before the deadline passed.",
+]
+# What LLM output and pasted documents tend to add on top of plain ASCII
+FANCY = {"'": "’", "the ": "“the” ", "fi": "ﬁ", ". ": " — "}
+
+def make_text(kb: int, fancy: bool, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    paras, size = [], 0
+    while size < kb * 1024:
+        para = " ".join(rng.choice(SENTENCES) for _ in range(5))
+        if fancy:
+            for plain, fancy_text in FANCY.items():
+                para = para.replace(plain, fancy_text)
+        paras.append(para)
+        size += len(para) + 2
+    return "\n\n".join(paras)
+
+def baseline(text: str) -> str:
+    return unicodedata.normalize("NFKC", ftfy.fix_text(text))
+
+def per_call(fn, text: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--kb", type=int, nargs="+", default=[4, 32, 256])
+    # correct_text, count_price and self_correct_cost each normalize both texts
+    parser.add_argument("--repeat", type=int, default=6)
+    args = parser.parse_args()
+
+    print(f"{'input':>14} {'ftfy ms':>9} {'first ms':>9} {'cached ms':>10} {'speedup':>8}")
+    for kb in args.kb:
+        for fancy in (False, True):
+            text = make_text(kb, fancy)
+            assert utils.normalize_punctuation(text) == baseline(text)
+            utils._normalize_cache.clear()
+            t_base = per_call(baseline, text, args.repeat)
+            t_first = per_call(utils.normalize_punctuation, text, 1)
+            t_cached = per_call(utils.normalize_punctuation, text, args.repeat)
+            total_new = (t_first + t_cached * (args.repeat - 1)) / args.repeat
+            label = f"{kb}KB {'unicode' if fancy else 'ascii'}"
+            print(f"{label:>14} {t_base:>9.2f} {t_first:>9.2f} {t_cached:>10.3f} {t_base / total_new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+"""
+End-to-end load test: concurrent scripted sessions against a real
+`streamlit run app.py` server, ramping concurrency level by level and
+reporting throughput, latency percentiles and error rates.
+
+Each virtual user speaks Streamlit's websocket protocol directly (no
+browser) and runs one flow per fresh session until the level's time is up:
+
+    free        sign up, log in, submit under 20 words (corrected straight away)
+    paid        log in, submit, confirm the charge, confirm the edits
+    self        log in, self-correction submit, confirm, send the edited text
+    collab      log in, open a shared document, submit it for correction
+    moderation  super user logs in and opens the moderation panel
+
+The model is a stand-in for ollama's /api/generate started here, with
+configurable latency and an optional parallelism cap (like
+OLLAMA_NUM_PARALLEL); the server under test reaches it through OLLAMA_HOST.
+Needs DATABASE_URL pointing at a disposable Postgres; accounts and
+documents are seeded under a per-run prefix.
+
+    python -m benchmarks.load_test [--levels 1 2 4 8 16] [--duration 30]
+        [--mix free=3 paid=3 self=1 collab=1 moderation=1]
+        [--llm-latency 0.5] [--llm-jitter 0.5] [--llm-parallel 0]
+        [--think 0.5] [--port 8599] [--url ws://HOST:PORT] [--save PATH]
+"""
+import argparse, asyncio, json, os, random, subprocess, sys, threading, time, urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tornado.websocket import websocket_connect
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+STEP_TIMEOUT = 120
+FLOWS = ("free", "paid", "self", "collab", "moderation")
+
+# Wrong word -> the stand-in model's correction
+FIXES = {"have": "has", "go": "goes", "were": "was", "an": "a", "their": "there"}
+SENTENCES = [
+    "She have a small house near the river.",
+    "He go to the market every morning.",
+    "The report were finished late last night.",
+    "We saw an dog running across the park.",
+    "The students left their books on the table.",
+    "My brother have two old bicycles.",
+    "The train go past our window at noon.",
+]
+
+def make_text(rng: random.Random, words: int) -> str:
+    out = []
+    while sum(len(s.split()) for s in out) < words:
+        out.append(rng.choice(SENTENCES))
+    return " ".join(out)
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+class StandInLLM:
+    """ollama /api/generate stand-in: fixed latency plus jitter, fixes FIXES words."""
+
+    def __init__(self, latency: float, jitter: float, parallel: int, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.slots = threading.Semaphore(parallel) if parallel else None
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def respond(self, prompt: str) -> str:
+        text = prompt.rsplit("Input: ", 1)[-1].rsplit("\n\nOutput:", 1)[0]
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * (1 + self.jitter * (2 * self.rng.random() - 1))
+        if self.slots:
+            with self.slots:
+                time.sleep(max(delay, 0))
+        else:
+            time.sleep(max(delay, 0))
+        return " ".join(FIXES.get(w, w) for w in text.split(" "))
+
+    def serve(self) -> ThreadingHTTPServer:
+        llm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                out = json.dumps({
+                    "model": body.get("model", "mistral"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "response": llm.respond(body.get("prompt", "")),
+                    "done": True,
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="stand-in-llm", daemon=True).start()
+        return server
+
+class FlowError(Exception):
+    pass
+
+class Session:
+    """
+    One browser tab: keeps the query string, the widget values it has set and
+    the elements of the last run, and replays them on every rerun as the
+    frontend does.
+    """
+
+    def __init__(self, url: str, think: float, rng: random.Random, steps: list):
+        self.url = url
+        self.think = think
+        self.rng = rng
+        self.steps = steps
+        self.flow = ""
+        self.query = ""
+        self.values = {}
+        self.elements = {}
+        self.auto_reruns = {}
+        self.ws = None
+
+    async def open(self, flow: str, page: str) -> None:
+        self.flow = flow
+        self.query = f"page={page}"
+        self.ws = await websocket_connect(self.url, subprotocols=["streamlit"])
+        await self.rerun("open")
+
+    def close(self) -> None:
+        if self.ws is not None:
+            self.ws.close()
+
+    async def rerun(self, step: str, trigger: str | None = None, fragment_id: str = "",
+                    auto: bool = False) -> None:
+        msg = BackMsg()
+        state = msg.rerun_script
+        state.query_string = self.query
+        state.fragment_id = fragment_id
+        state.is_auto_rerun = auto
+        for wid, (field, value) in self.values.items():
+            w = state.widget_states.widgets.add()
+            w.id = wid
+            setattr(w, field, value)
+        if trigger:
+            w = state.widget_states.widgets.add()
+            w.id = trigger
+            w.trigger_value = True
+        start = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        try:
+            await asyncio.wait_for(self._until_finished(), STEP_TIMEOUT)
+        finally:
+            if not auto:
+                self.steps.append((self.flow, step, time.perf_counter() - start))
+        problems = [el.exception.message for el in self._all("exception")]
+        problems += [el.alert.body for el in self._all("alert") if el.alert.format == Alert.ERROR]
+        if problems:
+            raise FlowError(f"{step}: {problems[0]}")
+
+    async def _until_finished(self) -> None:
+        while True:
+            raw = await self.ws.read_message()
+            if raw is None:
+                raise FlowError("connection closed")
+            if isinstance(raw, str):
+                continue
+            fm = ForwardMsg()
+            fm.ParseFromString(raw)
+            kind = fm.WhichOneof("type")
+            if kind == "new_session":
+                # A full run replaces every element; a fragment run only its own
+                fragments = set(fm.new_session.fragment_ids_this_run)
+                self.elements = {p: e for p, e in self.elements.items() if fragments and e[1] not in fragments}
+            elif kind == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                self.elements[tuple(fm.metadata.delta_path)] = (fm.delta.new_element, fm.delta.fragment_id)
+            elif kind == "page_info_changed":
+                self.query = fm.page_info_changed.query_string
+            elif kind == "auto_rerun":
+                self.auto_reruns[fm.auto_rerun.fragment_id] = [fm.auto_rerun.interval, time.monotonic()]
+            elif kind == "script_finished" and fm.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+
+    def _all(self, kind: str):
+        return [el for el, _ in self.elements.values() if el.WhichOneof("type") == kind]
+
+    def widget(self, kind: str, label: str, prefix: bool = False):
+        for el, fragment_id in self.elements.values():
+            if el.WhichOneof("type") == kind:
+                w = getattr(el, kind)
+                if w.label == label or (prefix and w.label.startswith(label)):
+                    return w, fragment_id
+        raise FlowError(f"no {kind} {label!r} on {self.query or 'page'}")
+
+    def fill(self, kind: str, label: str, text: str) -> None:
+        self.values[self.widget(kind, label)[0].id] = ("string_value", text)
+
+    def choose(self, label: str, option: str) -> None:
+        w, _ = self.widget("radio", label)
+        self.values[w.id] = ("int_value", list(w.options).index(option))
+
+    async def click(self, label: str, prefix: bool = False) -> None:
+        w, fragment_id = self.widget("button", label, prefix)
+        await self.rerun(label, trigger=w.id, fragment_id=fragment_id)
+        await self.pause()
+
+    # User think time; fragments with run_every keep polling meanwhile
+    async def pause(self) -> None:
+        end = time.monotonic() + self.think * self.rng.uniform(0.5, 1.5)
+        while True:
+            now = time.monotonic()
+            for fragment_id, timer in self.auto_reruns.items():
+                if now - timer[1] >= timer[0] and now < end:
+                    timer[1] = now
+                    await self.rerun("auto", fragment_id=fragment_id, auto=True)
+            if now >= end:
+                return
+            await asyncio.sleep(min(0.25, end - now))
+
+    async def login(self, name: str) -> None:
+        self.fill("text_input", "Username", name)
+        self.fill("text_input", "Password", name)
+        await self.click("Login")
+        if "page=main" not in self.query:
+            raise FlowError(f"login as {name} failed ({self.query})")
+
+# Flows: each takes a fresh session and the virtual user's seeded accounts
+
+async def flow_free(s: Session, vu: dict) -> None:
+    vu["signups"] += 1
+    name = f"{vu['prefix']}free{vu['n']}_{vu['signups']}"
+    await s.open("free", "signup")
+    s.fill("text_input", "Username", name)
+    s.fill("text_input", "Password", name)
+    s.fill("text_input", "Confirm Password", name)
+    await s.click("Sign Up")
+    await s.login(name)
+    s.fill("text_area", "Your text:", make_text(s.rng, 12))
+    await s.click("Submit")
+
+async def flow_paid(s: Session, vu: dict) -> None:
+    await s.open("paid", "login")
+    await s.login(vu["paid"])
+    s.fill("text_area", "Your text:", make_text(s.rng, 60))
+    await s.click("Submit")
+    await s.click("Yes, submit")
+    await s.click("🔒 Confirm Edits")
+    await s.click("✅ Yes")
+
+async def flow_self(s: Session, vu: dict) -> None:
+    await s.open("self", "login")
+    await s.login(vu["paid"])
+    text = make_text(s.rng, 40)
+    s.fill("text_area", "Your text:", text)
+    s.choose("Select Correction Type", "Self Correction")
+    await s.click("Submit")
+    await s.click("Yes, submit")
+    s.fill("text_area", "Edit your text below:", " ".join(FIXES.get(w, w) for w in text.split(" ")))
+    await s.click("Confirm Self-Correction")
+
+async def flow_collab(s: Session, vu: dict) -> None:
+    await s.open("collab", "login")
+    await s.login(vu["paid"])
+    await s.click(vu["title"], prefix=True)
+    await s.click("🔄 Submit for correction")
+
+async def flow_moderation(s: Session, vu: dict) -> None:
+    await s.open("moderation", "login")
+    await s.login(vu["super"])
+    await s.click("Go to Moderation Panel")
+    if "page=moderation" not in s.query:
+        raise FlowError(f"moderation panel did not open ({s.query})")
+
+FLOW_FUNCS = {"free": flow_free, "paid": flow_paid, "self": flow_self,
+              "collab": flow_collab, "moderation": flow_moderation}
+
+def seed(prefix: str, users: int, rng: random.Random) -> list[dict]:
+    """One paid account (with a shared document) and one super user per virtual user."""
+    import utils
+    utils.set_db()
+    vus = []
+    for n in range(users):
+        paid, sup = f"{prefix}paid{n}", f"{prefix}super{n}"
+        utils.add_user(paid, "F", paid)
+        utils.free_to_paid(paid)
+        utils.update_token(paid, 1_000_000_000, 0)
+        utils.add_user(sup, "F", sup)
+        utils.free_to_super(sup)
+        title = f"{prefix}doc{n}"
+        fid = utils.create_file(paid, title)
+        doc = "\n\n".join(make_text(rng, 80) for _ in range(20))
+        utils.update_file_content(fid, doc, paid)
+        vus.append({"prefix": prefix, "n": n, "paid": paid, "super": sup, "title": title, "signups": 0})
+    utils.censor_log.close()
+    return vus
+
+def start_server(port: int, llm_port: int, log_path: str) -> subprocess.Popen:
+    env = dict(os.environ, OLLAMA_HOST=f"http://127.0.0.1:{llm_port}")
+    log = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "app.py", "--server.headless=true",
+         f"--server.port={port}", "--server.fileWatcherType=none", "--browser.gatherUsageStats=false"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"server exited; see {log_path}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=2) as r:
+                if r.read() == b"ok":
+                    return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit(f"server did not come up; see {log_path}")
+
+async def run_level(url: str, vus: list[dict], duration: float, mix: dict, think: float, seed: int) -> dict:
+    steps, flows = [], []
+    end = time.monotonic() + duration
+    names, weights = list(mix), list(mix.values())
+
+    async def user(vu: dict):
+        rng = random.Random(f"{seed}-{len(vus)}-{vu['n']}")
+        while time.monotonic() < end:
+            flow = rng.choices(names, weights)[0]
+            s = Session(url, think, rng, steps)
+            start = time.perf_counter()
+            error = None
+            try:
+                await FLOW_FUNCS[flow](s, vu)
+            except (FlowError, asyncio.TimeoutError, OSError) as e:
+                error = str(e) or type(e).__name__
+            finally:
+                s.close()
+            flows.append((flow, time.perf_counter() - start, error))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(vu) for vu in vus))
+    elapsed = time.perf_counter() - start
+
+    latencies = [t for _, _, t in steps]
+    failed = [e for _, _, e in flows if e]
+    by_flow = {}
+    for flow, seconds, error in flows:
+        row = by_flow.setdefault(flow, {"runs": 0, "errors": 0, "seconds": []})
+        row["runs"] += 1
+        row["errors"] += error is not None
+        row["seconds"].append(seconds)
+    return {
+        "users": len(vus), "elapsed": elapsed,
+        "steps": len(steps), "steps_per_s": len(steps) / elapsed,
+        "flows": len(flows), "flows_per_s": (len(flows) - len(failed)) / elapsed,
+        "error_rate": len(failed) / len(flows) if flows else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": sorted(set(failed))[:5],
+        "by_flow": {f: {"runs": r["runs"], "errors": r["errors"],
+                        "p95_s": percentile(r["seconds"], 0.95)} for f, r in by_flow.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--levels", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--mix", nargs="+", default=["free=3", "paid=3", "self=1", "collab=1", "moderation=1"])
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per model call")
+    parser.add_argument("--llm-jitter", type=float, default=0.5, help="+/- fraction of the latency")
+    parser.add_argument("--llm-parallel", type=int, default=0, help="concurrent model calls (0 = unlimited)")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between interactions")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--url", help="websocket URL of an already running server (its OLLAMA_HOST is up to you)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", nargs="?", const="", default=None,
+                        help="write results as JSON (default: benchmarks/results/load-<timestamp>.json)")
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix:
+        flow, _, weight = item.partition("=")
+        if flow not in FLOWS:
+            parser.error(f"unknown flow {flow!r}; choose from {', '.join(FLOWS)}")
+        mix[flow] = float(weight or 1)
+    if not os.getenv("DATABASE_URL"):
+        raise SystemExit("DATABASE_URL must point at a disposable Postgres")
+
+    rng = random.Random(args.seed)
+    prefix = f"load{int(time.time())}_"
+    vus = seed(prefix, max(args.levels), rng)
+
+    llm = StandInLLM(args.llm_latency, args.llm_jitter, args.llm_parallel, args.seed)
+    llm_server = llm.serve()
+    server = None
+    url = args.url
+    if not url:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        log_path = os.path.join(RESULTS_DIR, "load-server.log")
+        server = start_server(args.port, llm_server.server_port, log_path)
+        url = f"ws://127.0.0.1:{args.port}"
+    url = url.rstrip("/") + "/_stcore/stream"
+
+    results = []
+    print(f"{'users':>5} {'flows/s':>8} {'steps/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    try:
+        for level in args.levels:
+            row = asyncio.run(run_level(url, vus[:level], args.duration, mix, args.think, args.seed))
+            results.append(row)
+            print(f"{level:>5} {row['flows_per_s']:>8.2f} {row['steps_per_s']:>8.2f} {row['p50_ms']:>8.0f} "
+                  f"{row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f} {row['error_rate']:>7.1%}")
+            for flow, f in sorted(row["by_flow"].items()):
+                print(f"{'':>5}   {flow:<11} {f['runs']:>4} runs {f['errors']:>3} failed  p95 {f['p95_s']:.2f}s")
+            for error in row["errors"]:
+                print(f"{'':>5}   ! {error[:100]}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        llm_server.shutdown()
+    print(f"\nmodel calls: {llm.calls}")
+
+    if args.save is not None:
+        path = args.save or os.path.join(
+            RESULTS_DIR, "load-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"created": datetime.now(timezone.utc).isoformat(), "mix": mix, "duration": args.duration,
+                "llm_latency": args.llm_latency, "llm_jitter": args.llm_jitter,
+                "llm_parallel": args.llm_parallel, "think": args.think, "seed": args.seed}
+        with open(path, "w") as f:
+            json.dump({"meta": meta, "levels": results}, f, indent=1)
+        print(f"saved {path}")
+
+if __name__ == "__main__":
+    main()
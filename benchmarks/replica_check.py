@@ -0,0 +1,158 @@
+"""
+Checks read routing (utils.read_connection) against a primary and a replica,
+e.g. two local Postgres instances:
+
+    DATABASE_URL=postgresql://localhost:5432/app \\
+    DATABASE_READ_URL=postgresql://localhost:5433/app \\
+    python -m benchmarks.replica_check [--timeout 30]
+
+The second instance can be a streaming standby of the first or just another
+server. A standalone server counts as a replica with no lag, so the routing
+checks still run, but it never receives the primary's writes and the
+catch-up and paused-replay checks are skipped. A standalone replica gets the
+schema created (set_db) if it has none.
+"""
+import argparse, os, sys, time
+import psycopg2
+import utils
+from psycopg2.extras import RealDictCursor
+from replicas import ReplicaSet, primary_lsn
+
+def server(con) -> tuple:
+    cur = con.cursor()
+    cur.execute("SELECT inet_server_addr() AS addr, inet_server_port() AS port")
+    row = cur.fetchone()
+    return (row["addr"], row["port"])
+
+def answered_by(min_lsn) -> tuple:
+    con = utils.read_connection(min_lsn)
+    try:
+        return server(con)
+    finally:
+        con.close()
+
+def head() -> int:
+    con = utils.get_connection()
+    try:
+        return primary_lsn(con)
+    finally:
+        con.close()
+
+def on_replica(url: str, sql: str):
+    con = psycopg2.connect(url, cursor_factory=RealDictCursor)
+    con.autocommit = True
+    try:
+        cur = con.cursor()
+        cur.execute(sql)
+        return cur.fetchone()
+    finally:
+        con.close()
+
+def standby(url: str) -> bool:
+    return on_replica(url, "SELECT pg_is_in_recovery() AS standby")["standby"]
+
+def wait_for_check() -> None:
+    time.sleep(utils.REPLICA_CHECK_SECONDS + 0.2)
+
+def add_submission(client: str, text: str) -> int:
+    utils.set_submission(client, text, "after", 1)
+    return head()
+
+def ensure_replica_schema(url: str) -> None:
+    get_connection = utils.get_connection
+    def replica_connection():
+        con = psycopg2.connect(url, cursor_factory=utils.CountingCursor)
+        con.autocommit = True
+        return con
+    utils.get_connection = replica_connection
+    try:
+        utils.set_db()
+    finally:
+        utils.get_connection = get_connection
+
+def check(name: str, ok: bool, detail: str = "") -> bool:
+    print(f"{'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail else ''}")
+    return ok
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for the replica to catch up")
+    args = parser.parse_args()
+    if not utils.DB_URL or not utils.DB_READ_URLS:
+        print("Set DATABASE_URL and DATABASE_READ_URL", file=sys.stderr)
+        return 2
+
+    replica_url = utils.DB_READ_URLS[0]
+    streaming = standby(replica_url)
+    utils.set_db()
+    if not streaming:
+        ensure_replica_schema(replica_url)
+    con = utils.get_connection()
+    primary = server(con)
+    con.close()
+    print(f"primary {primary}, replica {'standby' if streaming else 'standalone'}, "
+          f"max lag {utils.DB_REPLICA_MAX_LAG}s")
+
+    results = [
+        check("within tolerance reads the replica", answered_by(0) != primary),
+        check("min_lsn=None reads the primary", answered_by(None) == primary),
+        check("min_lsn past the primary's position reads the primary", answered_by(head() + (1 << 30)) == primary),
+        check("unreachable replica falls back to the primary",
+              ReplicaSet(["postgresql://127.0.0.1:1/none?connect_timeout=1"], utils.get_connection).pick(0.0) is None),
+    ]
+
+    if streaming:
+        client = f"replica_check_{os.getpid()}"
+        utils.add_user(client, "P", "x")
+        # Read-your-writes: a read that must include a fresh write only moves to
+        # the replica once the replica is known to have replayed it
+        written = add_submission(client, "before")
+        started = time.monotonic()
+        while answered_by(written) == primary and time.monotonic() - started < args.timeout:
+            time.sleep(0.2)
+        moved = answered_by(written) != primary
+        results.append(check("read after a write waits for the replica", moved,
+                             f"{time.monotonic() - started:.1f}s"))
+        if moved:
+            def originals(cur):
+                cur.execute("SELECT original FROM submission WHERE client_id = %s", (client,))
+                return [r["original"] for r in cur.fetchall()]
+            results.append(check("replica read includes the write", "before" in utils.run_read(originals, written)))
+
+        # A standby that stops replaying has received everything it replayed,
+        # which the old lag query took for caught up; by position it falls behind
+        on_replica(replica_url, "SELECT pg_wal_replay_pause() IS NULL AS paused")
+        try:
+            written = add_submission(client, "while paused")
+            time.sleep(utils.DB_REPLICA_MAX_LAG)
+            wait_for_check()
+            results.append(check("a standby with replay paused is not read", answered_by(0) == primary))
+            results.append(check("nor for a position it has not replayed", answered_by(written) == primary))
+        finally:
+            on_replica(replica_url, "SELECT pg_wal_replay_resume() IS NULL AS resumed")
+
+        con = utils.get_connection()
+        cur = con.cursor()
+        cur.execute("DELETE FROM submission WHERE client_id = %s", (client,))
+        cur.execute("DELETE FROM account WHERE client_id = %s", (client,))
+        con.close()
+    else:
+        print("skip read-your-writes catch-up and paused replay (replica is not a standby)")
+
+    # A replica read that fails after its connection was handed out runs again on the primary
+    wait_for_check()
+    tried = []
+    def drop_on_replica(cur):
+        tried.append(server(cur.connection))
+        if tried[-1] != primary:
+            cur.execute("SELECT pg_terminate_backend(pg_backend_pid())")
+        return tried[-1]
+    answer = utils.run_read(drop_on_replica)
+    results.append(check("replica failing mid-query retries on the primary",
+                         answer == primary and tried[0] != primary, " -> ".join(map(str, tried))))
+    results.append(check("and is skipped until its next check", answered_by(0) == primary))
+
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
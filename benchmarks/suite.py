@@ -0,0 +1,199 @@
+"""
+CPU benchmark suite for the correction pipeline.
+
+Generates synthetic corpora (short/free-tier, medium, book-length; clean,
+error-dense and blacklist-heavy) and times each stage of correct_text with
+the LLM replaced by a deterministic stub: normalization, diffing,
+censoring, HTML rendering, clean-text extraction, pricing and the whole
+correct_text call. Every call runs with the caches cleared; fast stages are
+looped so each sample is long enough to time. Reports median time per call,
+words/s and peak traced memory, and can save the results as JSON and compare
+a run against a saved one.
+
+    python -m benchmarks.suite [--sizes short medium book] [--variants clean errors blacklist]
+                               [--repeat 3] [--save [PATH]] [--compare PATH] [--threshold 0.15]
+
+No database or model is needed; censor-log writes are discarded.
+"""
+import argparse, json, os, platform, random, statistics, subprocess, time, tracemalloc
+from datetime import datetime, timezone
+import streamlit as st
+import utils
+from censor import PhraseMatcher
+from diff_engine import diff_opcodes
+
+SIZES = {"short": 15, "medium": 2_000, "book": 100_000}
+VARIANTS = ("clean", "errors", "blacklist")
+MIN_SAMPLE_S = 0.02
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Error injections the stub model undoes: correct form -> wrong form
+ERRORS = {"am": "is", "a": "an", "goes": "go", "were": "was", "has": "have", "their": "there"}
+
+def make_corpus(n_words: int, variant: str, rng: random.Random) -> tuple[str, str, list[str]]:
+    """Return (input text, the stub model's correction, blacklist)."""
+    vocab = [f"word{i}" for i in range(5000)]
+    blacklist = [f"bad{i}" for i in range(5000 if variant == "blacklist" else 200)]
+    # a fifth of the blacklist entries are two-word phrases
+    for i in range(0, len(blacklist), 5):
+        blacklist[i] = f"{blacklist[i]} {blacklist[i + 1]}"
+    error_rate = {"clean": 0.0, "errors": 0.12, "blacklist": 0.05}[variant]
+    bad_rate = 0.05 if variant == "blacklist" else 0.002
+
+    correct, wrong = [], []
+    paragraph_len = rng.randint(40, 120)
+    for i in range(n_words):
+        r = rng.random()
+        bad = None
+        if r < error_rate:
+            word = rng.choice(list(ERRORS))
+            bad = ERRORS[word]
+        elif r < error_rate + bad_rate:
+            word = rng.choice(blacklist).split()[0]
+        else:
+            word = rng.choice(vocab)
+        tail = "." if (i + 1) % 12 == 0 else ""
+        correct.append(word + tail)
+        wrong.append((bad or word) + tail)
+        if (i + 1) % paragraph_len == 0 and i + 1 < n_words:
+            correct.append("\n\n")
+            wrong.append("\n\n")
+    join = lambda ws: " ".join(ws).replace(" \n\n ", "\n\n")
+    return join(wrong), join(correct), blacklist
+
+class StubLLM:
+    """Deterministic stand-in for ollama.Client: maps known inputs to their corrections."""
+
+    def __init__(self, corrections: dict[str, str]):
+        self.corrections = corrections
+
+    def generate(self, model: str, prompt: str, options: dict) -> dict:
+        text = prompt.rsplit("Input: ", 1)[-1].rsplit("\n\nOutput:", 1)[0]
+        return {"response": self.corrections.get(text, text)}
+
+def clear_caches():
+    utils._normalize_cache.clear()
+    utils._clean_text_cache.clear()
+    st.session_state.pop("_edit_analyses", None)
+
+def run_correct_text(text: str):
+    st.session_state["type"] = "F"
+    st.session_state["client_id"] = "bench"
+    utils.correct_text(text)
+
+def stages(text: str, corrected: str, matcher: PhraseMatcher) -> dict:
+    words, _ = utils.layout_words(utils.normalize_punctuation(corrected))
+    analysis = utils.get_edit_analysis(text, corrected)
+    html_body, _, _ = utils.render_correction(analysis, matcher)
+    html = f"<div>{html_body}</div>"
+    return {
+        "normalize": lambda: utils.normalize_punctuation(text),
+        "diff": lambda: diff_opcodes(text.split(), corrected.split()),
+        "censor": lambda: matcher.mask(words),
+        "render": lambda: utils.render_correction(analysis, matcher),
+        "clean_text": lambda: utils.html_to_clean_text(html),
+        "pricing": lambda: utils.count_price(text, corrected),
+        "correct_text": lambda: run_correct_text(text),
+    }
+
+def timed(fn, loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        clear_caches()
+        fn()
+    return (time.perf_counter() - start) / loops
+
+def measure(fn, repeat: int) -> tuple[float, float]:
+    # Fast stages are looped until a sample takes MIN_SAMPLE_S, so timer
+    # resolution and noise don't dominate the short corpora
+    loops = 1
+    while timed(fn, loops) * loops < MIN_SAMPLE_S and loops < 1 << 16:
+        loops *= 2
+    seconds = statistics.median(timed(fn, loops) for _ in range(repeat))
+    # Peak memory from one extra traced run, so tracing doesn't skew the timings
+    clear_caches()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline: dict, threshold: float) -> int:
+    regressions = 0
+    print(f"\n{'corpus':<18} {'stage':<13} {'base ms':>10} {'now ms':>10} {'change':>8}")
+    for corpus, by_stage in results.items():
+        for stage, row in by_stage.items():
+            old = baseline.get(corpus, {}).get(stage)
+            if not old:
+                continue
+            change = row["ms"] / old["ms"] - 1 if old["ms"] else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{corpus:<18} {stage:<13} {old['ms']:>10.2f} {row['ms']:>10.2f} {change:>+7.0%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--stages", nargs="+", default=None, help="subset of stages to run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", nargs="?", const="", default=None,
+                        help="write results as JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--threshold", type=float, default=0.15, help="slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    # Censored words would be queued for a database that isn't there
+    utils.censor_log.log = lambda client_id, words: None
+
+    results = {}
+    print(f"{'corpus':<18} {'stage':<13} {'ms':>10} {'words/s':>12} {'peak KB':>10}")
+    for size in args.sizes:
+        for variant in args.variants:
+            rng = random.Random(f"{args.seed}-{size}-{variant}")
+            text, corrected, blacklist = make_corpus(SIZES[size], variant, rng)
+            matcher = PhraseMatcher(blacklist)
+            utils.get_llm = lambda stub=StubLLM({text: corrected}): stub
+            utils.get_censor = lambda m=matcher: m
+            n_words = len(text.split())
+            corpus = f"{size}/{variant}"
+            results[corpus] = {}
+            for stage, fn in stages(text, corrected, matcher).items():
+                if args.stages and stage not in args.stages:
+                    continue
+                seconds, peak = measure(fn, args.repeat)
+                row = {"ms": seconds * 1000, "words_per_s": n_words / seconds if seconds else 0.0,
+                       "peak_kb": peak / 1024, "words": n_words}
+                results[corpus][stage] = row
+                print(f"{corpus:<18} {stage:<13} {row['ms']:>10.2f} {row['words_per_s']:>12,.0f} {row['peak_kb']:>10,.0f}")
+
+    if args.save is not None:
+        path = args.save or os.path.join(
+            RESULTS_DIR, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"created": datetime.now(timezone.utc).isoformat(), "git": git_revision(),
+                "python": platform.python_version(), "machine": platform.platform(),
+                "repeat": args.repeat, "seed": args.seed}
+        with open(path, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1)
+        print(f"\nsaved {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import atexit, hashlib, queue, re, threading, time
+from typing import Callable, Iterable
+from psycopg2.extras import execute_values
+
+_NON_WORD = re.compile(r"\W+")
+_END = object()
+
+# Blacklist comparison form of a word: letters/digits only, lowercase
+def clean_token(word: str) -> str:
+    return _NON_WORD.sub("", word).lower()
+
+class PhraseMatcher:
+    """
+    Token-level trie over single words and multi-word phrases.
+    Built once, then scan() finds every leftmost-longest match in a single
+    pass over a word list, however many phrases were compiled in. version
+    is a digest of the compiled phrase set: equal for any two matchers that
+    censor the same phrases.
+    """
+
+    def __init__(self, phrases: Iterable[str], key: Callable[[str], str] = clean_token):
+        self.key = key
+        self.root = {}
+        self.size = 0
+        compiled = set()
+        for phrase in phrases:
+            tokens = [t for t in (key(w) for w in phrase.split()) if t]
+            if not tokens:
+                continue
+            node = self.root
+            for t in tokens:
+                node = node.setdefault(t, {})
+            if _END not in node:
+                self.size += 1
+            node[_END] = " ".join(tokens)
+            compiled.add(node[_END])
+        self.version = hashlib.blake2b("\n".join(sorted(compiled)).encode(), digest_size=16).hexdigest()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def scan(self, words: list[str]) -> list[tuple[int, int, str]]:
+        """Return (start, end, phrase) for each non-overlapping match."""
+        if not self.root:
+            return []
+        root, key = self.root, self.key
+        keyed = {}
+        # Each word is keyed once, however often it repeats
+        toks = [keyed[w] if w in keyed else keyed.setdefault(w, key(w)) for w in words]
+        hits = []
+        i, n = 0, len(toks)
+        while i < n:
+            node = root.get(toks[i])
+            if node is None:
+                i += 1
+                continue
+            best = None
+            j = i + 1
+            while True:
+                if _END in node:
+                    best = (j, node[_END])
+                if j == n:
+                    break
+                node = node.get(toks[j])
+                if node is None:
+                    break
+                j += 1
+            if best:
+                hits.append((i, best[0], best[1]))
+                i = best[0]
+            else:
+                i += 1
+        return hits
+
+    def mask(self, words: list[str]) -> list[str | None]:
+        """Per-word matched phrase (or None), for callers that render word by word."""
+        out = [None] * len(words)
+        for start, end, phrase in self.scan(words):
+            out[start:end] = [phrase] * (end - start)
+        return out
+
+class CensorLogWriter:
+    """
+    Write-behind queue for censor_log rows.
+    log() only enqueues; a daemon thread flushes with one multi-row INSERT
+    when batch_size events are waiting or flush_interval seconds have passed,
+    and once more at interpreter shutdown. When the queue is full, events are
+    dropped and counted rather than blocking the correction path; a batch
+    whose INSERT fails is counted as failed.
+    """
+
+    def __init__(self, connect: Callable, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 2.0, late_after: float = 10.0):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.late_after = late_after
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.failed = 0
+        self.late = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def log(self, client_id: str, words: Iterable[str]) -> None:
+        self._ensure_started()
+        ts = int(time.time())
+        for w in words:
+            try:
+                self.queue.put_nowait((client_id, w, ts, time.monotonic()))
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": self.queue.qsize(), "written": self.written,
+                    "dropped": self.dropped, "failed": self.failed, "late": self.late}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="censor-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._collect(time.monotonic() + self.flush_interval)
+            if batch:
+                self._flush(batch)
+
+    # Gather up to batch_size events, waiting no later than deadline
+    def _collect(self, deadline: float) -> list[tuple]:
+        batch = []
+        while len(batch) < self.batch_size and not self._stop.is_set():
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(timeout, 0.5)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _flush(self, batch: list[tuple]) -> None:
+        try:
+            con = self.connect()
+            try:
+                cur = con.cursor()
+                execute_values(
+                    cur,
+                    "INSERT INTO censor_log (client_id, original_word, event_ts) VALUES %s",
+                    [(client_id, w, ts) for client_id, w, ts, _ in batch],
+                    page_size=self.batch_size
+                )
+                con.commit()
+            finally:
+                con.close()
+        except Exception:
+            # Losing a batch of log rows beats stalling or crashing the writer
+            with self._lock:
+                self.failed += len(batch)
+            return
+        now = time.monotonic()
+        with self._lock:
+            self.written += len(batch)
+            self.late += sum(1 for *_, queued in batch if now - queued > self.late_after)
+
+    # Drain whatever is still queued; called at shutdown
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) == self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
@@ -0,0 +1,207 @@
+import json, re
+from typing import Iterable, Iterator
+
+# Text operations over a whole document: a list of components where a
+# positive int retains that many characters, a negative int deletes that
+# many, and a str inserts it. Every op spans the full length of the text it
+# applies to, so a mismatched base is caught instead of silently corrupting.
+
+# Append one component, merging with the previous one where possible
+def _push(op: list, c) -> None:
+    if not c:
+        return
+    if op:
+        last = op[-1]
+        if isinstance(c, str):
+            if isinstance(last, str):
+                op[-1] = last + c
+                return
+            # Canonical order: an insert goes before an adjacent delete
+            if last < 0:
+                if len(op) > 1 and isinstance(op[-2], str):
+                    op[-2] += c
+                else:
+                    op.insert(len(op) - 1, c)
+                return
+        elif isinstance(last, int) and (c > 0) == (last > 0):
+            op[-1] = last + c
+            return
+    op.append(c)
+
+def _common_prefix_len(a: str, b: str) -> int:
+    # Binary search on slice equality keeps the comparisons in C
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+# Smallest single-region op turning old into new, or None if equal
+def diff_op(old: str, new: str) -> list | None:
+    if old == new:
+        return None
+    p = _common_prefix_len(old, new)
+    s = _common_prefix_len(old[p:][::-1], new[p:][::-1])
+    op = []
+    _push(op, p)
+    _push(op, new[p:len(new) - s])
+    _push(op, -(len(old) - p - s))
+    _push(op, s)
+    return op
+
+def apply_op(text: str, op: list) -> str:
+    out, i = [], 0
+    for c in op:
+        if isinstance(c, str):
+            out.append(c)
+        elif c > 0:
+            if i + c > len(text):
+                raise ValueError("operation retains past the end of the text")
+            out.append(text[i:i + c])
+            i += c
+        else:
+            i -= c
+    if i != len(text):
+        raise ValueError("operation does not span the whole text")
+    return "".join(out)
+
+def transform(a: list, b: list) -> tuple[list, list]:
+    """
+    For two ops on the same text, return (a2, b2) with
+    apply(apply(t, a), b2) == apply(apply(t, b), a2).
+    Inserts at the same position put a's text first.
+    """
+    a2, b2 = [], []
+    ia, ib = iter(a), iter(b)
+    x, y = next(ia, None), next(ib, None)
+    while x is not None or y is not None:
+        if isinstance(x, str):
+            _push(a2, x)
+            _push(b2, len(x))
+            x = next(ia, None)
+            continue
+        if isinstance(y, str):
+            _push(a2, len(y))
+            _push(b2, y)
+            y = next(ib, None)
+            continue
+        if x is None or y is None:
+            raise ValueError("operations do not share a base text")
+        m = min(abs(x), abs(y))
+        if x > 0 and y > 0:
+            _push(a2, m)
+            _push(b2, m)
+        elif x < 0 < y:
+            _push(a2, -m)
+        elif y < 0 < x:
+            _push(b2, -m)
+        # both deleting the same characters: nothing left to do on either side
+        x = x - m if x > 0 else x + m
+        y = y - m if y > 0 else y + m
+        if x == 0:
+            x = next(ia, None)
+        if y == 0:
+            y = next(ib, None)
+    return a2, b2
+
+# Rewrite op so it applies after ops that were committed since its base
+def rebase(op: list, committed: list[list]) -> list:
+    for c in committed:
+        op = transform(c, op)[1]
+    return op
+
+# Compact wire/storage form: '[12,"word",-3,40]'
+def dump_op(op: list) -> str:
+    return json.dumps(op, separators=(",", ":"), ensure_ascii=False)
+
+def load_op(data: str) -> list:
+    return json.loads(data)
+
+# Restrict an op on the whole text to the window [start, end) of it.
+# Returns (window_op, new_start, new_end, new_total). Text inserted exactly
+# at a window edge belongs to the neighbouring text, except at the ends of
+# the document, where it would otherwise be invisible to the window.
+def window_op(op: list, start: int, end: int, total: int) -> tuple[list, int, int, int]:
+    wop = []
+    pos = 0
+    new_start, new_end, new_total = start, end, total
+    for c in op:
+        if isinstance(c, str):
+            n = len(c)
+            new_total += n
+            if start < pos < end or (pos == start == 0) or (pos == end == total):
+                _push(wop, c)
+                new_end += n
+            elif pos <= start:
+                new_start += n
+                new_end += n
+            continue
+        n = abs(c)
+        lo, hi = max(pos, start), min(pos + n, end)
+        inside = max(0, hi - lo)
+        if c < 0:
+            before = max(0, min(pos + n, start) - pos)
+            new_total -= n
+            new_start -= before
+            new_end -= before + inside
+        _push(wop, inside if c > 0 else -inside)
+        pos += n
+    return wop, new_start, new_end, new_total
+
+# Turn an op on the window [start, end) into one on the whole text
+def widen_op(wop: list, start: int, end: int, total: int) -> list:
+    op = []
+    _push(op, start)
+    for c in wop:
+        _push(op, c)
+    _push(op, total - end)
+    return op
+
+# apply_op over a stream of text pieces, yielding the result piece by piece
+def apply_op_stream(op: list, pieces: Iterable[str]) -> Iterator[str]:
+    it = iter(pieces)
+    buf, i = "", 0
+    def take(n: int):
+        nonlocal buf, i
+        while n:
+            if i == len(buf):
+                buf, i = next(it), 0
+                continue
+            k = min(n, len(buf) - i)
+            yield buf[i:i + k]
+            i += k
+            n -= k
+    for c in op:
+        if isinstance(c, str):
+            yield c
+        elif c > 0:
+            yield from take(c)
+        else:
+            for _ in take(-c):
+                pass
+    # Anything left means the op did not span the text
+    if buf[i:] or next(it, ""):
+        raise ValueError("operation does not span the whole text")
+
+_PARA_BREAK = re.compile(r"\n[ \t]*\n\s*")
+
+# Cut text into consecutive spans that concatenate back to it exactly: one
+# per paragraph (with the blank lines after it), long paragraphs split at a
+# newline or space so no chunk exceeds max_chars
+def chunk_spans(text: str, max_chars: int = 16384) -> list[tuple[int, int]]:
+    spans = []
+    start = 0
+    ends = [m.end() for m in _PARA_BREAK.finditer(text)] + [len(text)]
+    for end in ends:
+        while end - start > max_chars:
+            cut = max(text.rfind("\n", start, start + max_chars), text.rfind(" ", start, start + max_chars))
+            cut = cut + 1 if cut > start else start + max_chars
+            spans.append((start, cut))
+            start = cut
+        if end > start:
+            spans.append((start, end))
+            start = end
+    return spans
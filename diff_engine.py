@@ -0,0 +1,259 @@
+import numpy as np
+from bisect import bisect_left
+
+# Gaps up to MYERS_MAX_GAP words get an exact Myers diff; past MYERS_MAX_D
+# edits the search stops and the gap is reported as a replacement. Larger
+# gaps are first split at unique runs of ANCHOR_WIDTHS words (patience diff).
+MYERS_MAX_D = 512
+MYERS_MAX_GAP = 4096
+ANCHOR_WIDTHS = (1, 2, 3, 4)
+
+# Map words to integer ids shared by both documents
+def intern_tokens(a_words: list[str], b_words: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    table = {}
+    a = np.fromiter((table.setdefault(w, len(table)) for w in a_words), dtype=np.int32, count=len(a_words))
+    b = np.fromiter((table.setdefault(w, len(table)) for w in b_words), dtype=np.int32, count=len(b_words))
+    return a, b
+
+# Length of the common prefix of two id arrays
+def _common_prefix(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(len(a), len(b))
+    if not n:
+        return 0
+    neq = np.flatnonzero(a[:n] != b[:n])
+    return int(neq[0]) if len(neq) else n
+
+# Hash every k-word window of an id array (wrapping uint64 arithmetic)
+def _kgram_keys(ids: np.ndarray, k: int) -> np.ndarray:
+    if k == 1:
+        return ids
+    keys = np.zeros(len(ids) - k + 1, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for t in range(k):
+            keys = keys * np.uint64(1000003) + ids[t:len(ids) - k + 1 + t].astype(np.uint64)
+    return keys
+
+# k-word runs that occur exactly once in both slices, paired by position and
+# reduced to their longest increasing chain (the patience anchors)
+def _unique_anchors(sa: np.ndarray, sb: np.ndarray, k: int = 1) -> list[tuple[int, int]]:
+    if len(sa) < k or len(sb) < k:
+        return []
+    ka, kb = _kgram_keys(sa, k), _kgram_keys(sb, k)
+    ua, ia, ca = np.unique(ka, return_index=True, return_counts=True)
+    ub, ib, cb = np.unique(kb, return_index=True, return_counts=True)
+    once_a, pos_a = ua[ca == 1], ia[ca == 1]
+    once_b, pos_b = ub[cb == 1], ib[cb == 1]
+    _, xa, xb = np.intersect1d(once_a, once_b, assume_unique=True, return_indices=True)
+    if not len(xa):
+        return []
+    pa, pb = pos_a[xa], pos_b[xb]
+    order = np.argsort(pa)
+    pa, pb = pa[order].tolist(), pb[order].tolist()
+
+    # Patience sort for the longest increasing subsequence of pb
+    tails, tail_idx, back = [], [], [-1] * len(pb)
+    for i, y in enumerate(pb):
+        t = bisect_left(tails, y)
+        if t == len(tails):
+            tails.append(y)
+            tail_idx.append(i)
+        else:
+            tails[t] = y
+            tail_idx[t] = i
+        back[i] = tail_idx[t - 1] if t else -1
+    chain = []
+    i = tail_idx[-1]
+    while i != -1:
+        chain.append((pa[i], pb[i]))
+        i = back[i]
+    chain.reverse()
+
+    # Drop (for k > 1) hash collisions, then overlapping windows
+    if k > 1:
+        xs, ys = np.array([c[0] for c in chain]), np.array([c[1] for c in chain])
+        ok = np.ones(len(chain), dtype=bool)
+        for t in range(k):
+            ok &= sa[xs + t] == sb[ys + t]
+        chain = [c for c, keep in zip(chain, ok.tolist()) if keep]
+    out = []
+    end_a = end_b = 0
+    for x, y in chain:
+        if x >= end_a and y >= end_b:
+            out.append((x, y))
+            end_a, end_b = x + k, y + k
+    return out
+
+# Classic O(ND) Myers diff on a small gap; returns matched (i, j) pairs
+# or None when the edit distance exceeds MYERS_MAX_D
+def _myers(a: list[int], b: list[int]) -> list[tuple[int, int]] | None:
+    n, m = len(a), len(b)
+    limit = min(n + m, MYERS_MAX_D)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    trace = []
+    for d in range(limit + 1):
+        trace.append(v[:])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m, offset)
+    return None
+
+def _myers_backtrack(trace: list[list[int]], x: int, y: int, offset: int) -> list[tuple[int, int]]:
+    pairs = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[offset + prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            pairs.append((x, y))
+        if d > 0:
+            x, y = prev_x, prev_y
+    pairs.reverse()
+    return pairs
+
+# Matching blocks (i, j, size) over the whole document, patience-anchored
+def matching_blocks(a: np.ndarray, b: np.ndarray) -> list[tuple[int, int, int]]:
+    a_list, b_list = a.tolist(), b.tolist()
+    blocks = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        # Small gaps get an exact Myers diff on plain lists, where numpy's
+        # per-call overhead would dominate
+        if (ahi - alo) + (bhi - blo) <= MYERS_MAX_GAP:
+            pairs = _myers(a_list[alo:ahi], b_list[blo:bhi])
+            if pairs is not None:
+                blocks.extend((alo + i, blo + j, 1) for i, j in pairs)
+                continue
+
+        # Trim common prefix and suffix in one vectorized compare each
+        p = _common_prefix(a[alo:ahi], b[blo:bhi])
+        if p:
+            blocks.append((alo, blo, p))
+            alo += p
+            blo += p
+        s = _common_prefix(a[alo:ahi][::-1], b[blo:bhi][::-1])
+        if s:
+            blocks.append((ahi - s, bhi - s, s))
+            ahi -= s
+            bhi -= s
+        if alo == ahi or blo == bhi:
+            continue
+
+        # Repetitive text may have no unique single words, so widen the
+        # anchor to unique word pairs, triples, ... before giving up
+        anchors = []
+        for k in ANCHOR_WIDTHS:
+            anchors = _unique_anchors(a[alo:ahi], b[blo:bhi], k)
+            if anchors:
+                break
+        if anchors:
+            prev_a, prev_b = alo, blo
+            for pa, pb in anchors:
+                pa += alo
+                pb += blo
+                blocks.append((pa, pb, k))
+                stack.append((prev_a, pa, prev_b, pb))
+                prev_a, prev_b = pa + k, pb + k
+            stack.append((prev_a, ahi, prev_b, bhi))
+            continue
+
+        if (ahi - alo) + (bhi - blo) > MYERS_MAX_GAP:
+            pairs = _myers(a_list[alo:ahi], b_list[blo:bhi])
+            blocks.extend((alo + i, blo + j, 1) for i, j in pairs or ())
+
+    blocks.sort()
+    # Merge adjacent runs so opcodes come out as SequenceMatcher would
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    return merged
+
+# SequenceMatcher-compatible opcodes for two word lists
+def diff_opcodes(a_words: list[str], b_words: list[str]) -> list[tuple[str, int, int, int, int]]:
+    return opcodes_from_ids(*intern_tokens(a_words, b_words))
+
+# Same, for token arrays that were already interned
+def opcodes_from_ids(a: np.ndarray, b: np.ndarray) -> list[tuple[str, int, int, int, int]]:
+    ops = []
+    i = j = 0
+    for ai, bj, size in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if i < ai or j < bj:
+            _push(ops, [False, i, ai, j, bj])
+            # Each new change may slide into the one before it
+            while len(ops) >= 3 and not ops[-1][0] and ops[-2][0] and not ops[-3][0]:
+                slid = _slide(ops[-3], ops[-2], ops[-1], a, b)
+                if slid is None:
+                    break
+                del ops[-3:]
+                for op in slid:
+                    _push(ops, op)
+        if size:
+            _push(ops, [True, ai, ai + size, bj, bj + size])
+        i, j = ai + size, bj + size
+    return [(_tag(*op), *op[1:]) for op in ops]
+
+def _tag(equal: bool, i1: int, i2: int, j1: int, j2: int) -> str:
+    if equal:
+        return "equal"
+    if i1 < i2 and j1 < j2:
+        return "replace"
+    return "delete" if i1 < i2 else "insert"
+
+# Append an op, extending the last one when it is of the same kind
+def _push(ops: list[list], op: list) -> None:
+    if ops and ops[-1][0] == op[0]:
+        ops[-1][2], ops[-1][4] = op[2], op[4]
+    else:
+        ops.append(op)
+
+# Changes a and c around the equal run e. A pure deletion or insertion that
+# sits in repeated words ("the the") can move across e without changing
+# either text; moving it onto the other change turns delete + insert into
+# one replace, as SequenceMatcher reports it (and edit_cost prices it).
+# Returns the ops replacing a, e, c, or None when neither can move.
+def _slide(a_op: list, e_op: list, c_op: list, a: np.ndarray, b: np.ndarray) -> list[list] | None:
+    size = e_op[2] - e_op[1]
+    _, ci1, ci2, cj1, cj2 = c_op
+    _, ai1, ai2, aj1, aj2 = a_op
+    if cj1 == cj2 and np.array_equal(a[ci1 - size:ci1], a[ci2 - size:ci2]):
+        n = ci2 - ci1
+        return [[False, ai1, ai2 + n, aj1, aj2], [True, ai2 + n, ci2, e_op[3], e_op[4]]]
+    if ci1 == ci2 and np.array_equal(b[cj1 - size:cj1], b[cj2 - size:cj2]):
+        n = cj2 - cj1
+        return [[False, ai1, ai2, aj1, aj2 + n], [True, e_op[1], e_op[2], aj2 + n, cj2]]
+    if aj1 == aj2 and np.array_equal(a[ai1:ai1 + size], a[ai2:ai2 + size]):
+        return [[True, ai1, ai1 + size, e_op[3], e_op[4]], [False, ai1 + size, ci2, cj1, cj2]]
+    if ai1 == ai2 and np.array_equal(b[aj1:aj1 + size], b[aj2:aj2 + size]):
+        return [[True, e_op[1], e_op[2], aj1, aj1 + size], [False, ci1, ci2, aj1 + size, cj2]]
+    return None
+
+# Number of words changed: deletions count removed words, everything else
+# counts the words written in their place
+def edit_cost(opcodes: list[tuple[str, int, int, int, int]]) -> int:
+    cost = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "delete":
+            cost += i2 - i1
+        elif tag != "equal":
+            cost += j2 - j1
+    return cost
@@ -0,0 +1,91 @@
+import threading, time
+from collections import OrderedDict
+from typing import Callable
+from session_store import pack, unpack
+
+class FlowStore:
+    """
+    Server-side flow state, one row per (client_id, flow_id): the flow id
+    (one per login, carried in the URL) only names a user's state, so it is
+    always looked up together with the already logged-in user. Each write
+    bumps the row's version; this process keeps the last version it read or
+    wrote, so loading an unchanged row transfers no data.
+    """
+
+    def __init__(self, connect: Callable, ttl: float = 12 * 3600, max_cached: int = 512):
+        self.connect = connect
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key: tuple[str, str], version: int, data: dict) -> None:
+        with self._lock:
+            self._cache[key] = (version, data)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    # The user's data for a live flow id, or None if unknown, expired or unreadable
+    def load(self, client_id: str, flow_id: str) -> dict | None:
+        key = (client_id, flow_id)
+        with self._lock:
+            cached = self._cache.get(key)
+        con = self.connect()
+        cur = con.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT version,
+                       CASE WHEN version = %s THEN NULL ELSE data END AS data
+                FROM flow_state
+                WHERE client_id = %s AND flow_id = %s AND updated_ts >= %s
+                """,
+                (cached[0] if cached else -1, client_id, flow_id, int(time.time() - self.ttl))
+            )
+            row = cur.fetchone()
+        finally:
+            con.close()
+        if row is None:
+            return None
+        if row["data"] is None:
+            return dict(cached[1])
+        try:
+            data = unpack(bytes(row["data"]))
+        except ValueError:
+            return None
+        self._remember(key, row["version"], data)
+        return dict(data)
+
+    def save(self, client_id: str, flow_id: str, data: dict) -> None:
+        now = int(time.time())
+        con = self.connect()
+        cur = con.cursor()
+        try:
+            cur.execute(
+                """
+                INSERT INTO flow_state (client_id, flow_id, data, version, updated_ts)
+                VALUES (%s, %s, %s, 1, %s)
+                ON CONFLICT (client_id, flow_id) DO UPDATE
+                SET data = EXCLUDED.data, version = flow_state.version + 1, updated_ts = EXCLUDED.updated_ts
+                RETURNING version
+                """,
+                (client_id, flow_id, pack(data), now)
+            )
+            row = cur.fetchone()
+            cur.execute("DELETE FROM flow_state WHERE updated_ts < %s", (now - self.ttl,))
+            con.commit()
+        finally:
+            con.close()
+        self._remember((client_id, flow_id), row["version"], data)
+
+    def delete(self, client_id: str, flow_id: str) -> None:
+        with self._lock:
+            self._cache.pop((client_id, flow_id), None)
+        con = self.connect()
+        cur = con.cursor()
+        try:
+            cur.execute("DELETE FROM flow_state WHERE client_id = %s AND flow_id = %s", (client_id, flow_id))
+            con.commit()
+        finally:
+            con.close()
@@ -0,0 +1,145 @@
+import atexit, os, threading, time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Input sizes are reported in a few coarse buckets so the label set stays small
+SIZE_BUCKETS = ((20, "0-20"), (200, "21-200"), (2000, "201-2000"), (20000, "2001-20000"))
+
+def size_bucket(words: int) -> str:
+    for limit, name in SIZE_BUCKETS:
+        if words <= limit:
+            return name
+    return "20001+"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class StageMetrics:
+    """
+    In-process timing spans, one series per (flow, stage, tier, size) label
+    set. Each series keeps a count and sum plus the most recent `window`
+    samples, from which p50/p95/p99 are computed at export time. render()
+    gives the Prometheus text format (a summary per series, plus any counters
+    or gauges from add_collector); the exporters serve it over HTTP or
+    rewrite a file periodically.
+    """
+
+    def __init__(self, name: str = "app_stage_seconds", window: int = 2048):
+        self.name = name
+        self.window = window
+        self._series = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+
+    def observe(self, seconds: float, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0, 0.0, deque(maxlen=self.window)]
+            series[0] += 1
+            series[1] += seconds
+            series[2].append(seconds)
+
+    # Time the block; recorded even if it raises (st.stop() included), since
+    # slow failures are exactly what these are for
+    @contextmanager
+    def span(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    # Another metric read at export time; collect() returns [(labels, value)]
+    def add_collector(self, name: str, kind: str, help: str, collect: Callable[[], list[tuple[dict, float]]]) -> None:
+        with self._lock:
+            self._collectors.append((name, kind, help, collect))
+
+    # {label tuple: {"count", "sum", "p50", "p95", "p99"}}
+    def snapshot(self) -> dict:
+        with self._lock:
+            series = {k: (n, total, sorted(samples)) for k, (n, total, samples) in self._series.items()}
+        out = {}
+        for key, (n, total, samples) in series.items():
+            row = {"count": n, "sum": total}
+            for q in QUANTILES:
+                row[f"p{round(q * 100)}"] = samples[min(len(samples) - 1, int(q * len(samples)))]
+            out[key] = row
+        return out
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} Duration of request stages in seconds.",
+                 f"# TYPE {self.name} summary"]
+        for key, row in sorted(self.snapshot().items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+            sep = "," if labels else ""
+            for q in QUANTILES:
+                lines.append(f'{self.name}{{{labels}{sep}quantile="{q}"}} {row[f"p{round(q * 100)}"]:.6f}')
+            lines.append(f"{self.name}_sum{{{labels}}} {row['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {row['count']}")
+        with self._lock:
+            collectors = list(self._collectors)
+        for name, kind, help, collect in collectors:
+            try:
+                samples = collect()
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        atexit.register(server.shutdown)
+        return server
+
+    # Rewrite path every interval seconds (and at exit), e.g. for node_exporter's
+    # textfile collector; the replace is atomic so readers never see half a file
+    def write_every(self, path: str, interval: float = 15.0) -> None:
+        def write():
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    write()
+                except OSError:
+                    pass
+
+        thread = threading.Thread(target=run, name="metrics-file", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        atexit.register(lambda: (self._stop.set(), write()))
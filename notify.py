@@ -0,0 +1,133 @@
+import atexit, json, select, threading
+from collections import OrderedDict
+from typing import Callable
+import psycopg2
+from replicas import primary_lsn
+
+CHANNEL = "app_events"
+
+# Queue a notification on the writer's cursor; Postgres delivers it to every
+# listener when that statement's transaction commits
+def publish(cur, kind: str, user: str) -> None:
+    cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps({"kind": kind, "user": user})))
+
+class NotificationHub:
+    """
+    Per-process LISTEN connection plus in-memory per-user notification state.
+    get() serves (kind, user) rows from memory and only runs the loader after
+    a NOTIFY for that pair (or on first use). While the listener is down the
+    state is not trusted: get() returns None and callers query as before.
+    """
+
+    def __init__(self, dsn: str, max_entries: int = 10000, poll_interval: float = 5.0,
+                 retry_after: float = 5.0):
+        self.dsn = dsn
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+        self.retry_after = retry_after
+        self.healthy = False
+        self.events = 0
+        self._state = OrderedDict()
+        self._gen = {}
+        self._versions = {}
+        self._changed = {}
+        self._connected_lsn = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="notify-listener", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def get(self, kind: str, user: str, loader: Callable[[str], list]) -> list | None:
+        key = (kind, user)
+        with self._lock:
+            if not self.healthy:
+                return None
+            if key in self._state:
+                self._state.move_to_end(key)
+                return self._state[key]
+            gen = self._gen.get(key, 0)
+        rows = loader(user)
+        with self._lock:
+            # A NOTIFY that raced the load leaves the entry empty for next time
+            if self.healthy and self._gen.get(key, 0) == gen:
+                self._state[key] = rows
+                while len(self._state) > self.max_entries:
+                    self._state.popitem(last=False)
+        return rows
+
+    # Bumped on every event for the user; lets pages notice changes without a query
+    def version(self, user: str) -> int:
+        with self._lock:
+            return self._versions.get(user, 0)
+
+    # WAL position a load for (kind, user) must have: the primary's position
+    # when the last event for the pair arrived (after its commit), or when the
+    # listener (re)connected if that came later
+    def changed_lsn(self, kind: str, user: str) -> int:
+        with self._lock:
+            return max(self._changed.get((kind, user), 0), self._connected_lsn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"healthy": self.healthy, "entries": len(self._state), "events": self.events}
+
+    def _on_event(self, payload: str, lsn: int) -> None:
+        try:
+            event = json.loads(payload)
+            key = (event["kind"], event["user"])
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            self.events += 1
+            self._state.pop(key, None)
+            self._gen[key] = self._gen.get(key, 0) + 1
+            self._versions[key[1]] = self._versions.get(key[1], 0) + 1
+            self._changed[key] = lsn
+
+    def _set_healthy(self, healthy: bool, lsn: int = 0) -> None:
+        with self._lock:
+            self.healthy = healthy
+            # Events may have been missed while disconnected
+            self._connected_lsn = lsn
+            self._changed.clear()
+            self._state.clear()
+            self._gen.clear()
+            for user in self._versions:
+                self._versions[user] += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            con = None
+            try:
+                con = psycopg2.connect(self.dsn)
+                con.autocommit = True
+                con.cursor().execute(f"LISTEN {CHANNEL}")
+                self._set_healthy(True, primary_lsn(con))
+                while not self._stop.is_set():
+                    if select.select([con], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    con.poll()
+                    # Delivered after their commits, so the position read next
+                    # covers them (ones arriving meanwhile get their own read)
+                    while con.notifies:
+                        pending = con.notifies[:]
+                        del con.notifies[:]
+                        lsn = primary_lsn(con)
+                        for n in pending:
+                            self._on_event(n.payload, lsn)
+            except Exception:
+                pass
+            finally:
+                if self.healthy:
+                    self._set_healthy(False)
+                if con is not None:
+                    try:
+                        con.close()
+                    except Exception:
+                        pass
+            self._stop.wait(self.retry_after)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=self.poll_interval + 1)
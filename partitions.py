@@ -0,0 +1,240 @@
+import json, os, re, time, zlib
+from datetime import datetime, timezone
+from typing import Callable
+
+# Append-only tables partitioned by month of event_ts (epoch seconds, UTC).
+# Partitions are named <table>_pYYYYMM; <table>_default catches rows outside
+# every partition and <table>_legacy is the pre-partitioning table, attached
+# as one partition covering everything before partitioning started.
+_UPPER = re.compile(r"TO \('?(-?\d+)'?\)")
+_LOWER = re.compile(r"FROM \('?(-?\d+)'?\)")
+PAGE_ROWS = 5000
+
+def month_start(ts: float, offset: int = 0) -> int:
+    d = datetime.fromtimestamp(ts, timezone.utc)
+    months = d.year * 12 + d.month - 1 + offset
+    return int(datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc).timestamp())
+
+def partition_name(table: str, start: int) -> str:
+    return f"{table}_p{datetime.fromtimestamp(start, timezone.utc):%Y%m}"
+
+def _relkind(cur, name: str) -> str | None:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return row["relkind"] if row else None
+
+def ensure_partitioned(cur, table: str, columns: str) -> None:
+    """
+    Create `table` (columns given as SQL, after the id column) partitioned
+    by range of event_ts with a default partition. An existing plain table
+    of that name becomes <table>_legacy and is attached as the partition for
+    everything before the month after its newest row, keeping its ids.
+    """
+    kind = _relkind(cur, table)
+    if kind == "p":
+        return
+    cur.execute("BEGIN")
+    try:
+        # One process migrates; the others wait and find it done
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"partition {table}",))
+        kind = _relkind(cur, table)
+        if kind == "p":
+            cur.execute("COMMIT")
+            return
+        if kind == "r":
+            # A partition's key has to include the partition column
+            cur.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            cur.execute(f"ALTER TABLE {table}_legacy DROP CONSTRAINT {table}_pkey, "
+                        f"ADD CONSTRAINT {table}_legacy_pkey PRIMARY KEY (id, event_ts)")
+        cur.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq")
+        cur.execute(f"""
+        CREATE TABLE {table} (
+            id  INTEGER NOT NULL DEFAULT nextval('{table}_id_seq'),
+            {columns.strip()},
+            PRIMARY KEY (id, event_ts)
+        ) PARTITION BY RANGE (event_ts)
+        """)
+        cur.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        if kind == "r":
+            cur.execute(f"SELECT MAX(event_ts) AS newest FROM {table}_legacy")
+            newest = cur.fetchone()["newest"]
+            bound = month_start(max(newest or 0, time.time()), 1)
+            cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {table}_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+                        (bound,))
+        cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+
+# (name, lower, upper) of the table's range partitions, oldest first;
+# lower is None for a MINVALUE bound
+def list_partitions(cur, table: str) -> list[tuple[str, int | None, int]]:
+    cur.execute(
+        """
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+          FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+         WHERE i.inhparent = to_regclass(%s)
+        """,
+        (table,)
+    )
+    out = []
+    for row in cur.fetchall():
+        upper = _UPPER.search(row["bound"])
+        if upper is None:
+            continue
+        lower = _LOWER.search(row["bound"])
+        out.append((row["name"], int(lower.group(1)) if lower else None, int(upper.group(1))))
+    out.sort(key=lambda p: (p[2], p[1] if p[1] is not None else -2**63))
+    return out
+
+def ensure_partitions(cur, table: str, now: float, ahead: int = 2) -> list[str]:
+    """
+    Create the monthly partitions from this month to `ahead` months on, and
+    one for every month that has rows sitting in the default partition
+    (moved in first, as ATTACH requires). Returns the partitions created.
+    """
+    cur.execute(f"""
+        SELECT DISTINCT EXTRACT(EPOCH FROM date_trunc('month', to_timestamp(event_ts) AT TIME ZONE 'UTC'))::BIGINT AS ts
+          FROM {table}_default
+    """)
+    stray = {month_start(r["ts"]) for r in cur.fetchall()}
+    wanted = stray | {month_start(now, i) for i in range(ahead + 1)}
+    covered = list_partitions(cur, table)
+    created = []
+    for start in sorted(wanted):
+        end = month_start(start, 1)
+        if any((lo is None or lo < end) and start < hi for _, lo, hi in covered):
+            continue
+        name = partition_name(table, start)
+        cur.execute("BEGIN")
+        try:
+            cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {table}_default WHERE event_ts >= %s AND event_ts < %s RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+                """,
+                (start, end)
+            )
+            cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        covered.append((name, start, end))
+        created.append(name)
+    return created
+
+# One archived chunk: a partition's rows for one client, zlib-packed JSON
+def pack_rows(columns: list[str], rows: list[list]) -> bytes:
+    return zlib.compress(json.dumps({"columns": columns, "rows": rows}, separators=(",", ":")).encode(), 9)
+
+def unpack_rows(data: bytes) -> list[dict]:
+    packed = json.loads(zlib.decompress(data))
+    return [dict(zip(packed["columns"], row)) for row in packed["rows"]]
+
+def archive_partition(cur, table: str, name: str, lower: int | None, upper: int,
+                      parquet_dir: str | None = None) -> int:
+    """
+    Move one partition into archive_chunk, one compressed chunk per client,
+    then detach and drop it, all in one transaction. With parquet_dir, the
+    rows are also written to <parquet_dir>/<table>/<name>.parquet (zstd).
+    Returns the number of rows archived.
+    """
+    writer = None
+    path = None
+    total = 0
+    cur.execute("BEGIN")
+    try:
+        cur.execute(f"SELECT * FROM {name} LIMIT 0")
+        columns = [d[0] for d in cur.description]
+        client, chunk = None, []
+
+        def flush():
+            if chunk:
+                cur.execute(
+                    """
+                    INSERT INTO archive_chunk (table_name, partition_name, client_id, from_ts, to_ts, row_count, data)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (table_name, client_id, partition_name) DO NOTHING
+                    """,
+                    (table, name, client, lower if lower is not None else min(r[columns.index("event_ts")] for r in chunk),
+                     upper, len(chunk), pack_rows(columns, chunk))
+                )
+
+        # One server-side cursor over the partition, sorted once and read
+        # PAGE_ROWS at a time; there is no (client_id, id) index to page on
+        cur.execute(f"DECLARE archive_rows NO SCROLL CURSOR FOR SELECT * FROM {name} ORDER BY client_id, id")
+        while True:
+            cur.execute("FETCH FORWARD %s FROM archive_rows", (PAGE_ROWS,))
+            page = cur.fetchall()
+            if not page:
+                break
+            if parquet_dir:
+                writer, path = _write_parquet(writer, path, parquet_dir, table, name, columns, page)
+            for row in page:
+                if row["client_id"] != client:
+                    flush()
+                    client, chunk = row["client_id"], []
+                chunk.append([row[c] for c in columns])
+            total += len(page)
+        cur.execute("CLOSE archive_rows")
+        flush()
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(path + ".tmp", path)
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        if writer is not None:
+            writer.close()
+        if path and os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        raise
+    return total
+
+def _write_parquet(writer, path, parquet_dir, table, name, columns, page):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    batch = pa.Table.from_pylist([{c: row[c] for c in columns} for row in page])
+    if writer is None:
+        os.makedirs(os.path.join(parquet_dir, table), exist_ok=True)
+        path = os.path.join(parquet_dir, table, f"{name}.parquet")
+        writer = pq.ParquetWriter(path + ".tmp", batch.schema, compression="zstd")
+    writer.write_table(batch.cast(writer.schema))
+    return writer, path
+
+def maintain(connect: Callable, retention: dict[str, int], now: float | None = None,
+             ahead: int = 2, parquet_dir: str | None = None) -> dict:
+    """
+    For each table: create upcoming partitions, then archive every partition
+    that ends before the start of the month `retention[table]` months ago.
+    Only one process does this at a time. Returns what was created and archived.
+    """
+    now = time.time() if now is None else now
+    done = {"created": [], "archived": {}}
+    con = connect()
+    cur = con.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(hashtext('partition maintenance')) AS locked")
+        if not cur.fetchone()["locked"]:
+            return done
+        try:
+            for table, months in retention.items():
+                done["created"] += ensure_partitions(cur, table, now, ahead)
+                cutoff = month_start(now, -months)
+                for name, lower, upper in list_partitions(cur, table):
+                    if upper <= cutoff:
+                        done["archived"][name] = archive_partition(cur, table, name, lower, upper, parquet_dir)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(hashtext('partition maintenance'))")
+    finally:
+        con.close()
+    return done
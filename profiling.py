@@ -0,0 +1,79 @@
+import cProfile, io, os, pstats, re, threading, time, tracemalloc
+from contextlib import contextmanager
+
+# tracemalloc is process-wide: started by the first profiled block and
+# stopped by the last one, unless something else had already started it
+_lock = threading.Lock()
+_UNSAFE = re.compile(r"[^\w.-]")
+_active = 0
+_started = False
+
+def _trace_start() -> None:
+    global _active, _started
+    with _lock:
+        if _active == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started = True
+        _active += 1
+        tracemalloc.reset_peak()
+
+def _trace_stop() -> tuple[tracemalloc.Snapshot, int]:
+    global _active, _started
+    with _lock:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        _active -= 1
+        if _active == 0 and _started:
+            tracemalloc.stop()
+            _started = False
+    return snapshot, peak
+
+@contextmanager
+def profile_to(directory: str, kind: str, label: str, meta: dict | None = None,
+               top_functions: int = 40, top_allocations: int = 25):
+    """
+    Profile the block with cProfile (this thread only) and tracemalloc, and
+    write <timestamp>-<kind>-<label>.txt (top functions by cumulative time,
+    top allocation sites) plus a .prof for snakeviz or pstats. The files are
+    written even if the block raises, st.stop() and st.rerun() included.
+    """
+    started = time.time()
+    _trace_start()
+    profiler = cProfile.Profile()
+    t0 = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall = time.perf_counter() - t0
+        snapshot, peak = _trace_stop()
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started)) + f"{started % 1:.3f}"[1:]
+        base = os.path.join(directory, f"{stamp}-{kind}-{_UNSAFE.sub('_', label)}")
+        profiler.dump_stats(base + ".prof")
+
+        out = io.StringIO()
+        out.write(f"kind: {kind}\n")
+        for key, value in (meta or {}).items():
+            out.write(f"{key}: {value}\n")
+        out.write(f"started: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}\n")
+        out.write(f"wall: {wall:.3f} s\n")
+        out.write(f"traced memory peak: {peak / 2**20:.1f} MiB (process-wide while tracing)\n")
+        out.write(f"\n== CPU: top {top_functions} by cumulative time ==\n")
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top_functions)
+        out.write(f"== Memory: top {top_allocations} allocation sites still held ==\n")
+        for stat in snapshot.statistics("lineno")[:top_allocations]:
+            out.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  {stat.traceback[0]}\n")
+        with open(base + ".txt", "w") as f:
+            f.write(out.getvalue())
+
+# Newest profile reports first
+def list_profiles(directory: str, limit: int = 10) -> list[str]:
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith(".txt")]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, n) for n in sorted(names, reverse=True)[:limit]]
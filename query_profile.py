@@ -0,0 +1,129 @@
+import re, threading, time
+from collections import OrderedDict
+
+# Literals and whitespace are folded so one statement shape is one fingerprint
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+def fingerprint(sql) -> str:
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _STRING.sub("?", str(sql))
+    sql = sql.replace("%s", "?")
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?, ...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "rows", "params")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        # Hashes of the parameter tuples seen, to tell repeats from N+1 loops
+        self.params = {}
+
+    def add(self, seconds: float, rows: int, params_key) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.rows += max(rows, 0)
+        self.params[params_key] = self.params.get(params_key, 0) + 1
+
+class RunProfile:
+    """
+    Queries issued during one script run (a full rerun or a fragment rerun),
+    grouped by fingerprint.
+    """
+
+    # Same shape this many times with different parameters in one run: likely N+1
+    N_PLUS_ONE_MIN = 5
+
+    def __init__(self, page: str, fragment: bool, marker=None):
+        self.page = page
+        self.fragment = fragment
+        self.started = time.time()
+        self.marker = marker
+        self.queries = OrderedDict()
+
+    def add(self, sql, params, seconds: float, rows: int) -> None:
+        fp = fingerprint(sql)
+        stats = self.queries.get(fp)
+        if stats is None:
+            stats = self.queries[fp] = QueryStats()
+        try:
+            key = hash(params if not isinstance(params, (list, dict)) else repr(params))
+        except TypeError:
+            key = hash(repr(params))
+        stats.add(seconds, rows, key)
+
+    @property
+    def count(self) -> int:
+        return sum(s.count for s in self.queries.values())
+
+    @property
+    def seconds(self) -> float:
+        return sum(s.seconds for s in self.queries.values())
+
+    # One row per fingerprint, slowest first, with the repeat/N+1 flags
+    def rows(self) -> list[dict]:
+        out = []
+        for fp, s in self.queries.items():
+            repeated = max(s.params.values()) - 1
+            flags = []
+            if repeated:
+                flags.append(f"identical x{repeated + 1}")
+            if len(s.params) >= self.N_PLUS_ONE_MIN:
+                flags.append("N+1?")
+            out.append({"query": fp, "calls": s.count, "ms": round(s.seconds * 1000, 2),
+                        "rows": s.rows, "flags": ", ".join(flags)})
+        out.sort(key=lambda r: r["ms"], reverse=True)
+        return out
+
+    @property
+    def flagged(self) -> int:
+        return sum(1 for r in self.rows() if r["flags"])
+
+class PageProfile:
+    """Process-wide totals per (page, fingerprint), across every session's runs."""
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._runs = {}
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_run(self, page: str) -> None:
+        with self._lock:
+            self._runs[page] = self._runs.get(page, 0) + 1
+
+    def add(self, page: str, sql, seconds: float, rows: int) -> None:
+        key = (page, fingerprint(sql))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = [0, 0.0, 0]
+                while len(self._stats) > self.max_entries:
+                    self._stats.popitem(last=False)
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += max(rows, 0)
+
+    def rows(self) -> list[dict]:
+        with self._lock:
+            runs = dict(self._runs)
+            stats = list(self._stats.items())
+        out = []
+        for (page, fp), (count, seconds, rows) in stats:
+            n = runs.get(page) or 1
+            out.append({"page": page, "query": fp, "calls": count, "per_run": round(count / n, 2),
+                        "ms": round(seconds * 1000, 2), "rows": rows})
+        out.sort(key=lambda r: r["ms"], reverse=True)
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._runs.clear()
+            self._stats.clear()
@@ -0,0 +1,138 @@
+import itertools, threading, time
+from collections import deque
+from typing import Callable
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# WAL positions as byte offsets. Every commit the primary has acknowledged
+# lies before its current position; a standby holds every commit before the
+# position it has replayed (a server that is not a standby holds everything
+# it will ever get)
+PRIMARY_LSN_SQL = "SELECT pg_current_wal_lsn() - '0/0' AS lsn"
+REPLAY_LSN_SQL = "SELECT pg_is_in_recovery() AS standby, pg_last_wal_replay_lsn() - '0/0' AS lsn"
+
+def _row(cur) -> dict:
+    row = cur.fetchone()
+    return row if isinstance(row, dict) else dict(zip([d[0] for d in cur.description], row))
+
+def primary_lsn(con) -> int:
+    cur = con.cursor()
+    cur.execute(PRIMARY_LSN_SQL)
+    return int(_row(cur)["lsn"])
+
+class Replica:
+    __slots__ = ("url", "pool", "lsn", "synced", "checked", "error", "lock")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.pool = None
+        # Replayed WAL position, and the wall-clock time up to which that is
+        # known to include every commit on the primary
+        self.lsn = -1
+        self.synced = 0.0
+        self.checked = 0.0
+        self.error = None
+        self.lock = threading.Lock()
+
+class ReplicaSet:
+    """
+    Read replicas behind one pool each. pick(fresh_after, min_lsn) returns
+    the pool of the next replica, round robin, that has replayed the
+    primary's WAL up to min_lsn and up to where it stood at fresh_after.
+    Each check samples the primary's position (through `primary`, which
+    returns a connection) before the replica's, so replay that reaches a
+    sample covers every commit before it. Replicas are checked at most every
+    check_every seconds, and one that fails is skipped until its next check.
+    """
+
+    def __init__(self, urls: list[str], primary: Callable, check_every: float = 2.0, pool_max: int = 20,
+                 history: int = 64, **connect_kwargs):
+        self.replicas = [Replica(u) for u in urls]
+        self.primary = primary
+        self.check_every = check_every
+        self.pool_max = pool_max
+        self.connect_kwargs = connect_kwargs
+        self._next = itertools.count()
+        # (time, primary position) samples, oldest first
+        self._samples = deque(maxlen=history)
+        self._samples_lock = threading.Lock()
+
+    def _sample_primary(self) -> None:
+        now = time.time()
+        con = self.primary()
+        try:
+            lsn = primary_lsn(con)
+        finally:
+            con.close()
+        with self._samples_lock:
+            self._samples.append((now, lsn))
+
+    # Latest sample time the position covers, 0 if it covers none kept
+    def _synced_at(self, lsn: float) -> float:
+        with self._samples_lock:
+            for ts, sampled in reversed(self._samples):
+                if sampled <= lsn:
+                    return ts
+        return 0.0
+
+    def _check(self, r: Replica) -> None:
+        now = time.time()
+        con = None
+        try:
+            self._sample_primary()
+            if r.pool is None:
+                r.pool = ThreadedConnectionPool(1, self.pool_max, r.url, **self.connect_kwargs)
+            con = r.pool.getconn()
+            con.autocommit = True
+            cur = con.cursor()
+            cur.execute(REPLAY_LSN_SQL)
+            row = _row(cur)
+            r.lsn = int(row["lsn"] or 0) if row["standby"] else float("inf")
+            r.synced = self._synced_at(r.lsn)
+            r.error = None
+        except psycopg2.Error as e:
+            r.lsn = -1
+            r.synced = 0.0
+            r.error = str(e).strip()
+            if con is not None:
+                r.pool.putconn(con, close=True)
+                con = None
+        finally:
+            r.checked = now
+            if con is not None:
+                r.pool.putconn(con)
+
+    def pick(self, fresh_after: float, min_lsn: int = 0) -> ThreadedConnectionPool | None:
+        n = len(self.replicas)
+        start = next(self._next)
+        for i in range(n):
+            r = self.replicas[(start + i) % n]
+            # One thread re-checks while the others use the last measurement
+            if time.time() - r.checked >= self.check_every and r.lock.acquire(blocking=False):
+                try:
+                    self._check(r)
+                finally:
+                    r.lock.release()
+            if r.pool is not None and r.error is None and r.synced >= fresh_after and r.lsn >= min_lsn:
+                return r.pool
+        return None
+
+    # A connection from this pool failed: skip the replica until its next check
+    def mark_down(self, pool: ThreadedConnectionPool, error: str) -> None:
+        for r in self.replicas:
+            if r.pool is pool:
+                r.lsn = -1
+                r.synced = 0.0
+                r.error = error
+                r.checked = time.time()
+
+    def status(self) -> list[dict]:
+        now = time.time()
+        with self._samples_lock:
+            head = self._samples[-1][1] if self._samples else None
+        return [
+            {"replica": i, "lag_s": round(max(r.checked - r.synced, 0.0), 2) if r.error is None else None,
+             "lag_bytes": max(head - r.lsn, 0) if r.error is None and head is not None and r.lsn != float("inf") else None,
+             "checked_s_ago": round(now - r.checked, 1) if r.checked else None, "error": r.error}
+            for i, r in enumerate(self.replicas)
+        ]
@@ -0,0 +1,101 @@
+import base64, io, json, sys, threading, time, zlib
+from collections import deque
+
+# Rough retained size of a session-state value: strings, bytes and buffers
+# at their real size, containers and plain objects by walking their contents.
+# Shared objects are counted once per call.
+def approx_size(obj, _seen: set | None = None, _depth: int = 0) -> int:
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return sys.getsizeof(obj)
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, io.BytesIO):
+        return sys.getsizeof(obj) + obj.getbuffer().nbytes
+    size = sys.getsizeof(obj)
+    if _depth > 8:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_size(k, seen, _depth + 1) + approx_size(v, seen, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        for v in obj:
+            size += approx_size(v, seen, _depth + 1)
+    elif hasattr(obj, "__dict__"):
+        size += approx_size(vars(obj), seen, _depth + 1)
+    elif hasattr(obj, "__slots__"):
+        for name in obj.__slots__:
+            size += approx_size(getattr(obj, name, None), seen, _depth + 1)
+    return size
+
+# Spilled and checkpointed values are zlib-packed JSON, so reading a row
+# back can never run code. Tuples, bytes and dicts whose keys JSON would turn
+# into strings are tagged and come back as they were; any other type is
+# refused (TypeError). unpack raises ValueError on data it did not pack.
+_TUPLE, _BYTES, _DICT = "\u0000t", "\u0000b", "\u0000d"
+
+def _encode(obj):
+    if isinstance(obj, tuple):
+        return {_TUPLE: [_encode(v) for v in obj]}
+    if isinstance(obj, list):
+        return [_encode(v) for v in obj]
+    if isinstance(obj, dict):
+        if all(isinstance(k, str) and not k.startswith("\u0000") for k in obj):
+            return {k: _encode(v) for k, v in obj.items()}
+        return {_DICT: [[_encode(k), _encode(v)] for k, v in obj.items()]}
+    if isinstance(obj, (bytes, bytearray)):
+        return {_BYTES: base64.b64encode(obj).decode()}
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    raise TypeError(f"cannot pack {type(obj).__name__}")
+
+def _decode(obj: dict):
+    if len(obj) == 1:
+        if _TUPLE in obj:
+            return tuple(obj[_TUPLE])
+        if _BYTES in obj:
+            return base64.b64decode(obj[_BYTES])
+        if _DICT in obj:
+            return {k: v for k, v in obj[_DICT]}
+    return obj
+
+def pack(obj) -> bytes:
+    return zlib.compress(json.dumps(_encode(obj), separators=(",", ":")).encode(), 6)
+
+def unpack(data: bytes):
+    try:
+        return json.loads(zlib.decompress(data), object_hook=_decode)
+    except zlib.error as e:
+        raise ValueError(str(e)) from None
+
+class SessionMemory:
+    """
+    Process-wide view of each live session's approximate session-state size,
+    refreshed by the session itself on every full run. Sessions not seen for
+    `ttl` seconds are assumed gone.
+    """
+
+    def __init__(self, ttl: float = 900):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def update(self, session_id: str, **info) -> None:
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = dict(info, seen=now)
+            for sid in [s for s, row in self._sessions.items() if now - row["seen"] > self.ttl]:
+                del self._sessions[sid]
+
+    def drop(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    # One row per session, largest first
+    def rows(self) -> list[dict]:
+        with self._lock:
+            sessions = list(self._sessions.items())
+        out = [dict(row, session=sid[:8]) for sid, row in sessions]
+        out.sort(key=lambda r: r["bytes"], reverse=True)
+        return out
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import streamlit.components.v1 as components
 
@@ -43,35 +44,55 @@ else:
 # `declare_component` and call it done. The wrapper allows us to customize
 # our component's API: we can pre-process its input args, post-process its
 # output value, and add a docstring for users.
-def streamlit_html_viewer(html: str, height: int = 400, key: str | None = None) -> str:
+def streamlit_html_viewer(
+    html: str | None = None,
+    height: int = 400,
+    key: str | None = None,
+    chunks: list[str] | None = None,
+    css: str = "",
+) -> list[int] | None:
     """Create a new instance of "streamlit_html_viewer".
 
     Parameters
     ----------
-    name: str
-        The name of the thing we're saying hello to. The component will display
-        the text "Hello, {name}!"
+    html: str or None
+        The markup to display in one piece. Spans with class "toggle" and
+        data-id, data-original and data-corrected attributes switch between
+        their original and corrected text when clicked.
+    height: int
+        Height of the scrollable viewer in pixels.
     key: str or None
         An optional key that uniquely identifies this component. If this is
         None, and the component's arguments are changed, the component will
         be re-mounted in the Streamlit frontend and lose its current state.
+    chunks: list[str] or None
+        The markup split into paragraphs, used instead of `html`. Only the
+        paragraphs in or near the viewport are mounted, so long documents
+        stay cheap to open and scroll.
+    css: str
+        Stylesheet applied in chunked mode; the scroll box has class
+        "scrollable".
 
     Returns
     -------
-    int
-        The number of times the component's "Click Me" button has been clicked.
-        (This is the value passed to `Streamlit.setComponentValue` on the
-        frontend.)
+    list[int] or None
+        Sorted data-ids of the toggles currently showing their original text,
+        or None before the first click. Only this list crosses the websocket;
+        the caller rebuilds the text from its own copy of the edits.
 
     """
+    # Identifies the document so the frontend only resets its scroll and
+    # toggle state when the content really changes
+    doc_id = None
+    if chunks is not None:
+        doc_id = hashlib.blake2b("\0".join(chunks).encode(), digest_size=16).hexdigest()
+
     # Call through to our private component function. Arguments we pass here
     # will be sent to the frontend, where they'll be available in an "args"
     # dictionary.
-    #
-    # "default" is a special argument that specifies the initial return
-    # value of the component before the user has interacted with it.
-    component_value = _component_func(html=html, height=height, key=key)
+    component_value = _component_func(
+        html=html, chunks=chunks, doc_id=doc_id, css=css,
+        height=height, key=key, default=None
+    )
 
-    # We could modify the value returned from the component if we wanted.
-    # There's no need to do this in our simple example - but it's an option.
     return component_value
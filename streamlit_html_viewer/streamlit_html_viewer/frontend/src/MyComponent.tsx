@@ -1,43 +1,128 @@
-import React, { useEffect, useState } from "react"
+import React, { useEffect, useRef, useState } from "react"
 import {
   Streamlit,
   withStreamlitConnection,
   ComponentProps,
 } from "streamlit-component-lib"
 
+// Paragraphs closer than this to the viewport stay mounted
+const OVERSCAN_PX = 600
+// Height assumed for paragraphs that have never been measured
+const ESTIMATED_CHUNK_PX = 60
+
 function MyComponent(props: ComponentProps) {
-  const initialHtml = props.args.html as string
+  const initialHtml = props.args.html as string | null
+  const chunks      = props.args.chunks as string[] | null
+  const docId       = (props.args.doc_id as string) || initialHtml || ""
+  const css         = (props.args.css as string) || ""
   const height      = (props.args.height as number) || 400
 
   const [content, setContent] = useState(initialHtml)
+  const [scrollTop, setScrollTop] = useState(0)
+  const [, setMeasured] = useState(0)
+  // data-ids of toggle spans currently showing their original text
+  const flipped = useRef<Set<number>>(new Set())
+  // measured paragraph heights; undefined until a paragraph has been mounted
+  const heights = useRef<(number | undefined)[]>([])
 
   // Sync when Python re‑renders
-  useEffect(() => setContent(initialHtml), [initialHtml])
+  useEffect(() => {
+    setContent(initialHtml)
+    flipped.current = new Set()
+    heights.current = []
+    setScrollTop(0)
+  }, [docId]) // eslint-disable-line react-hooks/exhaustive-deps
+
+  function showToggle(el: HTMLElement, showOriginal: boolean) {
+    el.textContent = showOriginal ? el.dataset.original! : el.dataset.corrected!
+    el.style.background = showOriginal ? "#DB0000" : "#2EBD2E"
+  }
 
   function onClick(e: React.MouseEvent) {
     const tgt = e.target as HTMLElement
-    if (tgt.classList.contains("toggle")) {
-      const orig = tgt.dataset.original!
-      const corr = tgt.dataset.corrected!
-      const now  = tgt.textContent === orig ? corr : orig
-      tgt.textContent = now
-      tgt.style.background = now === corr ? "#2EBD2E" : "#DB0000"
-
-      // send updated HTML back to Python immediately
-      const updated = document.getElementById("content")!.innerHTML
-      Streamlit.setComponentValue(updated)
+    if (tgt.classList.contains("toggle") && tgt.dataset.corrected !== undefined) {
+      const id = Number(tgt.dataset.id)
+      const showOriginal = !flipped.current.has(id)
+      showToggle(tgt, showOriginal)
+      if (showOriginal) {
+        flipped.current.add(id)
+      } else {
+        flipped.current.delete(id)
+      }
+
+      // send only the flipped ids back; Python rebuilds the text from its edit list
+      Streamlit.setComponentValue(Array.from(flipped.current).sort((a, b) => a - b))
+    }
+  }
+
+  // A paragraph scrolled (back) into view: record its height and restore
+  // the state of any toggles it contains
+  function onChunkMount(index: number, el: HTMLDivElement | null) {
+    if (!el) {
+      return
     }
+    el.querySelectorAll<HTMLElement>(".toggle[data-id]").forEach((t) => {
+      if (flipped.current.has(Number(t.dataset.id))) {
+        showToggle(t, true)
+      }
+    })
+    if (heights.current[index] !== el.offsetHeight) {
+      heights.current[index] = el.offsetHeight
+      setMeasured((n) => n + 1)
+    }
+  }
+
+  if (!chunks) {
+    return (
+      <div onClick={onClick}>
+        <div
+          id="content"
+          style={{ height: `${height}px`, overflowY: "auto" }}
+          dangerouslySetInnerHTML={{ __html: content || "" }}
+        />
+      </div>
+    )
+  }
+
+  // Offsets from measured heights (or an estimate), then mount only the
+  // paragraphs overlapping the viewport plus the overscan margin
+  const known = heights.current.filter((h): h is number => h !== undefined)
+  const estimate = known.length ? known.reduce((a, b) => a + b, 0) / known.length : ESTIMATED_CHUNK_PX
+  const offsets = [0]
+  for (let i = 0; i < chunks.length; i++) {
+    offsets.push(offsets[i] + (heights.current[i] ?? estimate))
+  }
+  let first = 0
+  while (first < chunks.length - 1 && offsets[first + 1] < scrollTop - OVERSCAN_PX) {
+    first++
+  }
+  let last = first
+  while (last < chunks.length - 1 && offsets[last + 1] < scrollTop + height + OVERSCAN_PX) {
+    last++
   }
 
   return (
     <div onClick={onClick}>
+      <style>{css}</style>
       <div
         id="content"
-        style={{ height: `${height}px`, overflowY: "auto" }}
-        dangerouslySetInnerHTML={{ __html: content }}
-      />
+        className="scrollable"
+        style={{ height: `${height}px`, maxHeight: `${height}px`, overflowY: "auto" }}
+        onScroll={(e) => setScrollTop((e.target as HTMLElement).scrollTop)}
+      >
+        <div style={{ height: offsets[first] }} />
+        {chunks.slice(first, last + 1).map((chunk, i) => (
+          <div
+            key={`${docId}-${first + i}`}
+            ref={(el) => onChunkMount(first + i, el)}
+            style={{ paddingBottom: "1em" }}
+            dangerouslySetInnerHTML={{ __html: chunk }}
+          />
+        ))}
+        <div style={{ height: offsets[chunks.length] - offsets[last + 1] }} />
+      </div>
     </div>
   )
 }
 
-export default withStreamlitConnection(MyComponent)
\ No newline at end of file
+export default withStreamlitConnection(MyComponent)
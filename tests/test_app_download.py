@@ -0,0 +1,46 @@
+import ast
+from pathlib import Path
+
+import streamlit.elements.widgets.button as button
+from streamlit.testing.v1 import AppTest
+
+import utils
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+# app.py is one script behind a login, so the fragment is lifted out of it
+# and run on its own, against the real function body
+def fragment_source(name: str) -> str:
+    source = APP.read_text(encoding="utf-8-sig")
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.FunctionDef) and node.name == name:
+            start = min(d.lineno for d in node.decorator_list) if node.decorator_list else node.lineno
+            return "\n".join(source.splitlines()[start - 1:node.end_lineno])
+    raise LookupError(name)
+
+SCRIPT = """
+import io
+import streamlit as st
+from utils import iter_file_text
+{fragment}
+render_document_download(7)
+"""
+
+def test_prepare_full_document_offers_the_download(monkeypatch):
+    pieces = ["First paragraph, ünïcode.\n\n", "Second paragraph.\n"]
+    monkeypatch.setattr(utils, "iter_file_text", lambda file_id: iter(pieces) if file_id == 7 else iter(()))
+    served = []
+    marshall_file = button.marshall_file
+    def capture(coordinates, data, *args, **kwargs):
+        served.append(data.getvalue() if hasattr(data, "getvalue") else data)
+        return marshall_file(coordinates, data, *args, **kwargs)
+    monkeypatch.setattr(button, "marshall_file", capture)
+    at = AppTest.from_string(SCRIPT.format(fragment=fragment_source("render_document_download")))
+    at.run()
+    assert not at.get("download_button")
+    at.button(key="prepare_7").click().run()
+    assert not at.exception
+    buttons = at.get("download_button")
+    assert len(buttons) == 1
+    assert buttons[0].proto.label == "📥 Download document"
+    assert served == ["".join(pieces).encode("utf-8")]
@@ -0,0 +1,41 @@
+from censor import CensorLogWriter, PhraseMatcher
+
+def test_scan_finds_words_and_phrases_ignoring_case_and_punctuation():
+    m = PhraseMatcher(["darn", "heck no", "Heck  NO!"])
+    assert len(m) == 2
+    assert m.scan("Well DARN it, heck no!".split()) == [(1, 2, "darn"), (3, 5, "heck no")]
+
+def test_scan_prefers_the_longest_phrase():
+    m = PhraseMatcher(["bad", "bad word", "word"])
+    assert m.scan("a bad word here".split()) == [(1, 3, "bad word")]
+    assert m.scan("bad bad".split()) == [(0, 1, "bad"), (1, 2, "bad")]
+
+def test_whole_words_only():
+    m = PhraseMatcher(["ass"])
+    assert m.scan("a classy assessment".split()) == []
+    assert m.mask("you ass.".split()) == [None, "ass"]
+
+def test_empty_matcher():
+    m = PhraseMatcher(["", "!!"])
+    assert len(m) == 0
+    assert m.scan(["anything"]) == []
+
+class BrokenConnection:
+    def cursor(self):
+        raise RuntimeError("database is down")
+
+    def close(self):
+        pass
+
+def test_failed_flush_is_not_counted_as_dropped():
+    writer = CensorLogWriter(BrokenConnection, max_queue=2)
+    writer._ensure_started = lambda: None
+    writer.log("alice", ["a", "b", "c"])
+    writer.close()
+    assert writer.stats() == {"queued": 0, "written": 0, "dropped": 1, "failed": 2, "late": 0}
+
+def test_version_tracks_the_compiled_phrases():
+    a = PhraseMatcher(["darn", "heck no"])
+    assert PhraseMatcher(["Heck  NO!", "darn", "darn"]).version == a.version
+    assert PhraseMatcher(["darn"]).version != a.version
+    assert PhraseMatcher([]).version == PhraseMatcher(["!!"]).version
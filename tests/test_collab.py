@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from collab import (apply_op, apply_op_stream, chunk_spans, diff_op, dump_op, load_op, rebase,
+                    transform, widen_op, window_op)
+
+def random_edit(rng: random.Random, text: str) -> str:
+    i = rng.randint(0, len(text))
+    j = rng.randint(i, min(len(text), i + 5))
+    return text[:i] + rng.choice(["", "x", "yz", " new "]) + text[j:]
+
+def test_diff_op_is_one_region():
+    assert diff_op("same", "same") is None
+    assert diff_op("hello world", "hello there world") == [6, "there ", 5]
+    assert diff_op("abc", "") == [-3]
+    assert apply_op("hello world", diff_op("hello world", "help world")) == "help world"
+
+def test_apply_op_checks_the_base_length():
+    with pytest.raises(ValueError):
+        apply_op("abc", [2])
+    with pytest.raises(ValueError):
+        apply_op("abc", [4])
+
+def test_transform_converges():
+    rng = random.Random(0)
+    for _ in range(500):
+        text = "".join(rng.choice("ab \n") for _ in range(rng.randint(0, 20)))
+        a = diff_op(text, random_edit(rng, text)) or [len(text)] if text else ["q"]
+        b = diff_op(text, random_edit(rng, text)) or [len(text)] if text else ["r"]
+        a2, b2 = transform(a, b)
+        assert apply_op(apply_op(text, a), b2) == apply_op(apply_op(text, b), a2)
+
+def test_concurrent_inserts_at_one_position_put_the_first_op_first():
+    a, b = ["A", 3], ["B", 3]
+    a2, b2 = transform(a, b)
+    assert apply_op(apply_op("xyz", a), b2) == "ABxyz"
+    assert apply_op(apply_op("xyz", b), a2) == "ABxyz"
+
+def test_overlapping_deletes_are_not_applied_twice():
+    text = "abcdef"
+    a, b = diff_op(text, "af"), diff_op(text, "abef")
+    a2, b2 = transform(a, b)
+    assert apply_op(apply_op(text, a), b2) == apply_op(apply_op(text, b), a2) == "af"
+
+def test_rebase_over_committed_ops():
+    base = "the cat sat"
+    committed = [diff_op(base, "the black cat sat")]
+    committed.append(diff_op("the black cat sat", "the black cat sat down"))
+    mine = rebase(diff_op(base, "the cat sat."), committed)
+    assert apply_op("the black cat sat down", mine) == "the black cat sat down."
+
+def test_dump_and_load_round_trip():
+    op = [12, "wörd", -3, 40]
+    assert load_op(dump_op(op)) == op
+
+def test_window_op_and_widen_op():
+    text = "aaaa bbbb cccc"
+    start, end = 5, 10
+    # An edit before the window only shifts it
+    op = diff_op(text, "aXaaa bbbb cccc")
+    wop, s2, e2, total = window_op(op, start, end, len(text))
+    assert wop == [5] and (s2, e2, total) == (6, 11, 15)
+    # One inside it lands in the window's text
+    op = diff_op(text, "aaaa bbYb cccc")
+    wop, s2, e2, total = window_op(op, start, end, len(text))
+    assert apply_op(text[start:end], wop) == apply_op(text, op)[s2:e2] == "bbYb "
+    assert apply_op(text, widen_op(diff_op("bbbb ", "B "), start, end, len(text))) == "aaaa B cccc"
+
+def test_apply_op_stream_matches_apply_op():
+    text = "one two three four"
+    op = diff_op(text, "one 2 three four!")
+    pieces = [text[i:i + 4] for i in range(0, len(text), 4)]
+    assert "".join(apply_op_stream(op, pieces)) == apply_op(text, op)
+    with pytest.raises(ValueError):
+        list(apply_op_stream([3], pieces))
+
+def test_chunk_spans_cover_the_text():
+    text = "para one\n\npara two is longer\n\n\n" + "word " * 50
+    spans = chunk_spans(text, max_chars=40)
+    assert "".join(text[s:e] for s, e in spans) == text
+    assert all(e - s <= 40 for s, e in spans)
+    assert text[spans[0][0]:spans[0][1]] == "para one\n\n"
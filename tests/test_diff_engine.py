@@ -0,0 +1,84 @@
+import random
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from benchmarks.bench_diff import make_pair
+from diff_engine import MYERS_MAX_GAP, diff_opcodes, edit_cost, intern_tokens, matching_blocks
+
+# Rebuild b from a and the opcodes
+def apply(a: list[str], b: list[str], opcodes) -> list[str]:
+    out = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            out += a[i1:i2]
+        else:
+            out += b[j1:j2]
+    return out
+
+def random_pair(rng: random.Random) -> tuple[list[str], list[str]]:
+    vocab = ["the", "a", "cat", "sat", "on", "mat", "is", "was", "saw", "seen"]
+    a = [rng.choice(vocab) for _ in range(rng.randint(0, 30))]
+    b = list(a)
+    for _ in range(rng.randint(0, 5)):
+        k = rng.randrange(len(b) + 1)
+        r = rng.random()
+        if r < 0.33 and k < len(b):
+            b.pop(k)
+        elif r < 0.66:
+            b.insert(k, rng.choice(vocab))
+        elif k < len(b):
+            b[k] = rng.choice(vocab)
+    return a, b
+
+def test_identical_texts_are_one_equal_run():
+    words = "the cat sat on the mat".split()
+    assert diff_opcodes(words, words) == [("equal", 0, 6, 0, 6)]
+    assert diff_opcodes([], []) == []
+
+def test_opcodes_cover_both_texts():
+    rng = random.Random(0)
+    for _ in range(500):
+        a, b = random_pair(rng)
+        opcodes = diff_opcodes(a, b)
+        assert apply(a, b, opcodes) == b
+        assert [op[1] for op in opcodes[1:]] == [op[2] for op in opcodes[:-1]]
+        assert [op[3] for op in opcodes[1:]] == [op[4] for op in opcodes[:-1]]
+        # Never two changes or two equal runs in a row
+        assert all((x[0] == "equal") != (y[0] == "equal") for x, y in zip(opcodes, opcodes[1:]))
+
+def test_repeated_word_deletion_merges_into_replace():
+    a, b = "I seen the the movie".split(), "I saw the movie".split()
+    opcodes = diff_opcodes(a, b)
+    assert apply(a, b, opcodes) == b
+    assert [op[0] for op in opcodes] == ["equal", "replace", "equal"]
+    assert edit_cost(opcodes) == edit_cost(SequenceMatcher(None, a, b).get_opcodes()) == 1
+
+def test_edit_cost_tracks_sequence_matcher():
+    rng = random.Random(1)
+    old = new = 0
+    for _ in range(2000):
+        a, b = random_pair(rng)
+        old += edit_cost(SequenceMatcher(None, a, b).get_opcodes())
+        new += edit_cost(diff_opcodes(a, b))
+    assert new <= old
+
+def test_edit_cost_counts_written_and_removed_words():
+    opcodes = [("equal", 0, 1, 0, 1), ("replace", 1, 3, 1, 2), ("delete", 3, 5, 2, 2), ("insert", 5, 5, 2, 5)]
+    assert edit_cost(opcodes) == 1 + 2 + 3
+
+def test_large_document_uses_anchors():
+    orig, corr = make_pair(MYERS_MAX_GAP * 3)
+    a, b = orig.split(), corr.split()
+    opcodes = diff_opcodes(a, b)
+    assert apply(a, b, opcodes) == b
+    assert edit_cost(opcodes) <= edit_cost(SequenceMatcher(None, a, b).get_opcodes())
+
+def test_matching_blocks_are_increasing_and_equal():
+    a, b = intern_tokens("a b c a b c a b".split(), "b c a c a b x".split())
+    blocks = matching_blocks(a, b)
+    for (i, j, n), (i2, j2, _) in zip(blocks, blocks[1:]):
+        assert i + n <= i2 and j + n <= j2
+    for i, j, n in blocks:
+        assert np.array_equal(a[i:i + n], b[j:j + n])
@@ -0,0 +1,10 @@
+import utils
+
+def test_same_words_new_line_breaks_keep_their_layout():
+    first = utils.get_edit_analysis("one two\nthree", "one two\nthree")
+    second = utils.get_edit_analysis("one two three", "one\ntwo three")
+    assert first.final_breaks == [0, 1, 2]
+    assert second.final_breaks == [1, 0, 2]
+    assert second.final_text == "one\ntwo three"
+    # The diff itself is shared
+    assert second.opcodes is first.opcodes
@@ -0,0 +1,42 @@
+from streamlit.testing.v1 import AppTest
+
+import utils
+from censor import PhraseMatcher
+
+SCRIPT = """
+import streamlit as st
+from utils import correct_paragraph_stream
+st.session_state.update(type="P", client_id="u")
+correct_paragraph_stream(["a b", "c d", "e f"], st.session_state.setdefault("owner", {"index": INDEX}), replay=REPLAY)
+"""
+
+def run(monkeypatch, available: int, replay: bool = False):
+    censor = PhraseMatcher([])
+    charged = []
+    monkeypatch.setattr(utils, "get_censor", lambda: censor)
+    monkeypatch.setattr(utils, "correct_paragraphs", lambda batch: [p + "." for p in batch])
+    monkeypatch.setattr(utils, "CORRECTION_BATCH_WORDS", 2)
+    monkeypatch.setattr(utils, "get_token", lambda client_id: (available, 0))
+    monkeypatch.setattr(utils, "update_token", lambda client_id, a, u: charged.append(-a))
+    monkeypatch.setattr(utils, "set_submission", lambda *args: None)
+    index = {"censor": censor.version, "paras": {}}
+    at = AppTest.from_string(SCRIPT.replace("INDEX", repr(index)).replace("REPLAY", repr(replay))).run()
+    return at, charged
+
+def test_batches_stopped_for_tokens_are_not_kept(monkeypatch):
+    # The first batch is corrected, the second is refused: nothing was billed,
+    # so nothing may be served from the index on the next submit
+    at, charged = run(monkeypatch, available=3)
+    assert at.error and not charged
+    assert at.session_state["owner"]["index"]["paras"] == {}
+
+def test_paid_corrections_are_indexed(monkeypatch):
+    at, charged = run(monkeypatch, available=100)
+    assert charged == [6]
+    assert len(at.session_state["owner"]["index"]["paras"]) == 3
+
+def test_replays_are_not_billed(monkeypatch):
+    # A resumed flow renders its paid correction again without charging for it
+    at, charged = run(monkeypatch, available=0, replay=True)
+    assert not at.error and not charged
+    assert at.session_state["corrected_text"] == "a b.\n\nc d.\n\ne f."
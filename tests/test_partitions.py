@@ -0,0 +1,52 @@
+from datetime import datetime, timezone
+
+from partitions import list_partitions, month_start, pack_rows, partition_name, unpack_rows
+
+def ts(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+def test_month_start():
+    assert month_start(ts(2024, 3, 17, 12, 30)) == ts(2024, 3, 1)
+    assert month_start(ts(2024, 3, 1)) == ts(2024, 3, 1)
+    assert month_start(ts(2024, 3, 17), 1) == ts(2024, 4, 1)
+    # Across year ends, both ways
+    assert month_start(ts(2024, 12, 31, 23, 59), 1) == ts(2025, 1, 1)
+    assert month_start(ts(2024, 1, 15), -1) == ts(2023, 12, 1)
+    assert month_start(ts(2024, 5, 2), -17) == ts(2022, 12, 1)
+
+def test_partition_name():
+    assert partition_name("submission", int(ts(2024, 3, 1))) == "submission_p202403"
+    assert partition_name("censor_log", int(ts(2023, 12, 1))) == "censor_log_p202312"
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, vars=None):
+        self.executed.append((sql, vars))
+
+    def fetchall(self):
+        return self.rows
+
+def test_list_partitions_parses_bounds_and_sorts():
+    mar, apr, may = int(ts(2024, 3, 1)), int(ts(2024, 4, 1)), int(ts(2024, 5, 1))
+    cur = FakeCursor([
+        {"name": "submission_p202404", "bound": f"FOR VALUES FROM ('{apr}') TO ('{may}')"},
+        {"name": "submission_default", "bound": "DEFAULT"},
+        {"name": "submission_legacy", "bound": f"FOR VALUES FROM (MINVALUE) TO ('{mar}')"},
+        {"name": "submission_p202403", "bound": f"FOR VALUES FROM ({mar}) TO ({apr})"},
+    ])
+    assert list_partitions(cur, "submission") == [
+        ("submission_legacy", None, mar),
+        ("submission_p202403", mar, apr),
+        ("submission_p202404", apr, may),
+    ]
+    assert cur.executed[0][1] == ("submission",)
+
+def test_packed_rows_round_trip():
+    rows = [[1, "alice", "teh", 1700000000], [2, "bob", None, 1700000001]]
+    assert unpack_rows(pack_rows(["id", "client_id", "original_word", "event_ts"], rows)) == [
+        {"id": 1, "client_id": "alice", "original_word": "teh", "event_ts": 1700000000},
+        {"id": 2, "client_id": "bob", "original_word": None, "event_ts": 1700000001},
+    ]
@@ -0,0 +1,17 @@
+from query_profile import fingerprint
+
+def test_literals_fold_to_one_shape():
+    a = fingerprint("SELECT * FROM file WHERE file_id = 12 AND owner = 'bob'")
+    b = fingerprint("SELECT *  FROM file\n WHERE file_id = 7 AND owner = 'o''brien'")
+    assert a == b == "SELECT * FROM file WHERE file_id = ? AND owner = ?"
+
+def test_placeholders_and_in_lists():
+    assert fingerprint("SELECT 1 FROM t WHERE id = %s") == "SELECT ? FROM t WHERE id = ?"
+    assert fingerprint("DELETE FROM t WHERE id IN (1, 2, 3)") == fingerprint("DELETE FROM t WHERE id IN (%s,%s)")
+    assert fingerprint("DELETE FROM t WHERE id IN (1, 2, 3)") == "DELETE FROM t WHERE id IN (?, ...)"
+
+def test_identifiers_with_digits_are_kept():
+    assert fingerprint("SELECT * FROM submission_p202403") == "SELECT * FROM submission_p202403"
+
+def test_bytes():
+    assert fingerprint(b"SELECT  'x'") == "SELECT ?"
@@ -0,0 +1,26 @@
+import pickle, zlib
+
+import pytest
+
+from session_store import pack, unpack
+
+def test_round_trip_keeps_types():
+    value = {
+        "parts": ["fixed ", ("orig", "corrected"), " \n"],
+        "_collab": (3, {"text": "abc", "first": 0, "seen": None}, "abd"),
+        "index": {"paras": {"ab12": ("out", "<b>", ["x"], 1)}, "censor": "d41d"},
+        7: {(1, 2): b"\x00\xff"},
+        "\u0000t": [1.5, True],
+    }
+    assert unpack(pack(value)) == value
+    assert isinstance(unpack(pack(value))["_collab"], tuple)
+
+def test_unknown_types_are_refused():
+    with pytest.raises(TypeError):
+        pack({"scan": {1, 2}})
+
+def test_foreign_and_corrupt_data_is_rejected():
+    with pytest.raises(ValueError):
+        unpack(zlib.compress(pickle.dumps({"a": 1})))
+    with pytest.raises(ValueError):
+        unpack(b"not zlib")
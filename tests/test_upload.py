@@ -0,0 +1,62 @@
+import codecs, io
+
+import pytest
+
+import upload
+from upload import UploadTooLarge, detect_encoding, iter_paragraphs, scan_upload
+
+TEXT = "First paragraph\nstill first.\n\n\n  Second one.  \n\nThird."
+
+def paragraphs(data: bytes, encoding: str) -> list[str]:
+    return list(iter_paragraphs(io.BytesIO(data), encoding))
+
+def test_paragraphs_split_at_blank_lines():
+    assert paragraphs(TEXT.encode(), "utf-8") == ["First paragraph\nstill first.", "Second one.", "Third."]
+    assert paragraphs(b"\n\n \n\n", "utf-8") == []
+    assert paragraphs(b"", "utf-8") == []
+
+def test_crlf_and_cr_are_normalized():
+    assert paragraphs(TEXT.replace("\n", "\r\n").encode(), "utf-8") == paragraphs(TEXT.encode(), "utf-8")
+    assert paragraphs(TEXT.replace("\n", "\r").encode(), "utf-8") == paragraphs(TEXT.encode(), "utf-8")
+
+@pytest.mark.parametrize("bom,codec", [
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+])
+def test_bom_encodings(bom, codec):
+    data = bom + "Ça va?\n\nOui.".encode(codec)
+    encoding = detect_encoding(data)
+    assert paragraphs(data, encoding) == ["Ça va?", "Oui."]
+
+def test_breaks_across_block_boundaries(monkeypatch):
+    monkeypatch.setattr(upload, "BLOCK_CHARS", 7)
+    text = "one two\n\nthree four five six\n\n\n\nseven\neight\n\nnine"
+    # Every alignment of the breaks against the block edges
+    for shift in range(8):
+        padded = "x" * shift + text
+        expected = [p.strip() for p in padded.split("\n\n") if p.strip()]
+        assert paragraphs(padded.encode(), "utf-8") == expected
+
+def test_the_callers_file_stays_open():
+    f = io.BytesIO(TEXT.encode())
+    list(iter_paragraphs(f, "utf-8"))
+    assert not f.closed
+
+def test_scan_counts_words_and_repeats():
+    data = b"a b c\n\nd e\n\na b c\n\nf"
+    scan = scan_upload(io.BytesIO(data), "P")
+    assert (scan.encoding, scan.size, scan.paragraphs) == ("utf-8", len(data), 4)
+    assert scan.words == 9
+    assert scan.unique_words == 6
+    assert scan.longest_paragraph == 5
+
+def test_scan_enforces_the_tier_limit(monkeypatch):
+    monkeypatch.setitem(upload.UPLOAD_LIMITS, "F", 10)
+    with pytest.raises(UploadTooLarge):
+        scan_upload(io.BytesIO(b"x" * 11), "F")
+    assert scan_upload(io.BytesIO(b"x" * 10), "F").words == 1
+    # An unknown tier gets the free tier's limit
+    with pytest.raises(UploadTooLarge):
+        scan_upload(io.BytesIO(b"x" * 11), "?")
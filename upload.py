@@ -0,0 +1,113 @@
+import codecs, hashlib, io, os
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator
+from charset_normalizer import from_bytes
+
+BLOCK_CHARS = 1 << 16
+SAMPLE_BYTES = 1 << 16
+
+# Largest .txt each tier may upload. Streamlit buffers an upload before the
+# app sees it, so server.maxUploadSize (.streamlit/config.toml) is kept at
+# the largest of these and rejects anything bigger before it is buffered;
+# the tier's own limit is checked before the file is decoded
+UPLOAD_LIMITS = {
+    "F": int(os.getenv("UPLOAD_MAX_BYTES_F", str(64 * 1024))),
+    "P": int(os.getenv("UPLOAD_MAX_BYTES_P", str(8 * 1024 * 1024))),
+    "S": int(os.getenv("UPLOAD_MAX_BYTES_S", str(8 * 1024 * 1024))),
+}
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+class UploadTooLarge(ValueError):
+    pass
+
+@dataclass(frozen=True)
+class UploadScan:
+    encoding: str
+    size: int
+    words: int
+    paragraphs: int
+    longest_paragraph: int
+    # Words in distinct paragraphs: what correct_paragraph_stream bills, as
+    # a paragraph that repeats is corrected once
+    unique_words: int
+
+# BOM first, then UTF-8 if the sample decodes cleanly, then a statistical guess
+def detect_encoding(sample: bytes) -> str:
+    for bom, name in _BOMS:
+        if sample.startswith(bom):
+            return name
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    best = from_bytes(sample).best()
+    return best.encoding if best else "cp1252"
+
+# Decoded text in blocks, newlines normalized; undecodable bytes become U+FFFD
+def iter_text_blocks(f: BinaryIO, encoding: str) -> Iterator[str]:
+    f.seek(0)
+    reader = io.TextIOWrapper(f, encoding=encoding, errors="replace", newline=None)
+    try:
+        while True:
+            block = reader.read(BLOCK_CHARS)
+            if not block:
+                return
+            yield block
+    finally:
+        # Keep the caller's file open
+        reader.detach()
+
+# Paragraphs (split at blank lines, stripped) without holding more than one
+# block plus the paragraph in progress
+def iter_paragraphs(f: BinaryIO, encoding: str) -> Iterator[str]:
+    pending = []
+    for block in iter_text_blocks(f, encoding):
+        # Join the paragraph in progress only once a break shows up
+        joins = pending and pending[-1].endswith("\n") and block.startswith("\n")
+        if "\n\n" not in block and not joins:
+            pending.append(block)
+            continue
+        pieces = ("".join(pending) + block).split("\n\n")
+        pending = [pieces.pop()]
+        for p in pieces:
+            p = p.strip()
+            if p:
+                yield p
+    tail = "".join(pending).strip()
+    if tail:
+        yield tail
+
+def scan_upload(f: BinaryIO, tier: str) -> UploadScan:
+    """
+    One streaming pass over an upload: size limit for the user's tier,
+    encoding, word counts and paragraph count. Raises UploadTooLarge.
+    """
+    limit = UPLOAD_LIMITS.get(tier, UPLOAD_LIMITS["F"])
+    size = getattr(f, "size", None)
+    if size is None:
+        size = f.seek(0, io.SEEK_END)
+    if size > limit:
+        raise UploadTooLarge(f"File is {size:,} bytes; the limit for your account is {limit:,} bytes.")
+
+    f.seek(0)
+    encoding = detect_encoding(f.read(SAMPLE_BYTES))
+    words = unique_words = paragraphs = longest = 0
+    seen = set()
+    for para in iter_paragraphs(f, encoding):
+        n = len(para.split())
+        paragraphs += 1
+        longest = max(longest, len(para))
+        words += n
+        digest = hashlib.blake2b(para.encode(), digest_size=16).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique_words += n
+    return UploadScan(encoding, size, words, paragraphs, longest, unique_words)
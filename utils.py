@@ -1,133 +1,417 @@
 import streamlit as st
 import html as html_lib
-import ollama, hashlib, time, re, unicodedata, ftfy, os, psycopg2
-from difflib import SequenceMatcher
-from psycopg2.extras import RealDictCursor
+from streamlit_html_viewer.streamlit_html_viewer import streamlit_html_viewer as html_viewer
+import ollama, hashlib, time, re, unicodedata, ftfy, os, psycopg2, threading, secrets, logging
+import numpy as np
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, replace
+from typing import Callable, Iterable, Iterator
+from diff_engine import intern_tokens, opcodes_from_ids, edit_cost
+from censor import PhraseMatcher, CensorLogWriter
+from notify import NotificationHub, publish
+from upload import UploadScan, UploadTooLarge, scan_upload, iter_paragraphs
+from metrics import StageMetrics, size_bucket
+from query_profile import PageProfile, RunProfile
+from profiling import profile_to, list_profiles
+from session_store import SessionMemory, approx_size, pack, unpack
+from flow_state import FlowStore
+from replicas import ReplicaSet, primary_lsn
+from partitions import ensure_partitioned, maintain, unpack_rows
+from collab import diff_op, apply_op, rebase, dump_op, load_op, window_op, widen_op, apply_op_stream, chunk_spans
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from dotenv import load_dotenv
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 DB_URL = os.getenv("DATABASE_URL")
-def get_connection():
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+
+# Read replicas: DATABASE_READ_URL is one replica DSN or a comma-separated
+# list. The read helpers that go through run_read() use a replica only when
+# it has replayed the primary's WAL up to where it stood DB_REPLICA_MAX_LAG
+# seconds ago, past this session's own last write (see note_write), and
+# past whatever position the caller asks for (min_lsn); otherwise the primary.
+DB_READ_URLS = [u.strip() for u in os.getenv("DATABASE_READ_URL", "").split(",") if u.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_SECONDS = 2
+
+# Statements issued by this process, for before/after measurements
+db_stats = {"queries": 0}
+
+# Opt-in query profiling: DB_PROFILE=1 profiles every session, otherwise a
+# super user can switch it on for their own session from the debug panel.
+# Each script run's statements are grouped by fingerprint in the session's
+# last QUERY_PROFILE_RUNS runs; page_profile totals them per page.
+DB_PROFILE = os.getenv("DB_PROFILE") == "1"
+QUERY_PROFILE_RUNS = 20
+page_profile = PageProfile()
+
+# Profile for the script run on this thread, or None if not profiling
+# (including background threads, which have no run)
+def current_query_run() -> RunProfile | None:
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None or not (DB_PROFILE or st.session_state.get("_db_profile")):
+        return None
+    runs = st.session_state.get("_query_runs")
+    if runs is None:
+        runs = st.session_state["_query_runs"] = deque(maxlen=QUERY_PROFILE_RUNS)
+    # Streamlit swaps in a fresh cursors dict at the start of every run
+    if runs and runs[-1].marker is ctx.cursors:
+        return runs[-1]
+    if runs:
+        runs[-1].marker = None
+    run = RunProfile(get_page(), bool(ctx.fragment_ids_this_run), ctx.cursors)
+    runs.append(run)
+    page_profile.add_run(run.page)
+    return run
+
+# This session's profiled runs, newest first, each with whether it is the current run
+def recent_query_runs() -> list[tuple[RunProfile, bool]]:
+    ctx = get_script_run_ctx(suppress_warning=True)
+    cursors = ctx.cursors if ctx else None
+    return [(r, r.marker is cursors) for r in reversed(st.session_state.get("_query_runs", ()))]
+
+class CountingCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        db_stats["queries"] += 1
+        run = current_query_run()
+        if run is None:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - start
+            run.add(query, vars, seconds, self.rowcount)
+            page_profile.add(run.page, query, seconds, self.rowcount)
+
+# One pool per process, shared by every session
+@st.cache_resource(show_spinner=False)
+def get_pool() -> ThreadedConnectionPool:
+    return ThreadedConnectionPool(1, DB_POOL_MAX, DB_URL, cursor_factory=CountingCursor)
+
+class PooledConnection:
+    """
+    Pool checkout that behaves like a connection; close() hands it back (or,
+    without a pool, closes it). As a context manager it is closed on exit,
+    so an exception in a helper cannot leak a pool slot.
+    """
+
+    def __init__(self, pool: ThreadedConnectionPool | None, con, replica: bool = False):
+        self._pool = pool
+        self._con = con
+        self.replica = replica
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # discard=True closes a broken connection instead of pooling it again
+    def close(self, discard: bool = False):
+        if self._con is None:
+            return
+        if self._pool is not None:
+            self._pool.putconn(self._con, close=discard)
+        else:
+            self._con.close()
+        self._con = None
+
+def get_connection() -> PooledConnection:
     if not DB_URL:
         raise RuntimeError("DATABASE_URL not set")
-    con = psycopg2.connect(DB_URL, cursor_factory=RealDictCursor)
+    pool = get_pool()
+    try:
+        con = pool.getconn()
+    except PoolError:
+        # Pool exhausted: fall back to a one-off connection
+        con = psycopg2.connect(DB_URL, cursor_factory=CountingCursor)
+        pool = None
+    con.autocommit = True
+    return PooledConnection(pool, con)
+
+# WAL position this session's own writes are at, for read-your-writes: a
+# write only flags the session, and the primary's position is read once, by
+# the next read that could go to a replica (0 off the script thread)
+def session_lsn() -> int:
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return 0
+    if st.session_state.pop("_wrote", False):
+        con = get_connection()
+        try:
+            st.session_state["_write_lsn"] = primary_lsn(con)
+        finally:
+            con.close()
+    return st.session_state.get("_write_lsn", 0)
+
+# Called after the commit by the helpers whose writes the user reads back
+# (tokens, submissions, invites, complaints, file edits); bookkeeping writes
+# such as flow checkpoints and session spills don't hold back replica reads
+def note_write() -> None:
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.session_state["_wrote"] = True
+
+@st.cache_resource(show_spinner=False)
+def get_replicas() -> ReplicaSet | None:
+    if not DB_READ_URLS:
+        return None
+    return ReplicaSet(DB_READ_URLS, get_connection, REPLICA_CHECK_SECONDS, DB_POOL_MAX,
+                      cursor_factory=CountingCursor)
+
+def read_connection(min_lsn: int | None = 0) -> PooledConnection:
+    """
+    Connection for a read: a replica that has replayed up to min_lsn (and
+    see DB_READ_URLS), else the primary. min_lsn=None always reads from the
+    primary.
+    """
+    replicas = get_replicas() if min_lsn is not None else None
+    if replicas is None:
+        return get_connection()
+    pool = replicas.pick(time.time() - DB_REPLICA_MAX_LAG, max(min_lsn, session_lsn()))
+    if pool is None:
+        return get_connection()
+    try:
+        con = pool.getconn()
+    except (PoolError, psycopg2.Error) as e:
+        replicas.mark_down(pool, str(e))
+        return get_connection()
     con.autocommit = True
-    return con
+    return PooledConnection(pool, con, replica=True)
+
+def run_read(query: Callable, min_lsn: int | None = 0):
+    """
+    query(cur) on a read_connection(min_lsn). A replica that fails during
+    the query is marked down and its connection discarded, and the query
+    runs again on the primary. Returns what query returns.
+    """
+    con = read_connection(min_lsn)
+    try:
+        return query(con.cursor())
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        if not con.replica:
+            raise
+        get_replicas().mark_down(con._pool, str(e).strip())
+        con.close(discard=True)
+    finally:
+        con.close()
+    con = get_connection()
+    try:
+        return query(con.cursor())
+    finally:
+        con.close()
+
+# Schema setup runs once per process rather than once per session
+@st.cache_resource(show_spinner=False)
+def ensure_db() -> bool:
+    set_db()
+    return True
+
+# LLM client shared by every session
+@st.cache_resource(show_spinner=False)
+def get_llm() -> ollama.Client:
+    return ollama.Client()
 
 def set_db():
     con = get_connection()
-    cur = con.cursor()
-    # Accounts
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS account (
-        client_id TEXT PRIMARY KEY,
-        password  TEXT NOT NULL,
-        type      TEXT NOT NULL DEFAULT 'F'
-    );
-    """)
-    # Token balances
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS token (
-        client_id TEXT PRIMARY KEY REFERENCES account(client_id),
-        available INTEGER NOT NULL DEFAULT 0,
-        used      INTEGER NOT NULL DEFAULT 0
-    );
-    """)
-    # Blacklist
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS blacklist (
-        word   TEXT PRIMARY KEY,
-        status TEXT NOT NULL
-               CHECK (status IN ('pending','approved'))
-               DEFAULT 'pending'
-    );
-    """)
-    # Censor log
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS censor_log (
-        id            SERIAL PRIMARY KEY,
-        client_id     TEXT    NOT NULL REFERENCES account(client_id),
-        original_word TEXT    NOT NULL,
-        event_ts      BIGINT  NOT NULL
-    );
-    """)
-    # Lockouts
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS lockout (
-        client_id TEXT PRIMARY KEY,
-        lock_ts   BIGINT NOT NULL DEFAULT 0
-    );
-    """)
-    # Submissions
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS submission (
-        id         SERIAL PRIMARY KEY,
-        client_id  TEXT    NOT NULL REFERENCES account(client_id),
-        original   TEXT    NOT NULL,
-        corrected  TEXT    NOT NULL,
-        error      INTEGER NOT NULL,
-        event_ts   BIGINT  NOT NULL
-    );
-    """)
-    # Upgrade requests
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS upgrade (
-        client_id TEXT PRIMARY KEY REFERENCES account(client_id),
-        req_ts    BIGINT NOT NULL
-    );
-    """)
-    # Documents/files
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS file (
-      file_id     SERIAL PRIMARY KEY,
-      owner       TEXT NOT NULL REFERENCES account(client_id),
-      title       TEXT,
-      content     TEXT NOT NULL DEFAULT '',
-      created_ts  BIGINT NOT NULL
-    );
-    """)
-    # Collaborators link table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS collaborator (
-      file_id    INTEGER NOT NULL REFERENCES file(file_id),
-      client_id  TEXT    NOT NULL REFERENCES account(client_id),
-      role       TEXT    NOT NULL DEFAULT 'edit',
-      PRIMARY KEY (file_id, client_id)
-    );
-    """)
-    # Pending invites
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS invite (
-      invite_id     SERIAL PRIMARY KEY,
-      file_id       INTEGER NOT NULL REFERENCES file(file_id),
-      inviter       TEXT    NOT NULL REFERENCES account(client_id),
-      invitee       TEXT    NOT NULL REFERENCES account(client_id),
-      status        TEXT    NOT NULL CHECK (status IN ('pending','accepted','rejected')),
-      requested_ts  BIGINT NOT NULL
-    );
-    """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS complaint (
-        complaint_id  SERIAL PRIMARY KEY,
-        file_id      INTEGER NOT NULL REFERENCES file(file_id),
-        complainant  TEXT NOT NULL REFERENCES account(client_id),
-        complained   TEXT NOT NULL REFERENCES account(client_id),
-        description  TEXT NOT NULL,
-        status       TEXT NOT NULL CHECK (status IN ('pending', 'resolved')) DEFAULT 'pending',
-        created_ts   BIGINT NOT NULL
-    );
-    """)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS complaint_response (
-        response_id  SERIAL PRIMARY KEY,
-        complaint_id INTEGER NOT NULL REFERENCES complaint(complaint_id),
-        client_id    TEXT NOT NULL REFERENCES account(client_id),
-        response     TEXT NOT NULL,
-        created_ts   BIGINT NOT NULL
-    );
-    """)
-    con.commit()
-    con.close()
+    try:
+        cur = con.cursor()
+        # Accounts
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS account (
+            client_id TEXT PRIMARY KEY,
+            password  TEXT NOT NULL,
+            type      TEXT NOT NULL DEFAULT 'F'
+        );
+        """)
+        # Token balances
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS token (
+            client_id TEXT PRIMARY KEY REFERENCES account(client_id),
+            available INTEGER NOT NULL DEFAULT 0,
+            used      INTEGER NOT NULL DEFAULT 0
+        );
+        """)
+        # Blacklist
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS blacklist (
+            word   TEXT PRIMARY KEY,
+            status TEXT NOT NULL
+                   CHECK (status IN ('pending','approved'))
+                   DEFAULT 'pending'
+        );
+        """)
+        # Censor log, partitioned by month (see partitions.py)
+        ensure_partitioned(cur, "censor_log", """
+            client_id     TEXT    NOT NULL REFERENCES account(client_id),
+            original_word TEXT    NOT NULL,
+            event_ts      BIGINT  NOT NULL
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS censor_log_recent
+            ON censor_log (event_ts)
+        """)
+        # Lockouts
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS lockout (
+            client_id TEXT PRIMARY KEY,
+            lock_ts   BIGINT NOT NULL DEFAULT 0
+        );
+        """)
+        # Submissions, partitioned by month (see partitions.py)
+        ensure_partitioned(cur, "submission", """
+            client_id  TEXT    NOT NULL REFERENCES account(client_id),
+            original   TEXT    NOT NULL,
+            corrected  TEXT    NOT NULL,
+            error      INTEGER NOT NULL,
+            event_ts   BIGINT  NOT NULL
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS submission_client
+            ON submission (client_id, event_ts)
+        """)
+        # Partitions moved out of submission and censor_log: one packed chunk per client
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS archive_chunk (
+            table_name     TEXT    NOT NULL,
+            partition_name TEXT    NOT NULL,
+            client_id      TEXT    NOT NULL,
+            from_ts        BIGINT  NOT NULL,
+            to_ts          BIGINT  NOT NULL,
+            row_count      INTEGER NOT NULL,
+            data           BYTEA   NOT NULL,
+            PRIMARY KEY (table_name, client_id, partition_name)
+        );
+        """)
+        # Upgrade requests
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS upgrade (
+            client_id TEXT PRIMARY KEY REFERENCES account(client_id),
+            req_ts    BIGINT NOT NULL
+        );
+        """)
+        # Documents/files
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS file (
+          file_id     SERIAL PRIMARY KEY,
+          owner       TEXT NOT NULL REFERENCES account(client_id),
+          title       TEXT,
+          content     TEXT NOT NULL DEFAULT '',
+          created_ts  BIGINT NOT NULL,
+          content_version INTEGER NOT NULL DEFAULT 0,
+          version     INTEGER NOT NULL DEFAULT 0,
+          chunk_version INTEGER NOT NULL DEFAULT -1
+        );
+        """)
+        cur.execute("ALTER TABLE file ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 0")
+        cur.execute("ALTER TABLE file ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0")
+        cur.execute("ALTER TABLE file ADD COLUMN IF NOT EXISTS chunk_version INTEGER NOT NULL DEFAULT -1")
+        # Revision history: file.content is the text at file.content_version,
+        # each later revision stores a delta against the one before it, and every
+        # FILE_SNAPSHOT_EVERY-th also stores the full text. file.version is the head.
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS file_revision (
+          file_id     INTEGER NOT NULL REFERENCES file(file_id),
+          version     INTEGER NOT NULL,
+          client_id   TEXT    NOT NULL REFERENCES account(client_id),
+          delta       TEXT    NOT NULL,
+          snapshot    TEXT,
+          created_ts  BIGINT  NOT NULL,
+          PRIMARY KEY (file_id, version)
+        );
+        """)
+        # The text at file.chunk_version cut into ordered paragraph chunks; the
+        # (chunk_no, char_start, char_len) columns are the index for range reads
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS file_chunk (
+          file_id       INTEGER NOT NULL REFERENCES file(file_id),
+          chunk_no      INTEGER NOT NULL,
+          char_start    INTEGER NOT NULL,
+          char_len      INTEGER NOT NULL,
+          content_hash  TEXT    NOT NULL,
+          content       TEXT    NOT NULL,
+          PRIMARY KEY (file_id, chunk_no)
+        );
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS file_revision_snapshot
+            ON file_revision (file_id, version) WHERE snapshot IS NOT NULL
+        """)
+        # Collaborators link table
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS collaborator (
+          file_id    INTEGER NOT NULL REFERENCES file(file_id),
+          client_id  TEXT    NOT NULL REFERENCES account(client_id),
+          role       TEXT    NOT NULL DEFAULT 'edit',
+          PRIMARY KEY (file_id, client_id)
+        );
+        """)
+        # Pending invites
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS invite (
+          invite_id     SERIAL PRIMARY KEY,
+          file_id       INTEGER NOT NULL REFERENCES file(file_id),
+          inviter       TEXT    NOT NULL REFERENCES account(client_id),
+          invitee       TEXT    NOT NULL REFERENCES account(client_id),
+          status        TEXT    NOT NULL CHECK (status IN ('pending','accepted','rejected')),
+          requested_ts  BIGINT NOT NULL
+        );
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS complaint (
+            complaint_id  SERIAL PRIMARY KEY,
+            file_id      INTEGER NOT NULL REFERENCES file(file_id),
+            complainant  TEXT NOT NULL REFERENCES account(client_id),
+            complained   TEXT NOT NULL REFERENCES account(client_id),
+            description  TEXT NOT NULL,
+            status       TEXT NOT NULL CHECK (status IN ('pending', 'resolved')) DEFAULT 'pending',
+            created_ts   BIGINT NOT NULL
+        );
+        """)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS complaint_response (
+            response_id  SERIAL PRIMARY KEY,
+            complaint_id INTEGER NOT NULL REFERENCES complaint(complaint_id),
+            client_id    TEXT NOT NULL REFERENCES account(client_id),
+            response     TEXT NOT NULL,
+            created_ts   BIGINT NOT NULL
+        );
+        """)
+        # Session-state values spilled out of server memory (see enforce_session_budget)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS session_blob (
+            session_id  TEXT NOT NULL,
+            blob_key    TEXT NOT NULL,
+            data        BYTEA NOT NULL,
+            created_ts  BIGINT NOT NULL,
+            PRIMARY KEY (session_id, blob_key)
+        );
+        """)
+        # Flow state that outlives the process serving it (see resume_flow_state)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS flow_state (
+            client_id   TEXT NOT NULL REFERENCES account(client_id),
+            flow_id     TEXT NOT NULL,
+            data        BYTEA NOT NULL,
+            version     INTEGER NOT NULL DEFAULT 1,
+            updated_ts  BIGINT NOT NULL,
+            PRIMARY KEY (client_id, flow_id)
+        );
+        """)
+        cur.execute("""
+        CREATE INDEX IF NOT EXISTS flow_state_updated
+            ON flow_state (updated_ts)
+        """)
+        con.commit()
+    finally:
+        con.close()
 
 # Load login page
 def get_page():
@@ -162,14 +446,16 @@ def add_user(client_id, user_type, password):
 
 def search_user(client_id, password):
     con = get_connection()
-    cur = con.cursor()
-    hash_password = hash_word(password)
-    cur.execute(
-        "SELECT type FROM account WHERE client_id = %s AND password = %s",
-        (client_id, hash_password)
-    )
-    row = cur.fetchone()
-    con.close()
+    try:
+        cur = con.cursor()
+        hash_password = hash_word(password)
+        cur.execute(
+            "SELECT type FROM account WHERE client_id = %s AND password = %s",
+            (client_id, hash_password)
+        )
+        row = cur.fetchone()
+    finally:
+        con.close()
     if not row:
         return None
     # Handle both dict‐ and tuple‐style cursors
@@ -179,13 +465,7 @@ def search_user(client_id, password):
 
 # Logout user session and redirect to login page
 def logout_user():
-    st.session_state['auth_stat'] = None
-    st.session_state['client_id'] = None
-    st.session_state['type'] = None
-    st.session_state['corrected_text'] = None
-    st.session_state['rendered_html'] = None
-    st.session_state['can_download'] = None
-    st.session_state['user_input'] = None
+    clear_session()
     set_page("login")
 
 def free_to_paid(client_id):
@@ -205,6 +485,7 @@ def free_to_paid(client_id):
         con.commit()
     finally:
         con.close()
+    cached_token.clear(client_id)
 
 def free_to_super(client_id):
     con = get_connection()
@@ -235,13 +516,15 @@ def request_free_to_paid(client_id) -> bool:
 
 def get_token(client_id: str) -> tuple[int,int]:
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        "SELECT available, used FROM token WHERE client_id = %s",
-        (client_id,)
-    )
-    row = cur.fetchone()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT available, used FROM token WHERE client_id = %s",
+            (client_id,)
+        )
+        row = cur.fetchone()
+    finally:
+        con.close()
 
     if not row:
         return (0, 0)
@@ -254,43 +537,88 @@ def get_token(client_id: str) -> tuple[int,int]:
 
 def update_token(client_id: str, available: int, used: int) -> None:
     con = get_connection()
-    cur = con.cursor()
-    # upsert the row if it doesn't exist yet
-    cur.execute(
-        """
-        INSERT INTO token (client_id)
-             VALUES (%s)
-        ON CONFLICT (client_id) DO NOTHING
-        """,
-        (client_id,)
-    )
-    # check current balance
-    cur.execute(
-        "SELECT available FROM token WHERE client_id = %s",
-        (client_id,)
-    )
-    row = cur.fetchone()
-    current_available = row["available"] if row else 0
-    # ensure new balance won't be negative
-    if current_available + available < 0:
+    try:
+        cur = con.cursor()
+        # upsert the row if it doesn't exist yet
+        cur.execute(
+            """
+            INSERT INTO token (client_id)
+                 VALUES (%s)
+            ON CONFLICT (client_id) DO NOTHING
+            """,
+            (client_id,)
+        )
+        # check current balance
+        cur.execute(
+            "SELECT available FROM token WHERE client_id = %s",
+            (client_id,)
+        )
+        row = cur.fetchone()
+        current_available = row["available"] if row else 0
+        # ensure new balance won't be negative
+        if current_available + available < 0:
+            raise ValueError(f"Cannot deduct {abs(available)} tokens: only {current_available} available")
+        # apply the delta
+        cur.execute(
+            """
+            UPDATE token
+               SET available = available + %s,
+                   used      = used      + %s
+             WHERE client_id = %s
+            """,
+            (available, used, client_id)
+        )
+        con.commit()
+        note_write()
+    finally:
         con.close()
-        raise ValueError(f"Cannot deduct {abs(available)} tokens: only {current_available} available")
-    # apply the delta
-    cur.execute(
-        """
-        UPDATE token
-           SET available = available + %s,
-               used      = used      + %s
-         WHERE client_id = %s
-        """,
-        (available, used, client_id)
-    )
-    con.commit()
-    con.close()
+    cached_token.clear(client_id)
+
+# Read-mostly lookups for display, cached per argument and cleared by the
+# helpers that change them. Charging paths keep calling the uncached versions.
+# A reload after such a clear must see the write, so these read the primary.
+@st.cache_data(ttl=120, show_spinner=False)
+def cached_token(client_id: str) -> tuple[int, int]:
+    return get_token(client_id)
+
+@st.cache_data(ttl=120, show_spinner=False)
+def cached_correction_count(client_id: str) -> int:
+    return count_correction(client_id)
+
+@st.cache_data(ttl=120, show_spinner=False)
+def cached_invites(user: str) -> list[dict]:
+    return list_invites_for(user, None)
+
+@st.cache_data(ttl=120, show_spinner=False)
+def cached_files(user: str) -> list[dict]:
+    return list_files_for(user, None)
+
+# Pushed notification state: one LISTEN connection per process, refreshed by
+# NOTIFY events from the helpers below instead of polling on every rerun
+NOTIFY_REFRESH_SECONDS = 5
+
+@st.cache_resource(show_spinner=False)
+def get_notifications() -> NotificationHub:
+    return NotificationHub(DB_URL)
+
+# The hub keeps what it loads until the next event, so a load must include that event
+def notified_invites(user: str) -> list[dict]:
+    hub = get_notifications()
+    rows = hub.get("invites", user, lambda u: list_invites_for(u, hub.changed_lsn("invites", u)))
+    return cached_invites(user) if rows is None else rows
+
+def notified_files(user: str) -> list[dict]:
+    hub = get_notifications()
+    rows = hub.get("files", user, lambda u: list_files_for(u, hub.changed_lsn("files", u)))
+    return cached_files(user) if rows is None else rows
+
+# None while the listener is down, so the caller can decide whether to query
+def notified_complaints(user: str) -> list[dict] | None:
+    return get_notifications().get("complaints", user, get_complaint_paid)
 
 def show_paid_user_metrics(client_id):
-    available, used = get_token(client_id)
-    corrections = count_correction(client_id)
+    available, used = cached_token(client_id)
+    corrections = cached_correction_count(client_id)
     c1, c2, c3 = st.columns(3)
     with c1:
         st.metric("Available Tokens", available)
@@ -300,44 +628,22 @@ def show_paid_user_metrics(client_id):
         st.metric("Corrections", corrections)
 
 def count_price(orig: str, final: str) -> int:
-    orig = normalize_punctuation(orig)
-    final = normalize_punctuation(final)
-    a = orig.split()
-    b = final.split()
-    s = SequenceMatcher(None, a, b)
-    cost = 0
-    for tag, i1, i2, j1, j2 in s.get_opcodes():
-        if tag != "equal":
-            if tag == "delete":
-                cost += (i2 - i1)
-            else:  # "replace" or "insert"
-                cost += (j2 - j1)
-    return cost
+    return get_edit_analysis(orig, final).cost
 
 def self_correct_cost(orig: str, final: str) -> int:
-    orig = normalize_punctuation(orig)
-    final = normalize_punctuation(final)
-    a = orig.split()
-    b = final.split()
-    s = SequenceMatcher(None, a, b)
-    cost = 0
-    for tag, i1, i2, j1, j2 in s.get_opcodes():
-        if tag != "equal":
-            if tag == "delete":
-                cost += (i2 - i1)
-            else:
-                cost += (j2 - j1)
-    return (cost + 1) // 2
+    return (get_edit_analysis(orig, final).cost + 1) // 2
 
 def get_lockout(client_id: str) -> int:
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        "SELECT lock_ts FROM lockout WHERE client_id = %s",
-        (client_id,)
-    )
-    row = cur.fetchone()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT lock_ts FROM lockout WHERE client_id = %s",
+            (client_id,)
+        )
+        row = cur.fetchone()
+    finally:
+        con.close()
 
     if not row:
         return 0
@@ -350,43 +656,59 @@ def get_lockout(client_id: str) -> int:
 def set_lockout(client_id: str, duration: int) -> None:
     lock_time = int(time.time()) + duration
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO lockout (client_id, lock_ts)
-             VALUES (%s, %s)
-        ON CONFLICT (client_id) DO UPDATE
-          SET lock_ts = EXCLUDED.lock_ts
-        """,
-        (client_id, lock_time)
-    )
-    con.commit()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO lockout (client_id, lock_ts)
+                 VALUES (%s, %s)
+            ON CONFLICT (client_id) DO UPDATE
+              SET lock_ts = EXCLUDED.lock_ts
+            """,
+            (client_id, lock_time)
+        )
+        con.commit()
+    finally:
+        con.close()
 
 def remove_lockout(client_id: str) -> None:
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        "DELETE FROM lockout WHERE client_id = %s",
-        (client_id,)
-    )
-    con.commit()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "DELETE FROM lockout WHERE client_id = %s",
+            (client_id,)
+        )
+        con.commit()
+    finally:
+        con.close()
 
-def get_submission(client_id: str) -> list[tuple]:
-    con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        """
-        SELECT original, corrected, error, event_ts
-          FROM submission
-         WHERE client_id = %s
-      ORDER BY event_ts DESC
-        """,
-        (client_id,)
-    )
-    rows = cur.fetchall()
-    con.close()
+def get_submission(client_id: str, archived: bool = False) -> list[tuple]:
+    def query(cur):
+        cur.execute(
+            """
+            SELECT original, corrected, error, event_ts
+              FROM submission
+             WHERE client_id = %s
+          ORDER BY event_ts DESC
+            """,
+            (client_id,)
+        )
+        rows = cur.fetchall()
+        # Older submissions come back from their archived partitions on request
+        if archived:
+            cur.execute(
+                """
+                SELECT data FROM archive_chunk
+                 WHERE table_name = 'submission' AND client_id = %s
+                """,
+                (client_id,)
+            )
+            for chunk in cur.fetchall():
+                rows.extend(unpack_rows(bytes(chunk["data"])))
+            rows.sort(key=lambda r: r["event_ts"], reverse=True)
+        return rows
+    rows = run_read(query)
 
     # if rows are dicts, convert to tuples
     out = []
@@ -399,27 +721,35 @@ def get_submission(client_id: str) -> list[tuple]:
 
 def set_submission(client_id: str, original: str, corrected: str, error: int) -> None:
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        """
-        INSERT INTO submission
-            (client_id, original, corrected, error, event_ts)
-         VALUES (%s, %s, %s, %s, %s)
-        """,
-        (client_id, original, corrected, error, int(time.time()))
-    )
-    con.commit()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            """
+            INSERT INTO submission
+                (client_id, original, corrected, error, event_ts)
+             VALUES (%s, %s, %s, %s, %s)
+            """,
+            (client_id, original, corrected, error, int(time.time()))
+        )
+        con.commit()
+        note_write()
+    finally:
+        con.close()
+    cached_correction_count.clear(client_id)
 
 def count_correction(client_id: str) -> int:
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        "SELECT COUNT(*) FROM submission WHERE client_id = %s",
-        (client_id,)
-    )
-    row = cur.fetchone()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT (SELECT COUNT(*) FROM submission WHERE client_id = %s) + "
+            "(SELECT COALESCE(SUM(row_count), 0) FROM archive_chunk "
+            "WHERE table_name = 'submission' AND client_id = %s)",
+            (client_id, client_id)
+        )
+        row = cur.fetchone()
+    finally:
+        con.close()
     # handle RealDictCursor
     if isinstance(row, dict):
         # psycopg2 RealDictCursor returns {'count': 123}
@@ -427,35 +757,233 @@ def count_correction(client_id: str) -> int:
         return int(next(iter(row.values())))
     return row[0]
 
+class TextCache:
+    """Thread-safe LRU shared by all sessions, keyed by text hash and bounded by total characters."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.entries = OrderedDict()
+        self.chars = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        # a single huge value would just evict everything else
+        if len(value) > self.max_chars // 4:
+            return
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.chars += len(value)
+            while self.chars > self.max_chars:
+                _, old = self.entries.popitem(last=False)
+                self.chars -= len(old)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.chars = 0
+
+# Within ASCII, ftfy only touches control characters (including \r line
+# breaks and terminal escapes) and HTML entities; NFKC changes nothing
+_ASCII_NEEDS_NORMALIZE = re.compile(r"[\x00-\x08\x0b-\x1f\x7f&]")
+_normalize_cache = TextCache(8_000_000)
+
 # No special characters for punctuation
 def normalize_punctuation(text: str) -> str:
-    fixed = ftfy.fix_text(text)
-    return unicodedata.normalize("NFKC", fixed)
-
-# Remove HTML tags
+    # Plain printable ASCII is already normalized; skip ftfy entirely
+    if text.isascii() and not _ASCII_NEEDS_NORMALIZE.search(text):
+        return text
+    key = text_hash(text)
+    fixed = _normalize_cache.get(key)
+    if fixed is None:
+        fixed = unicodedata.normalize("NFKC", ftfy.fix_text(text))
+        _normalize_cache.put(key, fixed)
+    return fixed
+
+# Content hash used to key the per-session memos below
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+# Small LRU kept in st.session_state so every rerun of the same session reuses it
+def session_memo(name: str) -> OrderedDict:
+    memo = st.session_state.get(name)
+    if memo is None:
+        memo = OrderedDict()
+        st.session_state[name] = memo
+    return memo
+
+def _memo_put(memo: OrderedDict, key, value, maxsize: int) -> None:
+    memo[key] = value
+    memo.move_to_end(key)
+    while len(memo) > maxsize:
+        memo.popitem(last=False)
+
+@dataclass(frozen=True)
+class EditAnalysis:
+    """Everything derived from one original/corrected pair, computed once."""
+    orig_text: str
+    final_text: str
+    orig_words: list[str]
+    final_words: list[str]
+    final_breaks: list[int]
+    orig_ids: np.ndarray
+    final_ids: np.ndarray
+    opcodes: list[tuple[str, int, int, int, int]]
+    cost: int
+
+EDIT_ANALYSIS_CACHE_SIZE = 8
+
+# Normalize, tokenize and diff an original/corrected pair, memoized per session.
+# Looked up first by raw content hash, then by the normalized word sequence, so
+# the LLM output and the text extracted back from the viewer share one entry.
+def get_edit_analysis(orig: str, final: str) -> EditAnalysis:
+    memo = session_memo("_edit_analyses")
+    raw_key = ("raw", text_hash(orig), text_hash(final))
+    analysis = memo.get(raw_key)
+    if analysis is not None:
+        memo.move_to_end(raw_key)
+        return analysis
+
+    orig_text = normalize_punctuation(orig)
+    final_text = normalize_punctuation(final)
+    orig_words = orig_text.split()
+    final_words, final_breaks = layout_words(final_text)
+    word_key = ("words", text_hash(" ".join(orig_words)), text_hash(" ".join(final_words)))
+    analysis = memo.get(word_key)
+    if analysis is None:
+        orig_ids, final_ids = intern_tokens(orig_words, final_words)
+        opcodes = opcodes_from_ids(orig_ids, final_ids)
+        analysis = EditAnalysis(
+            orig_text, final_text, orig_words, final_words, final_breaks,
+            orig_ids, final_ids, opcodes, edit_cost(opcodes)
+        )
+        _memo_put(memo, word_key, analysis, EDIT_ANALYSIS_CACHE_SIZE)
+    elif analysis.final_breaks != final_breaks or analysis.final_text != final_text or analysis.orig_text != orig_text:
+        # Same words laid out differently: keep the diff, take this pair's layout
+        analysis = replace(analysis, orig_text=orig_text, final_text=final_text, final_breaks=final_breaks)
+    _memo_put(memo, raw_key, analysis, EDIT_ANALYSIS_CACHE_SIZE)
+    return analysis
+
+# Split text into words plus the break after each one:
+# 0 = same line, 1 = line break, 2 = paragraph break
+def layout_words(text: str) -> tuple[list[str], list[int]]:
+    words, breaks = [], []
+    for para in text.strip().split("\n\n"):
+        for line in para.splitlines():
+            line_words = line.split()
+            if line_words:
+                words.extend(line_words)
+                breaks.extend([0] * (len(line_words) - 1) + [1])
+        if breaks:
+            breaks[-1] = 2
+    return words, breaks
+
+# One token per <style> block or tag (quoted attribute values may contain '>')
+_HTML_TOKEN = re.compile(
+    r"<style\b.*?</style\s*>|<!--.*?-->|</?(?P<name>[a-zA-Z][\w-]*)(?:[^>\"']|\"[^\"]*\"|'[^']*')*>",
+    re.S | re.I
+)
+# Tags that end a line in the viewer's markup; toggle spans are inline text
+_BREAK_TAGS = {"br", "div", "p"}
+_clean_text_cache = TextCache(8_000_000)
+
+# Text the viewer shows once the toggles with the given data-ids are flipped
+# back to their originals, in the same shape html_to_clean_text gives the HTML
+def apply_toggles(parts: list, flipped: list[int] | None) -> str:
+    flipped = set(flipped or ())
+    out = []
+    toggle_id = 0
+    for part in parts:
+        if isinstance(part, str):
+            out.append(part)
+        else:
+            out.append(part[0] if toggle_id in flipped else part[1])
+            toggle_id += 1
+    lines = (" ".join(line.split()) for line in "".join(out).splitlines())
+    return "\n\n".join(ln for ln in lines if ln)
+
+# Remove HTML tags: one scan over the markup, every non-empty line becomes
+# its own paragraph. Memoized because the confirm/preview/download screens
+# re-extract the same viewer HTML on every rerun.
 def html_to_clean_text(html_data: str) -> str:
-    html = re.sub(r"<style.*?>.*?</style>", "", html_data, flags=re.S)
-    html = re.sub(r"</div>\s*<div[^>]*>", "\n\n", html)
-    html = re.sub(r"(?:<br\s*/?>\s*){2,}", "\n\n", html)
-    html = re.sub(r"<br\s*/?>", "\n", html)
-    text = re.sub(r"<[^>]+>", "", html)
-    lines = [" ".join(line.split()) for line in text.splitlines()]
-    return "\n\n".join([ln for ln in lines if ln.strip()])
-
-def correct_text(user_input, self_correction=False):
-    try:
-        # Load approved blacklist words
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("SELECT word FROM blacklist WHERE status = 'approved'")
-        blacklisted = {row[0] for row in cur.fetchall()}
-        con.close()
-
-        # Token use
-        word_count = len(user_input.strip().split())
-
-        # Common LLM instruction
-        LLM_instruction = '''
+    key = text_hash(html_data)
+    text = _clean_text_cache.get(key)
+    if text is not None:
+        return text
+
+    pieces = []
+    pos = 0
+    for m in _HTML_TOKEN.finditer(html_data):
+        if m.start() > pos:
+            pieces.append(html_data[pos:m.start()])
+        pos = m.end()
+        name = m.group("name")
+        if name and name.lower() in _BREAK_TAGS:
+            pieces.append("\n")
+    pieces.append(html_data[pos:])
+
+    lines = (" ".join(line.split()) for line in html_lib.unescape("".join(pieces)).splitlines())
+    text = "\n\n".join(ln for ln in lines if ln)
+    _clean_text_cache.put(key, text)
+    return text
+
+# Viewer HTML and plain-text parts for a correction. Only words the
+# correction touched are censored; toggles are numbered from 0.
+def render_correction(analysis: EditAnalysis, censor: PhraseMatcher) -> tuple[str, list, list[str]]:
+    html_body = ""
+    to_log = []
+    o_words = analysis.orig_words
+    c_words, c_breaks = analysis.final_words, analysis.final_breaks
+    censored = censor.mask(c_words)
+    # Plain-text mirror of the HTML: str parts are fixed text, tuples are
+    # (original, corrected) toggles in data-id order. The viewer only
+    # reports which ids were flipped and apply_toggles rebuilds the text.
+    parts = []
+    toggle_id = 0
+    for tag, o1, o2, c1, c2 in analysis.opcodes:
+        if tag == 'equal':
+            for c in range(c1, c2):
+                html_body += html_lib.escape(c_words[c], quote=True) + " " + "<br>" * c_breaks[c]
+                parts.append(c_words[c] + " " + "\n" * c_breaks[c])
+        else:
+            # censor blacklisted words/phrases the correction touches
+            seg_words = []
+            for c in range(c1, c2):
+                if censored[c]:
+                    to_log.append(censored[c])
+                    seg_words.append("***")
+                else:
+                    seg_words.append(c_words[c])
+            segment = " ".join(seg_words)
+            original = " ".join(o_words[o1:o2])
+            orig_esc = html_lib.escape(original, quote=True)
+            seg_esc = html_lib.escape(segment, quote=True)
+            html_body += (
+                f'<span class="toggle" data-id="{toggle_id}" '
+                f'data-original="{orig_esc}" '
+                f'data-corrected="{seg_esc}" '
+                f'style="background:#2EBD2E; border-radius:8px; '
+                f'padding:4px; display:inline-block; cursor:pointer; '
+                f'font-size:16px; color:white;">'
+                f'{seg_esc}</span> '
+            )
+            # a change spanning a break keeps the widest one after it
+            brk = max(c_breaks[c1:c2], default=0)
+            html_body += "<br>" * brk
+            parts.append((original, segment))
+            parts.append(" " + "\n" * brk)
+            toggle_id += 1
+    return html_body, parts, to_log
+
+# Common LLM instruction
+LLM_INSTRUCTION = '''
             You are a grammar checker.
             Your task is to identify grammatical errors in the input text, such as subject-verb agreement, article usage, or verb tense.
             Example: In 'I is an student.', errors are 'is' (should be 'am') and 'an student' (should be 'a student').
@@ -470,9 +998,8 @@ def correct_text(user_input, self_correction=False):
             Do not act as a chatbot, calculator, or problem solver.
         '''
 
-        if self_correction:
-            # Modified instruction for self-correction: identify errors only
-            LLM_instruction += '''
+# Self-correction: identify errors only
+SELF_CORRECTION_INSTRUCTION = '''
                 For each word or phrase with a grammatical error, output the original word or phrase exactly as it appears in the input.
                 Output format: List each erroneous word or phrase on a new line.
                 Example:
@@ -482,9 +1009,9 @@ def correct_text(user_input, self_correction=False):
                 an student
                 If no errors, output nothing.
             '''
-        else:
-            # Standard instruction for LLM correction
-            LLM_instruction += '''
+
+# Standard correction
+STANDARD_INSTRUCTION = '''
                 Output the input text with any grammatical errors corrected, preserving the original intent and structure.
                 Example: Input 'I is an student.', output 'I am a student.'.
                 If the input has no grammatical errors, output it unchanged.
@@ -492,143 +1019,114 @@ def correct_text(user_input, self_correction=False):
                 Output only the corrected or unchanged input text. Do not provide explanations, comments, or additional content.
             '''
 
+def run_model(text: str, self_correction: bool = False) -> str:
+    instruction = LLM_INSTRUCTION + (SELF_CORRECTION_INSTRUCTION if self_correction else STANDARD_INSTRUCTION)
+    resp = get_llm().generate(
+        model="mistral",
+        prompt=f"{instruction}\n\nInput: {text}\n\nOutput:",
+        options={
+            "temperature": 0.0,
+            "top_p": 1.0,
+            "max_tokens": 1024
+        }
+    )
+    return resp['response'].strip()
+
+# Spans per stage go to stage_metrics, labelled with the flow, tier and input size.
+# A replay renders a correction made earlier again: nothing is billed or logged.
+def correct_text(user_input, self_correction=False, replay=False):
+    # Token use
+    word_count = len(user_input.strip().split())
+    flow = "self_correction" if self_correction else "correct_text"
+    span = lambda stage: stage_span(flow, stage, word_count)
+    with span("total"), profile_run("correct_text") if profile_requested("correct_text") else nullcontext():
+        _correct_text(user_input, self_correction, replay, word_count, span)
+
+def _correct_text(user_input, self_correction, replay, word_count, span):
+    try:
+        # Approved blacklist, compiled once and shared across sessions
+        with span("blacklist"):
+            censor = get_censor()
+
         # Generate response
-        resp = ollama.generate(
-            model="mistral",
-            prompt=f"{LLM_instruction}\n\nInput: {user_input}\n\nOutput:",
-            options={
-                "temperature": 0.0,
-                "top_p": 1.0,
-                "max_tokens": 1024
-            }
-        )
-        output = resp['response'].strip()
+        with span("model"):
+            output = run_model(user_input, self_correction)
 
         # Paid‐user token accounting & history
-        if st.session_state['type'] == 'P':
-            available, _ = get_token(st.session_state['client_id'])
-            if available < word_count:
-                st.error(f"Not enough tokens for correction. Required: {word_count}, Available: {available}")
-                st.session_state["rendered_html"] = None
-                st.session_state["corrected_text"] = None
-                st.stop()
-            update_token(st.session_state['client_id'], -word_count, word_count)
+        if st.session_state['type'] == 'P' and not replay:
+            with span("tokens"):
+                available, _ = get_token(st.session_state['client_id'])
+                if available < word_count:
+                    st.error(f"Not enough tokens for correction. Required: {word_count}, Available: {available}")
+                    st.session_state["rendered_html"] = None
+                    st.session_state["corrected_text"] = None
+                    st.stop()
+                update_token(st.session_state['client_id'], -word_count, word_count)
             if not self_correction:
                 grammar_error = user_input.strip() != output.strip()
-                set_submission(
-                    st.session_state['client_id'],
-                    user_input,
-                    output,
-                    1 if grammar_error else 0
-                )
+                with span("submission"):
+                    set_submission(
+                        st.session_state['client_id'],
+                        user_input,
+                        output,
+                        1 if grammar_error else 0
+                    )
                 if word_count > 10 and not grammar_error:
-                    update_token(st.session_state['client_id'], 3, 0)
+                    with span("tokens"):
+                        update_token(st.session_state['client_id'], 3, 0)
                     st.success("No error found. Awarded 3 bonus tokens.")
 
         # Prepare diff/HTML
-        orig_text = normalize_punctuation(user_input)
-        orig_paras = orig_text.strip().split("\n\n")
-        html_body = ""
-        to_log = []
-
-        if self_correction:
-            # Highlight erroneous words/phrases
-            error_words = output.splitlines() if output else []
-            for para in orig_paras:
-                lines = para.splitlines()
-                for line in lines:
-                    words = line.split()
-                    i = 0
-                    while i < len(words):
-                        matched = False
-                        for err in error_words:
-                            err_len = len(err.split())
-                            if i + err_len <= len(words):
-                                phrase = " ".join(words[i:i + err_len])
-                                if phrase == err:
-                                    # Highlight the erroneous phrase
-                                    phrase_esc = html_lib.escape(phrase, quote=True)
-                                    html_body += (
-                                        f'<span class="toggle" '
-                                        f'data-original="{phrase_esc}" '
-                                        f'style="background:#2EBD2E; border-radius:8px; '
-                                        f'padding:4px; display:inline-block; cursor:pointer; '
-                                        f'font-size:16px; color:white;">'
-                                        f'{phrase_esc}</span> '
-                                    )
-                                    i += err_len
-                                    matched = True
-                                    break
-                        if not matched:
-                            # Non-erroneous word
-                            word = words[i]
-                            # Check for blacklisted words
-                            clean = re.sub(r'\W+', '', word).lower()
-                            if clean in blacklisted:
-                                to_log.append(clean)
-                                word = "***"
-                            html_body += html_lib.escape(word, quote=True) + " "
-                            i += 1
-                    html_body += "<br>"
-                html_body += "<br>"
-            st.session_state["corrected_text"] = user_input  # Keep original for editing
-        else:
-            # Standard LLM correction
-            corr_text = normalize_punctuation(output)
-            corr_paras = corr_text.strip().split("\n\n")
-            for orig_para, corr_para in zip(orig_paras, corr_paras):
-                orig_lines = orig_para.splitlines()
-                corr_lines = corr_para.splitlines()
-                for o_line, c_line in zip(orig_lines, corr_lines):
-                    o_words = o_line.split()
-                    c_words = c_line.split()
-                    diff = SequenceMatcher(None, o_words, c_words)
-                    for tag, o1, o2, c1, c2 in diff.get_opcodes():
-                        if tag == 'equal':
-                            html_body += " ".join(c_words[c1:c2]) + " "
-                        else:
-                            segment = " ".join(c_words[c1:c2])
-                            original = " ".join(o_words[o1:o2])
-                            # log blacklisted
-                            for w in c_words[c1:c2]:
-                                clean = re.sub(r'\W+', '', w).lower()
-                                if clean in blacklisted:
-                                    to_log.append(clean)
-                                    segment = segment.replace(w, "***")
-                            orig_esc = html_lib.escape(original, quote=True)
-                            seg_esc = html_lib.escape(segment, quote=True)
-                            html_body += (
-                                f'<span class="toggle" '
-                                f'data-original="{orig_esc}" '
-                                f'data-corrected="{seg_esc}" '
-                                f'style="background:#2EBD2E; border-radius:8px; '
-                                f'padding:4px; display:inline-block; cursor:pointer; '
-                                f'font-size:16px; color:white;">'
-                                f'{seg_esc}</span> '
-                            )
-                    html_body += "<br>"
-                html_body += "<br>"
-            st.session_state["corrected_text"] = "\n\n".join(output.split("\n\n"))
-
-        # Log any censored words
-        if to_log:
-            con = get_connection()
-            cur = con.cursor()
-            for w in set(to_log):
-                cur.execute(
-                    """
-                    INSERT INTO censor_log (client_id, original_word, event_ts)
-                         VALUES (%s, %s, %s)
-                    """,
-                    (st.session_state['client_id'], w, int(time.time()))
-                )
-            con.commit()
-            con.close()
+        with span("render"):
+            html_body = ""
+            to_log = []
+
+            if self_correction:
+                # Highlight erroneous words/phrases; everything else is censored
+                # in the same pass over the original's words
+                words, breaks = layout_words(normalize_punctuation(user_input))
+                errors = PhraseMatcher(output.splitlines() if output else [], key=str)
+                censored = censor.mask(words)
+                i = 0
+                for start, end, _ in errors.scan(words) + [(len(words), len(words), None)]:
+                    for k in range(i, start):
+                        word = words[k]
+                        if censored[k]:
+                            to_log.append(censored[k])
+                            word = "***"
+                        html_body += html_lib.escape(word, quote=True) + " " + "<br>" * breaks[k]
+                    if start < end:
+                        # Highlight the erroneous phrase
+                        phrase_esc = html_lib.escape(" ".join(words[start:end]), quote=True)
+                        html_body += (
+                            f'<span class="toggle" '
+                            f'data-original="{phrase_esc}" '
+                            f'style="background:#2EBD2E; border-radius:8px; '
+                            f'padding:4px; display:inline-block; cursor:pointer; '
+                            f'font-size:16px; color:white;">'
+                            f'{phrase_esc}</span> '
+                        )
+                        html_body += "<br>" * max(breaks[start:end])
+                    i = end
+                st.session_state["corrected_text"] = user_input  # Keep original for editing
+            else:
+                # Standard LLM correction: one diff over the whole document, so
+                # merged or split lines and paragraphs no longer drop text
+                html_body, parts, logged = render_correction(get_edit_analysis(user_input, output), censor)
+                to_log.extend(logged)
+                st.session_state["rendered_parts"] = parts
+                st.session_state["corrected_text"] = apply_toggles(parts, [])
+
+        # Log any censored words (written in the background)
+        if to_log and not replay:
+            with span("censor_log"):
+                censor_log.log(st.session_state['client_id'], set(to_log))
 
         # Finalize session state
         html_body = re.sub(r'(<br>\s*)+$', '', html_body)
         st.session_state["rendered_html"] = f"<div>{html_body}</div>"
         st.session_state["can_download"] = False
+        st.session_state["toggles"] = None
         if "original_input" not in st.session_state:
             st.session_state["original_input"] = user_input
 
@@ -636,9 +1134,549 @@ def correct_text(user_input, self_correction=False):
         st.error("❌ Failed to connect to the language model. Please try again.")
         st.stop()
 
+# Collab re-correction: per file, each paragraph's content hash maps to its
+# (model output, HTML fragment, parts, toggle count), so resubmitting a
+# document only sends the paragraphs that changed to the model
+_DATA_ID = re.compile(r'data-id="(\d+)"')
+
+def split_paragraphs(text: str) -> list[str]:
+    return [p.strip() for p in text.strip().split("\n\n") if p.strip()]
+
+# One model call for all paragraphs; one per paragraph if the output's
+# paragraphs don't line up with the input's
+def correct_paragraphs(paras: list[str]) -> list[str]:
+    if len(paras) > 1:
+        out = split_paragraphs(run_model("\n\n".join(paras)))
+        if len(out) == len(paras):
+            return out
+    return [run_model(p) for p in paras]
+
+# Paragraphs per model call are capped by word count, which also keeps each
+# call's output inside the model's max_tokens
+CORRECTION_BATCH_WORDS = 400
+
+# Corrected paragraphs kept per collab file (see correct_paragraph_stream)
+DOC_INDEX_PARAS = 5000
+
+def correct_paragraph_stream(paragraphs: Iterable[str], index_owner: dict | None = None, replay: bool = False) -> None:
+    """
+    Correct a document given as an iterator of paragraphs, a batch of
+    paragraphs per model call, and render it as correct_text does. With an
+    index_owner, paragraphs already corrected into its "index" are reused
+    and only the rest are sent to the model and billed.
+    """
+    try:
+        censor = get_censor()
+        index = index_owner.get("index") if index_owner is not None else None
+        # Fragments were censored against one blacklist; start over on a new one
+        if index is None or index["censor"] != censor.version:
+            index = {"censor": censor.version, "paras": {}}
+        cached = index["paras"]
+        paid = st.session_state['type'] == 'P' and not replay
+
+        hashes = []
+        batch, batch_words = [], 0
+        corrected_in, corrected_out, to_log = [], [], []
+        word_count = 0
+        # This run's corrections join the index only once they are paid for
+        fresh = {}
+
+        def flush():
+            nonlocal batch, batch_words, word_count
+            if not batch:
+                return
+            if paid:
+                available, _ = get_token(st.session_state['client_id'])
+                if available < word_count + batch_words:
+                    st.error(f"Not enough tokens for correction. Required: {word_count + batch_words}, Available: {available}")
+                    st.stop()
+            for para, output in zip(batch, correct_paragraphs(batch)):
+                html_body, parts, logged = render_correction(get_edit_analysis(para, output), censor)
+                toggles = sum(1 for part in parts if not isinstance(part, str))
+                fresh[text_hash(para)] = (output, html_body, parts, toggles)
+                corrected_in.append(para)
+                corrected_out.append(output)
+                to_log.extend(logged)
+            word_count += batch_words
+            batch, batch_words = [], 0
+
+        queued = set()
+        for para in paragraphs:
+            h = text_hash(para)
+            hashes.append(h)
+            if h in cached or h in queued:
+                continue
+            queued.add(h)
+            batch.append(para)
+            batch_words += len(para.split())
+            if batch_words >= CORRECTION_BATCH_WORDS:
+                flush()
+        flush()
+
+        if to_log and not replay:
+            censor_log.log(st.session_state['client_id'], set(to_log))
+        if paid and corrected_in:
+            update_token(st.session_state['client_id'], -word_count, word_count)
+        # Paid for (or free on this tier): from here on they can be reused
+        cached.update(fresh)
+        if paid and corrected_in:
+            original = "\n\n".join(corrected_in)
+            corrected = "\n\n".join(corrected_out)
+            grammar_error = original != corrected
+            set_submission(st.session_state['client_id'], original, corrected, 1 if grammar_error else 0)
+            if word_count > 10 and not grammar_error:
+                update_token(st.session_state['client_id'], 3, 0)
+                st.success("No error found. Awarded 3 bonus tokens.")
+
+        # Reassemble from fragments, renumbering toggles into one sequence
+        html_pieces, all_parts = [], []
+        offset = 0
+        for h in hashes:
+            _, html_body, parts, toggles = cached[h]
+            if offset and toggles:
+                html_body = _DATA_ID.sub(lambda m: f'data-id="{int(m.group(1)) + offset}"', html_body)
+            html_pieces.append(html_body)
+            all_parts.extend(parts)
+            offset += toggles
+        if index_owner is not None:
+            # The index spans every window corrected so far, so going back to
+            # one is free; past DOC_INDEX_PARAS the least recently used go
+            for h in hashes:
+                cached[h] = cached.pop(h)
+            for h in list(cached)[:max(0, len(cached) - DOC_INDEX_PARAS)]:
+                del cached[h]
+            index_owner["index"] = index
+
+        html_body = re.sub(r'(<br>\s*)+$', '', "".join(html_pieces))
+        st.session_state["rendered_html"] = f"<div>{html_body}</div>"
+        st.session_state["rendered_parts"] = all_parts
+        st.session_state["corrected_text"] = apply_toggles(all_parts, [])
+        st.session_state["can_download"] = False
+        st.session_state["toggles"] = None
+
+    except Exception:
+        st.error("❌ Failed to connect to the language model. Please try again.")
+        st.stop()
+
+# Upload scans are kept per uploaded file (and tier) so reruns don't re-read it
+def scan_uploaded(uploaded) -> UploadScan:
+    memo = session_memo("_upload_scans")
+    key = (uploaded.file_id, st.session_state['type'])
+    scan = memo.get(key)
+    if scan is None:
+        scan = scan_upload(uploaded, st.session_state['type'])
+        _memo_put(memo, key, scan, 4)
+    return scan
+
+# A streamed upload is kept as {"file_id", "encoding"}; its text is decoded
+# again from the uploaded file when the whole of it is needed
+# (self-correction, pricing) rather than kept in session state. Both return
+# None once the file is gone or replaced.
+def uploaded_file_for(ref: dict | None):
+    uploaded = st.session_state.get("uploaded_file")
+    if not ref or uploaded is None or uploaded.file_id != ref["file_id"]:
+        return None
+    return uploaded
+
+def upload_text(ref: dict | None) -> str | None:
+    uploaded = uploaded_file_for(ref)
+    return "\n\n".join(iter_paragraphs(uploaded, ref["encoding"])) if uploaded else None
+
+def correct_document(file_id: int, user_input: str) -> None:
+    """correct_text for the collab editor, billed only for changed paragraphs."""
+    correct_paragraph_stream(split_paragraphs(user_input), collab_state(file_id))
+
+# Background batched writer for censor_log, one per process
+censor_log = CensorLogWriter(lambda: get_connection())
+
+# Stage timings for the correction, confirm and download flows, one registry
+# per process. Exported in Prometheus text format on METRICS_PORT
+# (GET /metrics) and/or rewritten to METRICS_FILE every METRICS_FILE_SECONDS.
+stage_metrics = StageMetrics()
+stage_metrics.add_collector(
+    "censor_log_events_total", "counter",
+    "Censor log events: written (late ones included), late, dropped on a full queue, failed to insert.",
+    lambda: [({"outcome": k}, v) for k, v in censor_log.stats().items() if k != "queued"]
+)
+stage_metrics.add_collector(
+    "censor_log_queued", "gauge", "Censor log events waiting to be written.",
+    lambda: [({}, censor_log.stats()["queued"])]
+)
+
+def stage_span(flow: str, stage: str, words: int):
+    return stage_metrics.span(
+        flow=flow, stage=stage,
+        tier=st.session_state.get("type") or "none",
+        size=size_bucket(words)
+    )
+
+# Opt-in CPU/memory profiling of one whole rerun or one correct_text call.
+# PROFILE_MODE=rerun|correct_text profiles every such run (only for the
+# users in PROFILE_USERS, if set); with PROFILE_ALLOW_PARAM=1,
+# ?profile=rerun or ?profile=correct_text profiles the session's next one.
+# Reports go to PROFILE_DIR and are listed in the super-user panel.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MODE = os.getenv("PROFILE_MODE", "")
+PROFILE_USERS = {u.strip() for u in os.getenv("PROFILE_USERS", "").split(",") if u.strip()}
+PROFILE_ALLOW_PARAM = os.getenv("PROFILE_ALLOW_PARAM") == "1"
+
+def profile_requested(kind: str) -> bool:
+    if PROFILE_MODE == kind:
+        return not PROFILE_USERS or st.session_state.get("name") in PROFILE_USERS
+    return PROFILE_ALLOW_PARAM and st.query_params.get("profile") == kind
+
+@contextmanager
+def profile_run(kind: str):
+    # The query parameter is one-shot
+    if st.query_params.get("profile") == kind:
+        del st.query_params["profile"]
+    user = st.session_state.get("name") or st.session_state.get("client_id") or "anonymous"
+    meta = {"user": user, "tier": st.session_state.get("type"), "page": get_page()}
+    with profile_to(PROFILE_DIR, kind, user, meta):
+        yield
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_export() -> bool:
+    port = os.getenv("METRICS_PORT")
+    path = os.getenv("METRICS_FILE")
+    if port:
+        try:
+            stage_metrics.serve(int(port), os.getenv("METRICS_HOST", "127.0.0.1"))
+        except OSError:
+            # Another process already serves this port; it only sees its own spans
+            pass
+    if path:
+        stage_metrics.write_every(path, float(os.getenv("METRICS_FILE_SECONDS", "15")))
+    return True
+
+# Partition upkeep for submission and censor_log: the coming months'
+# partitions are created ahead, and partitions older than the table's
+# retention (in months) are packed into archive_chunk, plus Parquet files
+# under ARCHIVE_PARQUET_DIR if set, and dropped. Runs in a background thread
+# every PARTITION_CHECK_SECONDS, one process at a time; 0 turns the thread
+# off (call maintain_partitions() from a scheduled job instead).
+ARCHIVE_AFTER_MONTHS = {
+    "submission": int(os.getenv("SUBMISSION_RETENTION_MONTHS", "6")),
+    "censor_log": int(os.getenv("CENSOR_LOG_RETENTION_MONTHS", "3")),
+}
+ARCHIVE_PARQUET_DIR = os.getenv("ARCHIVE_PARQUET_DIR") or None
+PARTITION_CHECK_SECONDS = float(os.getenv("PARTITION_CHECK_SECONDS", str(6 * 3600)))
+
+# Background runs in this process, exported with the stage metrics
+partition_runs = {"ok": 0, "failed": 0, "last_success": 0.0}
+stage_metrics.add_collector(
+    "partition_maintenance_runs_total", "counter", "Background partition maintenance runs by outcome.",
+    lambda: [({"outcome": k}, partition_runs[k]) for k in ("ok", "failed")]
+)
+stage_metrics.add_collector(
+    "partition_maintenance_last_success_seconds", "gauge",
+    "Unix time of the last successful partition maintenance run (0: none yet).",
+    lambda: [({}, partition_runs["last_success"])]
+)
+
+def maintain_partitions() -> dict:
+    return maintain(get_connection, ARCHIVE_AFTER_MONTHS, parquet_dir=ARCHIVE_PARQUET_DIR)
+
+@st.cache_resource(show_spinner=False)
+def start_partition_maintenance() -> bool:
+    if PARTITION_CHECK_SECONDS <= 0:
+        return False
+    def run():
+        while True:
+            try:
+                done = maintain_partitions()
+            except Exception:
+                # Rows keep landing in the default partition; retried next time
+                partition_runs["failed"] += 1
+                log.exception("Partition maintenance failed")
+            else:
+                partition_runs["ok"] += 1
+                partition_runs["last_success"] = time.time()
+                if done["created"] or done["archived"]:
+                    log.info("Partition maintenance created %s, archived %s", done["created"], done["archived"])
+            time.sleep(PARTITION_CHECK_SECONDS)
+    threading.Thread(target=run, name="partition-maintenance", daemon=True).start()
+    return True
+
+# Per-session memory budget. Per-file collab state lives in one LRU
+# (collab_state); files beyond COLLAB_FILES_KEEP, and then every file but the
+# open one while the session is over SESSION_BUDGET_BYTES, are spilled to
+# session_blob and read back when reopened. Rows left behind by sessions
+# that never come back are deleted after SESSION_SPILL_TTL.
+SESSION_BUDGET_BYTES = int(os.getenv("SESSION_BUDGET_BYTES", str(16 << 20)))
+COLLAB_FILES_KEEP = int(os.getenv("COLLAB_FILES_KEEP", "3"))
+SESSION_SPILL_TTL = 24 * 3600
+# Memos that only save recomputation, dropped next when still over budget
+SESSION_DROPPABLE = ("_edit_analyses", "_upload_scans")
+session_memory = SessionMemory()
+
+def session_id() -> str:
+    return get_script_run_ctx().session_id
+
+def spill_session_blob(key: str, value) -> int:
+    data = pack(value)
+    now = int(time.time())
+    con = get_connection()
+    cur = con.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO session_blob (session_id, blob_key, data, created_ts)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (session_id, blob_key)
+            DO UPDATE SET data = EXCLUDED.data, created_ts = EXCLUDED.created_ts
+            """,
+            (session_id(), key, psycopg2.Binary(data), now)
+        )
+        cur.execute("DELETE FROM session_blob WHERE created_ts < %s", (now - SESSION_SPILL_TTL,))
+        con.commit()
+    finally:
+        con.close()
+    return len(data)
+
+# Read a spilled value back; the row is consumed
+def load_session_blob(key: str):
+    con = get_connection()
+    cur = con.cursor()
+    try:
+        cur.execute(
+            "DELETE FROM session_blob WHERE session_id = %s AND blob_key = %s RETURNING data",
+            (session_id(), key)
+        )
+        row = cur.fetchone()
+        con.commit()
+    finally:
+        con.close()
+    return unpack(bytes(row["data"])) if row else None
+
+# Everything this session holds for one collab file (doc window, submitted
+# original, rendered correction, paragraph index), most recently used last
+def collab_state(file_id: int) -> dict:
+    files = st.session_state.get("_collab_files")
+    if files is None:
+        files = st.session_state["_collab_files"] = OrderedDict()
+    state = files.get(file_id)
+    if state is None or "spilled" in state:
+        try:
+            state = (load_session_blob(f"collab_{file_id}") if state else None) or {}
+        except (psycopg2.Error, RuntimeError, ValueError):
+            state = {}
+        edit = state.pop("edit", None)
+        if edit is not None:
+            st.session_state[f"collab_edit_{file_id}"] = edit
+        files[file_id] = state
+    files.move_to_end(file_id)
+    return state
+
+def _evict_collab_file(files: OrderedDict, file_id: int) -> None:
+    state = files[file_id]
+    # The text area's unsynced edits go with the rest of the file's state
+    edit = st.session_state.get(f"collab_edit_{file_id}")
+    for key in (f"collab_edit_{file_id}", f"collab_first_{file_id}"):
+        st.session_state.pop(key, None)
+    if edit is not None:
+        state = dict(state, edit=edit)
+    if not state:
+        del files[file_id]
+        return
+    try:
+        files[file_id] = {"spilled": spill_session_blob(f"collab_{file_id}", state)}
+    except (psycopg2.Error, RuntimeError):
+        # Nowhere to spill: the file reloads from the database when reopened
+        del files[file_id]
+
+def enforce_session_budget(current_file: int | None = None) -> int:
+    """
+    Evict least recently used collab files, then droppable memos, until the
+    session is within budget, and report its size to session_memory.
+    Called once per full run; returns the session's approximate bytes.
+    """
+    sizes = {key: approx_size(st.session_state[key]) for key in list(st.session_state.keys())}
+    total = sum(sizes.values())
+    files = st.session_state.get("_collab_files") or OrderedDict()
+    in_memory = [fid for fid, state in files.items() if "spilled" not in state]
+    excess = len(in_memory) - COLLAB_FILES_KEEP
+    for fid in in_memory:
+        if excess <= 0 and total <= SESSION_BUDGET_BYTES:
+            break
+        if fid == current_file:
+            continue
+        before = approx_size(files[fid]) + sizes.get(f"collab_edit_{fid}", 0)
+        _evict_collab_file(files, fid)
+        total -= before
+        excess -= 1
+    for key in SESSION_DROPPABLE:
+        if total <= SESSION_BUDGET_BYTES:
+            break
+        if key in st.session_state:
+            del st.session_state[key]
+            total -= sizes.get(key, 0)
+
+    largest = max(sizes, key=sizes.get, default="")
+    session_memory.update(
+        session_id(),
+        user=st.session_state.get("name") or st.session_state.get("client_id") or "",
+        page=get_page(),
+        bytes=total,
+        largest=f"{largest} ({sizes[largest] / 1024:.0f} KiB)" if largest else "",
+        collab_files=sum(1 for state in files.values() if "spilled" not in state),
+        spilled=sum(1 for state in files.values() if "spilled" in state),
+        over_budget=total > SESSION_BUDGET_BYTES
+    )
+    return total
+
+# Logout: drop every session-state key and anything this session spilled
+def clear_session() -> None:
+    try:
+        con = get_connection()
+        try:
+            con.cursor().execute("DELETE FROM session_blob WHERE session_id = %s", (session_id(),))
+            con.commit()
+        finally:
+            con.close()
+    except (psycopg2.Error, RuntimeError):
+        pass
+    end_flow()
+    session_memory.drop(session_id())
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+
+# Flow state that has to survive a process restart or the browser reconnecting
+# to another process: confirmations in progress, the open file and its
+# unsynced edits. Each login gets a flow id, kept in the URL as ?flow=; the
+# FLOW_KEYS found in session state are checkpointed to flow_state whenever
+# they changed (every full run, from the periodic fragments, and right after
+# each state change around a charge). The flow id never logs anyone in: a
+# fresh session on a URL with one shows the login page, and only once the
+# password and lockout checks pass is that user's own state resumed.
+# Only the input (or the upload's reference), the flipped toggles, a confirmed
+# self-correction and flags are kept; renders and corrected text are rebuilt
+# from them (see rebuild_flow_renders). Balances are read again from account.
+FLOW_KEYS = (
+    "pending_submit", "pending_input", "pending_count", "pending_correction_type", "pending_upload",
+    "pending_self_correction", "self_corrected_text", "user_input", "original_input", "original_upload",
+    "confirming_purchase", "can_download", "toggles", "current_file"
+)
+FLOW_STATE_TTL = int(os.getenv("FLOW_STATE_TTL", str(12 * 3600)))
+flow_store = FlowStore(lambda: get_connection(), ttl=FLOW_STATE_TTL)
+
+# Called on a password login that passed the lockout check, before the
+# redirect to the main page: resumes the URL's flow if it is this user's,
+# else starts a new one
+def start_flow() -> None:
+    if not resume_flow_state():
+        st.query_params["flow"] = secrets.token_hex(16)
+    st.session_state.setdefault("_flow_saved", {})
+
+def end_flow() -> None:
+    flow = st.query_params.get("flow")
+    if flow:
+        if st.session_state.get("auth_stat"):
+            try:
+                flow_store.delete(st.session_state['name'], flow)
+            except (psycopg2.Error, RuntimeError):
+                pass
+        del st.query_params["flow"]
+
+def resume_flow_state() -> bool:
+    """
+    Restore the logged-in user's state for this tab's flow id. Returns
+    whether there was any; nothing is restored before a login.
+    """
+    flow = st.query_params.get("flow")
+    if not flow or not st.session_state.get("auth_stat"):
+        return False
+    try:
+        data = flow_store.load(st.session_state['name'], flow)
+    except (psycopg2.Error, RuntimeError):
+        return False
+    if data is None:
+        return False
+    for key, value in data.items():
+        if key != "_collab":
+            st.session_state[key] = value
+    if "_collab" in data:
+        file_id, doc, edit = data["_collab"]
+        collab_state(file_id)["doc"] = dict(doc)
+        st.session_state[f"collab_edit_{file_id}"] = edit
+    st.session_state["_flow_saved"] = data
+    st.session_state["_rebuild_renders"] = True
+    return True
+
+# Once per resumed flow, on the main page: correct its input again, unbilled,
+# to get back the render (and the corrected text) the flow stood at
+def rebuild_flow_renders() -> None:
+    if not st.session_state.pop("_rebuild_renders", False):
+        return
+    ss = st.session_state
+    if ss.get("pending_submit"):
+        return
+    if ss.get("pending_self_correction"):
+        if ss.get("user_input"):
+            correct_text(ss["user_input"], self_correction=True, replay=True)
+        return
+    can_download, toggles = ss.get("can_download"), ss.get("toggles")
+    if can_download and ss.get("self_corrected_text") is not None:
+        ss["corrected_text"] = ss["self_corrected_text"]
+        return
+    ref = ss.get("original_upload")
+    if ref:
+        uploaded = uploaded_file_for(ref)
+        if uploaded is None:
+            st.error("The uploaded file is gone. Please upload it again.")
+            ss["original_upload"] = None
+            ss["can_download"] = ss["confirming_purchase"] = False
+            return
+        correct_paragraph_stream(iter_paragraphs(uploaded, ref["encoding"]), replay=True)
+    elif ss.get("original_input"):
+        correct_text(ss["original_input"], replay=True)
+    else:
+        return
+    # The viewer starts with every toggle unflipped; only a confirmed text keeps its flips
+    if can_download:
+        ss["can_download"] = True
+        ss["toggles"] = toggles
+        ss["corrected_text"] = apply_toggles(ss["rendered_parts"], toggles)
+
+# Write the flow state if it changed since the last checkpoint
+def checkpoint_flow_state() -> None:
+    flow = st.query_params.get("flow")
+    saved = st.session_state.get("_flow_saved")
+    if not flow or saved is None or not st.session_state.get("auth_stat"):
+        return
+    data = {key: st.session_state[key] for key in FLOW_KEYS if st.session_state.get(key) is not None}
+    # The open file's edit only needs saving while it is ahead of the database
+    file_id = data.get("current_file")
+    state = (st.session_state.get("_collab_files") or {}).get(file_id) or {}
+    edit = st.session_state.get(f"collab_edit_{file_id}")
+    if "doc" in state and edit is not None and edit != state["doc"]["text"]:
+        data["_collab"] = (file_id, dict(state["doc"]), edit)
+    if data == saved:
+        return
+    try:
+        flow_store.save(st.session_state['name'], flow, data)
+    except (psycopg2.Error, RuntimeError):
+        return
+    st.session_state["_flow_saved"] = data
+
+# Compiled blacklist shared by every session. Moderation actions in this
+# process clear it immediately; the ttl bounds staleness across processes.
+@st.cache_resource(ttl=300, show_spinner=False)
+def get_censor() -> PhraseMatcher:
+    con = get_connection()
+    cur = con.cursor()
+    try:
+        cur.execute("SELECT word FROM blacklist WHERE status = 'approved'")
+        return PhraseMatcher(r["word"] for r in cur.fetchall())
+    finally:
+        con.close()
+
+# Longer inputs are never taken for an instruction to the model
+INSTRUCTION_MAX_WORDS = 25
+
 def is_instruction_like(text: str) -> bool:
     words = text.strip().split()
-    if len(words) >= 25:
+    if len(words) >= INSTRUCTION_MAX_WORDS:
         return False
 
     pattern = (
@@ -659,33 +1697,34 @@ def submit_blacklist_word(word: str):
         return
 
     con = get_connection()
-    cur = con.cursor()
-    # Try to insert; if it already exists, no-op
-    cur.execute(
-        """
-        INSERT INTO blacklist (word, status)
-             VALUES (%s, 'pending')
-        ON CONFLICT (word) DO NOTHING
-        """,
-        (word,)
-    )
+    try:
+        cur = con.cursor()
+        # Try to insert; if it already exists, no-op
+        cur.execute(
+            """
+            INSERT INTO blacklist (word, status)
+                 VALUES (%s, 'pending')
+            ON CONFLICT (word) DO NOTHING
+            """,
+            (word,)
+        )
 
-    if cur.rowcount == 0:
-        # rowcount==0 means the INSERT was skipped due to conflict
-        st.info("This word has already been submitted.")
-    else:
-        con.commit()
-        st.success("Submitted for review.")
+        if cur.rowcount == 0:
+            # rowcount==0 means the INSERT was skipped due to conflict
+            st.info("This word has already been submitted.")
+        else:
+            con.commit()
+            st.success("Submitted for review.")
 
-    con.close()
+    finally:
+        con.close()
 
 #--- CSS Style for Corrected Text Box ---#
-def wrap_scrollable(raw_html: str, max_height: int = 300) -> str:
+def scrollable_css(max_height: int = 300) -> str:
     """
-    Wrap `raw_html` in a scrollable div with a configurable max-height.
+    Stylesheet for the `.scrollable` box with a configurable max-height.
     """
-    css = f"""
-    <style>
+    return f"""
     .scrollable {{
         background-color: #262730;
         border: 1px solid #1D751D;
@@ -712,9 +1751,26 @@ def wrap_scrollable(raw_html: str, max_height: int = 300) -> str:
         scrollbar-width: thin;
         scrollbar-color: #7B7B81 #262730;
     }}
-    </style>
     """
-    return f"{css}<div class='scrollable'>{raw_html}</div>"
+
+def wrap_scrollable(raw_html: str, max_height: int = 300) -> str:
+    """
+    Wrap `raw_html` in a scrollable div with a configurable max-height.
+    """
+    return f"<style>{scrollable_css(max_height)}</style><div class='scrollable'>{raw_html}</div>"
+
+# Split correct_text's markup into paragraphs for the viewer's chunked mode.
+# Paragraph breaks are the only top-level "<br><br>" it emits; attribute
+# values are escaped, so the split never lands inside a tag.
+def viewer_chunks(rendered_html: str) -> list[str]:
+    body = rendered_html
+    if body.startswith("<div>") and body.endswith("</div>"):
+        body = body[len("<div>"):-len("</div>")]
+    return body.split("<br><br>")
+
+# Corrected-text viewer: only the paragraphs near the viewport are mounted
+def render_viewer(rendered_html: str, height: int):
+    return html_viewer(chunks=viewer_chunks(rendered_html), css=scrollable_css(height), height=height)
 
 def create_file(owner: str, title: str) -> int:
     """
@@ -722,29 +1778,34 @@ def create_file(owner: str, title: str) -> int:
     Returns the new file_id.
     """
     con = get_connection()
-    cur = con.cursor()
-    created_ts = int(time.time())
-    # 1) Insert into file, returning its ID
-    cur.execute(
-        """
-        INSERT INTO file (owner, title, created_ts)
-             VALUES (%s,   %s,    %s)
-        RETURNING file_id
-        """,
-        (owner, title, created_ts)
-    )
-    file_id = cur.fetchone()["file_id"]
-    # 2) Add owner as collaborator
-    cur.execute(
-        """
-        INSERT INTO collaborator (file_id, client_id)
-             VALUES (%s,       %s)
-        ON CONFLICT DO NOTHING
-        """,
-        (file_id, owner)
-    )
-    con.commit()
-    con.close()
+    try:
+        cur = con.cursor()
+        created_ts = int(time.time())
+        # 1) Insert into file, returning its ID
+        cur.execute(
+            """
+            INSERT INTO file (owner, title, created_ts)
+                 VALUES (%s,   %s,    %s)
+            RETURNING file_id
+            """,
+            (owner, title, created_ts)
+        )
+        file_id = cur.fetchone()["file_id"]
+        # 2) Add owner as collaborator
+        cur.execute(
+            """
+            INSERT INTO collaborator (file_id, client_id)
+                 VALUES (%s,       %s)
+            ON CONFLICT DO NOTHING
+            """,
+            (file_id, owner)
+        )
+        publish(cur, "files", owner)
+        con.commit()
+        note_write()
+    finally:
+        con.close()
+    cached_files.clear(owner)
     return file_id
 
 def invite_user(file_id: int, inviter: str, invitee: str) -> bool:
@@ -754,63 +1815,64 @@ def invite_user(file_id: int, inviter: str, invitee: str) -> bool:
     True if the invite was created.
     """
     con = get_connection()
-    cur = con.cursor()
+    try:
+        cur = con.cursor()
 
-    # (a) ensure the invitee exists
-    cur.execute("SELECT 1 FROM account WHERE client_id = %s", (invitee,))
-    if not cur.fetchone():
-        con.close()
-        return False
+        # (a) ensure the invitee exists
+        cur.execute("SELECT 1 FROM account WHERE client_id = %s", (invitee,))
+        if not cur.fetchone():
+            return False
 
-    # (b) no duplicate invite or existing collaborator
-    cur.execute(
-        "SELECT 1 FROM collaborator WHERE file_id = %s AND client_id = %s",
-        (file_id, invitee)
-    )
-    if cur.fetchone():
-        con.close()
-        return False
+        # (b) no duplicate invite or existing collaborator
+        cur.execute(
+            "SELECT 1 FROM collaborator WHERE file_id = %s AND client_id = %s",
+            (file_id, invitee)
+        )
+        if cur.fetchone():
+            return False
 
-    cur.execute(
-        "SELECT 1 FROM invite "
-        " WHERE file_id = %s AND invitee = %s AND status = 'pending'",
-        (file_id, invitee)
-    )
-    if cur.fetchone():
-        con.close()
-        return False
+        cur.execute(
+            "SELECT 1 FROM invite "
+            " WHERE file_id = %s AND invitee = %s AND status = 'pending'",
+            (file_id, invitee)
+        )
+        if cur.fetchone():
+            return False
 
-    # (c) create the pending invite
-    req_ts = int(time.time())
-    cur.execute(
-        """
-        INSERT INTO invite (file_id, inviter, invitee, status, requested_ts)
-             VALUES (%s,      %s,       %s,      'pending', %s)
-        """,
-        (file_id, inviter, invitee, req_ts)
-    )
+        # (c) create the pending invite
+        req_ts = int(time.time())
+        cur.execute(
+            """
+            INSERT INTO invite (file_id, inviter, invitee, status, requested_ts)
+                 VALUES (%s,      %s,       %s,      'pending', %s)
+            """,
+            (file_id, inviter, invitee, req_ts)
+        )
+        publish(cur, "invites", invitee)
 
-    con.commit()
-    con.close()
+        con.commit()
+        note_write()
+    finally:
+        con.close()
+    cached_invites.clear(invitee)
     return True
 
-def list_invites_for(user: str) -> list[dict]:
+def list_invites_for(user: str, min_lsn: int | None = 0) -> list[dict]:
     """
     Returns all pending invites for `user`.
     Each dict has keys: invite_id, file_id, inviter, title, requested_ts.
     """
-    con = get_connection()
-    cur = con.cursor()
-    cur.execute("""
-      SELECT i.invite_id, i.file_id, i.inviter, f.title, i.requested_ts
-        FROM invite i
-        JOIN file f ON f.file_id = i.file_id
-       WHERE i.invitee = %s
-         AND i.status = 'pending'
-       ORDER BY i.requested_ts DESC
-    """, (user,))
-    rows = cur.fetchall()
-    con.close()
+    def query(cur):
+        cur.execute("""
+          SELECT i.invite_id, i.file_id, i.inviter, f.title, i.requested_ts
+            FROM invite i
+            JOIN file f ON f.file_id = i.file_id
+           WHERE i.invitee = %s
+             AND i.status = 'pending'
+           ORDER BY i.requested_ts DESC
+        """, (user,))
+        return cur.fetchall()
+    rows = run_read(query, min_lsn)
     out = []
     for r in rows:
         out.append({
@@ -828,76 +1890,445 @@ def respond_invite(invite_id: int, accept: bool) -> None:
     If accepted, also add to collaborator table.
     """
     con = get_connection()
-    cur = con.cursor()
-    status = "accepted" if accept else "rejected"
-
-    # 1) update invite status
-    cur.execute("UPDATE invite SET status = %s WHERE invite_id = %s", (status, invite_id))
+    try:
+        cur = con.cursor()
+        status = "accepted" if accept else "rejected"
 
-    # 2) if accepted, add to collaborators
-    if accept:
-        cur.execute("SELECT file_id, invitee FROM invite WHERE invite_id = %s", (invite_id,))
+        # 1) update invite status
+        cur.execute(
+            "UPDATE invite SET status = %s WHERE invite_id = %s RETURNING file_id, invitee",
+            (status, invite_id)
+        )
         row = cur.fetchone()
-        if row:
-            fid  = row["file_id"]
-            user = row["invitee"]
+
+        # 2) if accepted, add to collaborators
+        if accept and row:
             cur.execute(
                 """
                 INSERT INTO collaborator (file_id, client_id)
                      VALUES (%s,       %s)
                 ON CONFLICT DO NOTHING
                 """,
-                (fid, user)
+                (row["file_id"], row["invitee"])
             )
+        if row:
+            publish(cur, "invites", row["invitee"])
+            publish(cur, "files", row["invitee"])
 
-    con.commit()
-    con.close()
+        con.commit()
+        note_write()
+    finally:
+        con.close()
+    if row:
+        cached_invites.clear(row["invitee"])
+        cached_files.clear(row["invitee"])
 
-def list_files_for(user: str) -> list[dict]:
+def list_files_for(user: str, min_lsn: int | None = 0) -> list[dict]:
     """
     Returns every file the user owns or is a collaborator on.
     Each dict: file_id, title, owner, created_ts.
     """
-    con = get_connection()
-    cur = con.cursor()
-    cur.execute("""
-      SELECT f.file_id, f.title, f.owner, f.created_ts
-        FROM file f
-        JOIN collaborator c ON c.file_id = f.file_id
-       WHERE c.client_id = %s
-       ORDER BY f.created_ts DESC
-    """, (user,))
-    rows = cur.fetchall()
-    con.close()
+    def query(cur):
+        cur.execute("""
+          SELECT f.file_id, f.title, f.owner, f.created_ts
+            FROM file f
+            JOIN collaborator c ON c.file_id = f.file_id
+           WHERE c.client_id = %s
+           ORDER BY f.created_ts DESC
+        """, (user,))
+        return cur.fetchall()
+    rows = run_read(query, min_lsn)
     return [
         {"file_id": r["file_id"], "title": r["title"], "owner": r["owner"], "created_ts": r["created_ts"]}
         for r in rows
     ]
 
-def update_file_content(file_id: int, content: str) -> None:
-    """Overwrite the ‘content’ column for this file."""
-    con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        "UPDATE file SET content = %s WHERE file_id = %s",
-        (content, file_id)
-    )
-    con.commit()
-    con.close()
+def update_file_content(file_id: int, content: str, client_id: str) -> None:
+    """Save `content` as a new revision of this file (only the delta is written)."""
+    text, version = load_file_doc(file_id)
+    op = diff_op(text, content)
+    if op:
+        push_file_op(file_id, client_id, version, op)
 
 def get_file_content(file_id: int) -> str:
     """Fetch the latest content for this file, or empty string."""
+    return load_file_doc(file_id)[0]
+
+# Collaborative editing: sessions keep the text at a known version, send
+# their edits as deltas and replay everyone else's
+COLLAB_SYNC_SECONDS = 3
+COLLAB_PUSH_RETRIES = 5
+FILE_SNAPSHOT_EVERY = 100
+FILE_KEEP_REVISIONS = 1000
+COLLAB_WINDOW_CHUNKS = 40
+FILE_PAGE_CHUNKS = 64
+
+class RevisionCompacted(ValueError):
+    """The deltas after a revision are gone (see compact_file)."""
+
+def file_channel(file_id: int) -> str:
+    return f"file:{file_id}"
+
+def load_file_doc(file_id: int, version: int | None = None) -> tuple[str, int]:
+    """
+    Text of a revision (default: the head) as (text, version): the nearest
+    snapshot at or before it plus at most FILE_SNAPSHOT_EVERY deltas.
+    """
+    con = get_connection()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT content, content_version, version FROM file WHERE file_id = %s",
+            (file_id,)
+        )
+        row = cur.fetchone()
+        if not row:
+            return "", 0
+        target = row["version"] if version is None else min(version, row["version"])
+        text, base = row["content"], row["content_version"]
+        cur.execute(
+            """
+            SELECT version, snapshot FROM file_revision
+             WHERE file_id = %s AND version <= %s AND snapshot IS NOT NULL
+             ORDER BY version DESC LIMIT 1
+            """,
+            (file_id, target)
+        )
+        snap = cur.fetchone()
+        if snap and snap["version"] > base:
+            text, base = snap["snapshot"], snap["version"]
+        if target < base:
+            raise RevisionCompacted(f"Revision {target} of file {file_id} has been compacted away")
+        cur.execute(
+            """
+            SELECT delta FROM file_revision
+             WHERE file_id = %s AND version > %s AND version <= %s
+             ORDER BY version
+            """,
+            (file_id, base, target)
+        )
+        deltas = cur.fetchall()
+    finally:
+        con.close()
+    for r in deltas:
+        text = apply_op(text, load_op(r["delta"]))
+    return text, base + len(deltas)
+
+def pull_file_ops(file_id: int, since: int) -> list[list]:
+    con = get_connection()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            "SELECT version, delta FROM file_revision WHERE file_id = %s AND version > %s ORDER BY version",
+            (file_id, since)
+        )
+        rows = cur.fetchall()
+    finally:
+        con.close()
+    if rows and rows[0]["version"] != since + 1:
+        raise RevisionCompacted(f"Deltas after revision {since} of file {file_id} have been compacted away")
+    return [load_op(r["delta"]) for r in rows]
+
+def push_file_op(file_id: int, client_id: str, base: int, op: list) -> list[list]:
+    """
+    Append an edit made against revision `base`.
+    Deltas committed since then are transformed past it first, and the
+    revision is claimed with an optimistic check on file.version, retried
+    if another writer got there first. Returns every delta after `base`,
+    ending with this one as stored. Raises LookupError for a missing file
+    and RevisionCompacted when `base` is older than the kept history.
+    """
     con = get_connection()
     cur = con.cursor()
-    cur.execute(
-        "SELECT content FROM file WHERE file_id = %s",
-        (file_id,)
-    )
-    row = cur.fetchone()
-    con.close()
-    if not row:
-        return ""
-    return row["content"] if isinstance(row, dict) else row[0]
+    try:
+        for _ in range(COLLAB_PUSH_RETRIES):
+            cur.execute("SELECT version FROM file WHERE file_id = %s", (file_id,))
+            row = cur.fetchone()
+            if row is None:
+                raise LookupError(f"File {file_id} does not exist")
+            head = row["version"]
+            cur.execute(
+                """
+                SELECT delta FROM file_revision
+                 WHERE file_id = %s AND version > %s AND version <= %s
+                 ORDER BY version
+                """,
+                (file_id, base, head)
+            )
+            committed = [load_op(r["delta"]) for r in cur.fetchall()]
+            if len(committed) != head - base:
+                raise RevisionCompacted(f"Deltas after revision {base} of file {file_id} have been compacted away")
+            mine = rebase(op, committed)
+            snapshot = None
+            if (head + 1) % FILE_SNAPSHOT_EVERY == 0:
+                snapshot = apply_op(load_file_doc(file_id, head)[0], mine)
+            # One statement, so the version bump and its revision row land together
+            cur.execute(
+                """
+                WITH bump AS (
+                    UPDATE file SET version = version + 1
+                     WHERE file_id = %s AND version = %s
+                    RETURNING version
+                )
+                INSERT INTO file_revision (file_id, version, client_id, delta, snapshot, created_ts)
+                SELECT %s, version, %s, %s, %s, %s FROM bump
+                """,
+                (file_id, head, file_id, client_id, dump_op(mine), snapshot, int(time.time()))
+            )
+            if cur.rowcount == 0:
+                continue
+            publish(cur, "file_ops", file_channel(file_id))
+            con.commit()
+            note_write()
+            if snapshot is not None:
+                refresh_file_chunks(file_id, snapshot, head + 1)
+                if (head + 1) % FILE_KEEP_REVISIONS == 0:
+                    compact_file(file_id)
+            return committed + [mine]
+        raise RuntimeError(f"Could not save edit to file {file_id}: too many concurrent writers")
+    finally:
+        con.close()
+
+def compact_file(file_id: int, keep: int = FILE_KEEP_REVISIONS) -> int:
+    """
+    Drop revisions older than the newest snapshot that still leaves `keep`
+    revisions of history; that snapshot becomes the start of the history.
+    Returns the number of rows deleted.
+    """
+    con = get_connection()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            """
+            SELECT r.version FROM file_revision r
+              JOIN file f ON f.file_id = r.file_id
+             WHERE r.file_id = %s AND r.snapshot IS NOT NULL AND r.version <= f.version - %s
+             ORDER BY r.version DESC LIMIT 1
+            """,
+            (file_id, keep)
+        )
+        row = cur.fetchone()
+        deleted = 0
+        if row:
+            cur.execute(
+                "DELETE FROM file_revision WHERE file_id = %s AND version < %s",
+                (file_id, row["version"])
+            )
+            deleted = cur.rowcount
+            con.commit()
+    finally:
+        con.close()
+    return deleted
+
+def refresh_file_chunks(file_id: int, text: str, version: int) -> None:
+    """
+    Re-cut the chunk table to `text` (revision `version`), rewriting only
+    chunks that changed. Writers are serialized on the file row, and one
+    holding an older revision than the chunks already have writes nothing.
+    """
+    spans = chunk_spans(text)
+    con = get_connection()
+    cur = con.cursor()
+    # One transaction, so readers never see a half-updated index
+    cur.execute("BEGIN")
+    try:
+        cur.execute("SELECT chunk_version FROM file WHERE file_id = %s FOR UPDATE", (file_id,))
+        row = cur.fetchone()
+        if row is None or row["chunk_version"] >= version:
+            cur.execute("COMMIT")
+            return
+        cur.execute(
+            "SELECT chunk_no, char_start, content_hash FROM file_chunk WHERE file_id = %s",
+            (file_id,)
+        )
+        existing = {r["chunk_no"]: (r["char_start"], r["content_hash"]) for r in cur.fetchall()}
+        rows = []
+        for no, (start, end) in enumerate(spans):
+            chunk = text[start:end]
+            h = text_hash(chunk)
+            if existing.get(no) != (start, h):
+                rows.append((file_id, no, start, end - start, h, chunk))
+        if rows:
+            execute_values(
+                cur,
+                """
+                INSERT INTO file_chunk (file_id, chunk_no, char_start, char_len, content_hash, content)
+                VALUES %s
+                ON CONFLICT (file_id, chunk_no) DO UPDATE
+                   SET char_start = EXCLUDED.char_start, char_len = EXCLUDED.char_len,
+                       content_hash = EXCLUDED.content_hash, content = EXCLUDED.content
+                """,
+                rows
+            )
+        cur.execute(
+            "DELETE FROM file_chunk WHERE file_id = %s AND chunk_no >= %s",
+            (file_id, len(spans))
+        )
+        cur.execute("UPDATE file SET chunk_version = %s WHERE file_id = %s", (version, file_id))
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+def load_file_window(file_id: int, first: int, count: int) -> dict:
+    """
+    Chunks [first, first + count) of the head revision, as
+    {"text", "start", "end", "total", "version", "first", "chunks", "seen"}:
+    the window's text, its character range within the whole document and
+    the document's length, chunk count and revision.
+    """
+    con = get_connection()
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT chunk_version FROM file WHERE file_id = %s", (file_id,))
+        row = cur.fetchone()
+        if row and row["chunk_version"] < 0:
+            # Never chunked: cut the current text once
+            text, version = load_file_doc(file_id)
+            refresh_file_chunks(file_id, text, version)
+            cur.execute("SELECT chunk_version FROM file WHERE file_id = %s", (file_id,))
+            row = cur.fetchone()
+        base = row["chunk_version"] if row else 0
+        cur.execute(
+            """
+            SELECT COUNT(*) AS chunks, COALESCE(SUM(char_len), 0) AS total
+              FROM file_chunk WHERE file_id = %s
+            """,
+            (file_id,)
+        )
+        stats = cur.fetchone()
+        cur.execute(
+            """
+            SELECT char_start, content FROM file_chunk
+             WHERE file_id = %s AND chunk_no >= %s AND chunk_no < %s
+             ORDER BY chunk_no
+            """,
+            (file_id, first, first + count)
+        )
+        rows = cur.fetchall()
+    finally:
+        con.close()
+    total = int(stats["total"])
+    text = "".join(r["content"] for r in rows)
+    start = rows[0]["char_start"] if rows else total
+    end = start + len(text)
+    # Replay the deltas saved since the chunks were cut, seen through the window
+    try:
+        ops = pull_file_ops(file_id, base)
+    except RevisionCompacted:
+        # The chunks predate the kept history: re-cut them at the head
+        text, version = load_file_doc(file_id)
+        refresh_file_chunks(file_id, text, version)
+        return load_file_window(file_id, first, count)
+    for o in ops:
+        wop, start, end, total = window_op(o, start, end, total)
+        text = apply_op(text, wop)
+    return {"text": text, "start": start, "end": end, "total": total, "version": base + len(ops),
+            "first": first, "chunks": int(stats["chunks"]), "seen": None}
+
+def iter_file_text(file_id: int) -> Iterator[str]:
+    """Stream the head revision: chunks page by page, with newer deltas applied on the fly."""
+    con = get_connection()
+    cur = con.cursor()
+    # One snapshot for every page, even if the chunks are re-cut meanwhile
+    cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ")
+    try:
+        cur.execute("SELECT chunk_version FROM file WHERE file_id = %s", (file_id,))
+        row = cur.fetchone()
+        if not row or row["chunk_version"] < 0:
+            yield load_file_doc(file_id)[0]
+            return
+        cur.execute(
+            "SELECT delta FROM file_revision WHERE file_id = %s AND version > %s ORDER BY version",
+            (file_id, row["chunk_version"])
+        )
+        deltas = [load_op(r["delta"]) for r in cur.fetchall()]
+
+        def pages():
+            next_no = 0
+            while True:
+                cur.execute(
+                    """
+                    SELECT chunk_no, content FROM file_chunk
+                     WHERE file_id = %s AND chunk_no >= %s
+                     ORDER BY chunk_no LIMIT %s
+                    """,
+                    (file_id, next_no, FILE_PAGE_CHUNKS)
+                )
+                page = cur.fetchall()
+                if not page:
+                    return
+                for r in page:
+                    yield r["content"]
+                next_no = page[-1]["chunk_no"] + 1
+
+        stream = pages()
+        for delta in deltas:
+            stream = apply_op_stream(delta, stream)
+        yield from stream
+    finally:
+        cur.execute("COMMIT")
+        con.close()
+
+def sync_file(file_id: int, client_id: str, doc: dict, local_text: str) -> bool:
+    """
+    Push the session's edit to its window (if any) and pull other
+    collaborators' deltas into doc (see load_file_window). Returns True when
+    the merged window differs from local_text, i.e. the editor must be refreshed.
+    A session too far behind to replay (see compact_file) gets the window
+    reloaded; an edit it could not push is left in doc["unmerged"].
+    """
+    hub = get_notifications()
+    wop = diff_op(doc["text"], local_text)
+    try:
+        if wop:
+            op = widen_op(wop, doc["start"], doc["end"], doc["total"])
+            ops = push_file_op(file_id, client_id, doc["version"], op)
+        else:
+            # Nothing typed: only read the log when a NOTIFY said it moved
+            seen = hub.version(file_channel(file_id))
+            if hub.healthy and seen == doc.get("seen"):
+                return False
+            doc["seen"] = seen
+            ops = pull_file_ops(file_id, doc["version"])
+    except RevisionCompacted:
+        doc.update(load_file_window(file_id, doc["first"], COLLAB_WINDOW_CHUNKS))
+        if wop:
+            doc["unmerged"] = local_text
+        return True
+    if not ops:
+        return False
+    text, start, end, total = doc["text"], doc["start"], doc["end"], doc["total"]
+    for o in ops:
+        wop, start, end, total = window_op(o, start, end, total)
+        text = apply_op(text, wop)
+    doc.update(text=text, start=start, end=end, total=total, version=doc["version"] + len(ops))
+    return text != local_text
+
+def file_changed(file_id: int, doc: dict) -> bool:
+    """
+    Whether collaborators committed deltas past doc's version, without
+    pulling them (sync_file does that). Reads the file row only after a
+    NOTIFY on the file's channel, or every call while the listener is down.
+    """
+    hub = get_notifications()
+    seen = hub.version(file_channel(file_id))
+    if hub.healthy and seen == doc.get("seen"):
+        return False
+    con = get_connection()
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT version FROM file WHERE file_id = %s", (file_id,))
+        row = cur.fetchone()
+    finally:
+        con.close()
+    if row is None or row["version"] <= doc["version"]:
+        # Our own push, or already merged
+        doc["seen"] = seen
+        return False
+    return True
 
 def submit_complaint(file_id: int, complainant: str, complained: str, description: str) -> bool:
     con = get_connection()
@@ -927,7 +2358,9 @@ def submit_complaint(file_id: int, complainant: str, complained: str, descriptio
             """,
             (file_id, complainant, complained, description, int(time.time()))
         )
+        publish(cur, "complaints", complained)
         con.commit()
+        note_write()
         return True
     except psycopg2.IntegrityError:
         return False
@@ -936,19 +2369,21 @@ def submit_complaint(file_id: int, complainant: str, complained: str, descriptio
 
 def get_complaint_paid(client_id: str) -> list[dict]:
     con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        """
-        SELECT c.complaint_id, c.file_id, c.complainant, c.description, c.created_ts, f.title
-        FROM complaint c
-        JOIN file f ON c.file_id = f.file_id
-        WHERE c.complained = %s AND c.status = 'pending'
-        ORDER BY c.created_ts DESC
-        """,
-        (client_id,)
-    )
-    rows = cur.fetchall()
-    con.close()
+    try:
+        cur = con.cursor()
+        cur.execute(
+            """
+            SELECT c.complaint_id, c.file_id, c.complainant, c.description, c.created_ts, f.title
+            FROM complaint c
+            JOIN file f ON c.file_id = f.file_id
+            WHERE c.complained = %s AND c.status = 'pending'
+            ORDER BY c.created_ts DESC
+            """,
+            (client_id,)
+        )
+        rows = cur.fetchall()
+    finally:
+        con.close()
     return [
         {
             "complaint_id": r["complaint_id"],
@@ -972,7 +2407,9 @@ def submit_complaint_response(complaint_id: int, client_id: str, response: str)
             """,
             (complaint_id, client_id, response, int(time.time()))
         )
+        publish(cur, "complaints", client_id)
         con.commit()
+        note_write()
         return True
     except psycopg2.IntegrityError:
         return False
@@ -980,52 +2417,68 @@ def submit_complaint_response(complaint_id: int, client_id: str, response: str)
         con.close()
 
 def get_complaint_super() -> list[dict]:
-    con = get_connection()
-    cur = con.cursor()
-    cur.execute(
-        """
-        SELECT c.complaint_id, c.file_id, c.complainant, c.complained, c.description, c.created_ts, f.title
-        FROM complaint c
-        JOIN file f ON c.file_id = f.file_id
-        WHERE c.status = 'pending'
-        ORDER BY c.created_ts DESC
-        """,
-    )
-    complaints = cur.fetchall()
-    out = []
-    for c in complaints:
-        # Fetch responses
+    def query(cur):
         cur.execute(
             """
-            SELECT client_id, response, created_ts
-            FROM complaint_response
-            WHERE complaint_id = %s
-            ORDER BY created_ts DESC
+            SELECT c.complaint_id, c.file_id, c.complainant, c.complained, c.description, c.created_ts, f.title
+            FROM complaint c
+            JOIN file f ON c.file_id = f.file_id
+            WHERE c.status = 'pending'
+            ORDER BY c.created_ts DESC
             """,
-            (c["complaint_id"],)
         )
-        responses = cur.fetchall()
-        out.append({
-            "complaint_id": c["complaint_id"],
-            "file_id": c["file_id"],
-            "complainant": c["complainant"],
-            "complained": c["complained"],
-            "description": c["description"],
-            "created_ts": c["created_ts"],
-            "title": c["title"],
-            "responses": [
-                {"client_id": r["client_id"], "response": r["response"], "created_ts": r["created_ts"]}
-                for r in responses
-            ]
-        })
-    con.close()
-    return out
+        complaints = cur.fetchall()
+        out = []
+        for c in complaints:
+            # Fetch responses
+            cur.execute(
+                """
+                SELECT client_id, response, created_ts
+                FROM complaint_response
+                WHERE complaint_id = %s
+                ORDER BY created_ts DESC
+                """,
+                (c["complaint_id"],)
+            )
+            responses = cur.fetchall()
+            out.append({
+                "complaint_id": c["complaint_id"],
+                "file_id": c["file_id"],
+                "complainant": c["complainant"],
+                "complained": c["complained"],
+                "description": c["description"],
+                "created_ts": c["created_ts"],
+                "title": c["title"],
+                "responses": [
+                    {"client_id": r["client_id"], "response": r["response"], "created_ts": r["created_ts"]}
+                    for r in responses
+                ]
+            })
+        return out
+    return run_read(query)
+
+# Censor log for the super-user logs page, newest first
+def list_censor_log() -> list[dict]:
+    def query(cur):
+        cur.execute(
+            "SELECT client_id AS user, original_word, event_ts "
+            "FROM censor_log "
+            "ORDER BY event_ts DESC"
+        )
+        return cur.fetchall()
+    return run_read(query)
 
 def handle_complaint():
     if st.session_state['type'] not in ('P', 'S'):
         st.session_state['complaints_checked'] = True
         return
-    complaints = get_complaint_paid(st.session_state['name'])
+    # Pushed state is current, so it is checked on every render; without the
+    # listener, query until the first clean check as before
+    complaints = notified_complaints(st.session_state['name'])
+    if complaints is None:
+        if st.session_state['complaints_checked']:
+            return
+        complaints = get_complaint_paid(st.session_state['name'])
     if not complaints:
         st.session_state['complaints_checked'] = True
         return
@@ -1089,7 +2542,9 @@ def resolve_complaint(complaint_id: int, complainant_penalty: int, complained_pe
             """,
             (complaint_id,)
         )
+        publish(cur, "complaints", complained)
         con.commit()
+        note_write()
         return True, "Complaint resolved successfully"
     except Exception as e:
         return False, str(e)